@@ -0,0 +1,133 @@
+"""
+Benchmarks firenzecard.add_features against the previous feature extraction
+on synthetic FirenzeCard logs, reporting wall time and DataFrame memory.
+
+Run from the repository root:
+
+    python dev/benchmarks/firenzecard_features_benchmark.py --rows 400000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'utils', 'database'))
+
+from features import firenzecard
+
+
+def make_logs(rows, museums=72, seed=0):
+    """
+    Makes synthetic FirenzeCard logs already merged with the museum locations,
+    as passed to add_features.
+
+    Args:
+        rows (int): number of museum entries
+        museums (int): number of museums
+        seed (int): random seed
+
+    Returns:
+        Pandas.DataFrame: the synthetic logs
+    """
+
+    rng = np.random.RandomState(seed)
+    cards = rows // 5
+
+    start = np.datetime64('2016-06-01T08:00')
+    # Distinct entry times, so both versions order the entries the same way
+    seconds = rng.permutation(122 * 24 * 60 * 60)[:rows].astype('timedelta64[s]')
+
+    return pd.DataFrame({
+        'museum_id': rng.randint(1, museums + 1, size=rows),
+        'museum_name': 'Museum',
+        'user_id': rng.randint(0, cards, size=rows),
+        'entry_time': (start + seconds).astype(str),
+        'total_adults': rng.randint(0, 2, size=rows),
+        'minors': rng.randint(0, 2, size=rows),
+        'latitude': 43.77,
+        'longitude': 11.25
+    })
+
+
+def legacy_features(df):
+    """
+    The feature extraction of extract_features before add_features, kept here
+    as the reference for the benchmark.
+    """
+
+    df['entry_time'] = pd.to_datetime(df['entry_time'])
+    df['time'] = pd.to_datetime(df['entry_time']).dt.time
+    df['date'] = pd.to_datetime(df['entry_time']).dt.date
+    df['hour'] = pd.to_datetime(df['entry_time']).dt.hour
+    df['day_of_week'] = df['entry_time'].dt.dayofweek
+
+    df = df.sort_values('entry_time', ascending=True)
+    df['total_people'] = df['total_adults'] + df['minors']
+
+    df['time_since_previous_museum'] = df.groupby('user_id')['entry_time'].diff()
+    df['time_since_previous_museum'] = df['time_since_previous_museum'].apply(
+        lambda x: pd.Timedelta(x) / pd.Timedelta('1 hour'))
+
+    df = df.sort_values('entry_time', ascending=True)
+    df['total_duration_card_use'] = df[df.user_id.notnull()].groupby(
+        'user_id')['entry_time'].transform(lambda x: x.iat[-1] - x.iat[0])
+    df['total_duration_card_use'] = df['total_duration_card_use'].apply(
+        lambda x: pd.Timedelta(x) / pd.Timedelta('1 hour'))
+
+    df['entry_is_adult'] = np.where(df['total_adults'] == 1, 1, 0)
+    df['is_card_with_minors'] = np.where(df['minors'] == 1, 1, 0)
+
+    entrances_per_card_per_museum = pd.DataFrame(df.groupby('user_id', as_index=True)['museum_id'].
+                                                 value_counts().rename('entrances_per_card_per_museum'))
+
+    df = pd.merge(entrances_per_card_per_museum.reset_index(), df, on=['user_id', 'museum_id'], how='inner')
+
+    for n in range(1, df['museum_id'].nunique()):
+        df['is_in_museum_' + str(n)] = np.where(df['museum_id'] == n, 1, 0)
+
+    return df
+
+
+def measure(function, logs):
+    start = time.time()
+    df = function(logs.copy())
+    elapsed = time.time() - start
+
+    return df, elapsed, df.memory_usage(index=True, deep=True).sum() / 1e6
+
+
+def main(rows):
+    logs = make_logs(rows)
+    print('Entries: %d, cards: %d' % (len(logs), logs['user_id'].nunique()))
+
+    legacy, legacy_time, legacy_mb = measure(legacy_features, logs)
+    print('legacy:       %7.2fs %9.1f MB' % (legacy_time, legacy_mb))
+
+    new, new_time, new_mb = measure(firenzecard.add_features, logs)
+    print('add_features: %7.2fs %9.1f MB (%.1fx faster, %.1fx smaller)'
+          % (new_time, new_mb, legacy_time / new_time, legacy_mb / new_mb))
+
+    key = ['user_id', 'entry_time', 'museum_id']
+    columns = ['time_since_previous_museum', 'total_duration_card_use',
+               'entrances_per_card_per_museum']
+    legacy = legacy.sort_values(key, kind='mergesort').reset_index(drop=True)
+    new = new.sort_values(key, kind='mergesort').reset_index(drop=True)
+
+    for column in columns:
+        assert np.allclose(legacy[column], new[column], equal_nan=True), column
+
+    print('Features match on %s' % ', '.join(columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=400000)
+    args = parser.parse_args()
+
+    main(args.rows)
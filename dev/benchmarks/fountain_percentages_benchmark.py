@@ -0,0 +1,102 @@
+"""
+Benchmarks fountain_deck_gl.create_percentage_columns against the previous
+two groupby-apply passes of create_percentage_column on a synthetic tower
+graph, and checks that both give the same percentages.
+
+Run from the repository root, with the requirements installed and
+src/utils/database/dbcreds.py in place as fountain_deck_gl imports dbutils:
+
+    python dev/benchmarks/fountain_percentages_benchmark.py --edges 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'utils', 'database'))
+
+import fountain_deck_gl
+
+
+def make_edges(edges, towers=19869, seed=0):
+    """
+    Makes a synthetic tower transition graph with distinct (from, to) pairs,
+    shaped like the edges from cdr_fountain.get_network_edges.
+
+    Args:
+        edges (int): approximate number of edges
+        towers (int): number of towers
+        seed (int): random seed
+
+    Returns:
+        Pandas.DataFrame: to, from and weight columns
+    """
+
+    rng = np.random.RandomState(seed)
+    pairs = np.unique(rng.randint(0, towers ** 2, size=edges))
+
+    return pd.DataFrame({'to': pairs % towers,
+                         'from': pairs // towers,
+                         'weight': rng.randint(1, 100, size=len(pairs))})
+
+
+def legacy_percentage_column(df, perc_col_name, weight_col_name, group_names):
+    """
+    create_percentage_column before create_percentage_columns, kept here as
+    the reference for the benchmark. The per group float() is dropped so that
+    it runs on current pandas, the result is the same.
+    """
+
+    df[perc_col_name] = df[weight_col_name]
+    group_sum = df.groupby(group_names).agg({perc_col_name: 'sum'})
+
+    group_perc = group_sum.groupby(level=0, group_keys=False) \
+        .apply(lambda x: 100 * x / x.sum())
+
+    return group_perc.reset_index()
+
+
+def legacy_percentages(edges):
+    group_perc = legacy_percentage_column(edges, 'perc_to', 'weight',
+                                          ['to', 'from', 'weight'])
+    return legacy_percentage_column(group_perc, 'perc_from', 'weight',
+                                    ['from', 'to', 'weight', 'perc_to'])
+
+
+def main(n_edges):
+    edges = make_edges(n_edges)
+    print('Edges: %d' % len(edges))
+
+    start = time.time()
+    legacy = legacy_percentages(edges.copy())
+    legacy_time = time.time() - start
+    print('legacy:                    %7.2fs' % legacy_time)
+
+    start = time.time()
+    new = fountain_deck_gl.create_percentage_columns(edges)
+    new_time = time.time() - start
+    print('create_percentage_columns: %7.2fs (%.0fx faster)'
+          % (new_time, legacy_time / new_time))
+
+    key = ['from', 'to']
+    legacy = legacy.sort_values(key).reset_index(drop=True)
+    new = new.sort_values(key).reset_index(drop=True)
+
+    for column in ['perc_to', 'perc_from']:
+        assert np.allclose(legacy[column], new[column]), column
+
+    print('Percentages match')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--edges', type=int, default=1000000)
+    args = parser.parse_args()
+
+    main(args.edges)
@@ -0,0 +1,192 @@
+"""
+Benchmarks trip_segmenter.segment_trips against the previous pandas
+implementation of get_trips on synthetic daily call counts, and checks that
+both give the same trip labels.
+
+Run from the repository root:
+
+    python dev/benchmarks/trip_segmenter_benchmark.py --rows 10000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src', 'utils', 'database'))
+
+from src.features import trip_segmenter as ts
+
+
+def make_counts(rows, seed=0):
+    """
+    Makes synthetic daily call counts shaped like the output of
+    get_daily_call_counts, sorted by customer and date.
+
+    Args:
+        rows (int): approximate number of rows to generate
+        seed (int): random seed
+
+    Returns:
+        Pandas.DataFrame: the synthetic counts
+    """
+
+    rng = np.random.RandomState(seed)
+
+    days_per_cust = rng.geometric(1 / 12., size=rows // 6 + 1)
+    days_per_cust = days_per_cust[np.cumsum(days_per_cust) <= rows]
+    n = days_per_cust.sum()
+
+    cust_ids = np.repeat(np.arange(len(days_per_cust)), days_per_cust)
+    first_row = np.ones(n, dtype=bool)
+    first_row[1:] = cust_ids[1:] != cust_ids[:-1]
+
+    # Gaps of 1 to 8 days between days with calls, restarting per customer
+    steps = rng.randint(1, 9, size=n)
+    steps[first_row] = rng.randint(0, 30, size=first_row.sum())
+    offsets = np.cumsum(steps)
+    offsets -= np.repeat(offsets[first_row] - steps[first_row], days_per_cust)
+    dates = np.datetime64('2016-06-01') + offsets.astype('timedelta64[D]')
+
+    calls = rng.randint(1, 20, size=n)
+    calls_in_florence = np.where(rng.rand(n) < 0.4,
+                                 rng.randint(0, 5, size=n), 0)
+    calls_near_airport = np.where(rng.rand(n) < 0.05, 1, 0)
+
+    date_diff = np.zeros(n)
+    date_diff[1:] = (offsets[1:] - offsets[:-1]) - 1
+    date_diff[first_row] = np.nan
+
+    return pd.DataFrame({
+        'cust_id': cust_ids,
+        'same_cust': ~first_row,
+        'date': dates,
+        'date_diff': date_diff,
+        'calls': calls + calls_in_florence,
+        'calls_in_florence': calls_in_florence,
+        'calls_near_airport': calls_near_airport
+    }, columns=ts.DAILY_CALL_COUNT_COLUMNS)
+
+
+def legacy_get_trips(counts, only_start=False, gap_length=3):
+    """
+    The pandas implementation of get_trips before segment_trips, kept here as
+    the reference for the benchmark.
+    """
+
+    counts.iloc[0, 1] = False
+
+    same_cust_false = counts['same_cust'] == False
+    same_cust_true = ~same_cust_false
+
+    counts.loc[same_cust_false, 'date_diff'] = None
+    gap_threshold = counts['date_diff'] < gap_length
+
+    counts['in_florence'] = (counts['calls_in_florence'] > 0) | \
+                            (counts['calls_near_airport'] > 0)
+
+    in_florence_true = counts['in_florence'] == True
+
+    counts['calls_out_florence'] = counts['calls'] - counts['calls_in_florence']
+    counts['out_florence'] = counts['calls_out_florence'] > 0
+
+    counts['was_in_florence'] = counts['in_florence'].shift(1)
+    counts['willbe_in_florence'] = counts['in_florence'].shift(-1)
+    counts.loc[same_cust_false, 'was_in_florence'] = None
+
+    was_in_florence_true = counts['was_in_florence'] == True
+    was_in_florence_false = ~was_in_florence_true
+    willbe_in_florence_true = counts['willbe_in_florence'] == True
+    willbe_in_florence_false = ~willbe_in_florence_true
+
+    counts['was_out_florence'] = counts['out_florence'].shift(1)
+    counts['willbe_out_florence'] = counts['out_florence'].shift(-1)
+    counts.loc[same_cust_false, 'was_out_florence'] = None
+
+    counts['trip'] = ''
+
+    counts.loc[same_cust_false & in_florence_true, 'trip'] = 'first'
+
+    if not only_start:
+        counts.loc[same_cust_true &
+                   (counts['same_cust'].shift(-1) == False) &
+                   in_florence_true, 'trip'] = 'last'
+
+    counts.loc[same_cust_true & gap_threshold & was_in_florence_true &
+               in_florence_true, 'trip'] = 'continue'
+
+    if not only_start:
+        counts.loc[same_cust_true & gap_threshold & was_in_florence_true &
+                   in_florence_true & willbe_in_florence_false,
+                   'trip'] = 'end'
+
+    counts.loc[same_cust_true & gap_threshold & was_in_florence_false &
+               in_florence_true, 'trip'] = 'start'
+
+    counts['on_trip'] = counts['trip'] != ''
+
+    trips = counts[['cust_id', 'same_cust', 'date', 'date_diff',
+                    'calls_in_florence', 'calls_out_florence', 'trip',
+                    'on_trip']].copy()
+
+    num = ((trips['on_trip'].shift(1) != trips['on_trip']).astype(int).cumsum())
+    trips['trip_id'] = num * (trips['on_trip']).astype(int)
+
+    trips_group = trips[trips['trip_id'] != 0][['cust_id', 'trip_id']]
+    trips_group = trips_group.groupby(['cust_id', 'trip_id']).size().to_frame()
+
+    return counts, trips_group
+
+
+def main(rows, only_start):
+    counts = make_counts(rows)
+    print('Rows: %d, customers: %d' % (len(counts), counts['cust_id'].nunique()))
+
+    legacy_counts = counts.copy()
+    start = time.time()
+    legacy_counts, legacy_group = legacy_get_trips(legacy_counts,
+                                                   only_start=only_start)
+    legacy_time = time.time() - start
+    print('legacy get_trips:  %.2fs' % legacy_time)
+
+    start = time.time()
+    codes, trip_ids, trips = ts.segment_trips(
+        counts['cust_id'].values, counts['date'].values,
+        counts['calls_in_florence'].values, counts['calls_near_airport'].values,
+        only_start=only_start)
+    engine_time = time.time() - start
+    print('segment_trips:     %.2fs (%.1fx)' % (engine_time,
+                                               legacy_time / engine_time))
+
+    labels = np.array(ts.TRIP_LABELS, dtype=object)[codes]
+    legacy_labels = legacy_counts['trip'].values.astype(object)
+
+    # The legacy version compares the last day of a customer with the first
+    # day of the next one ('end' and 'last' leak across the boundary), the
+    # engine does not. Every other row must match exactly.
+    _, last_row = ts.get_customer_boundaries(counts['cust_id'].values)
+    differ = labels != legacy_labels
+
+    print('Label mismatches on interior rows: %d' % (differ & ~last_row).sum())
+    print('Label mismatches on last row of a customer: %d'
+          % (differ & last_row).sum())
+
+    assert not (differ & ~last_row).any()
+
+    legacy_lengths = np.sort(legacy_group[0].values)
+    lengths = np.sort(trips['length'].values)
+    print('Trips: legacy %d, engine %d' % (len(legacy_lengths), len(lengths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--only-start', action='store_true')
+    args = parser.parse_args()
+
+    main(args.rows, args.only_start)
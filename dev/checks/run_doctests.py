@@ -0,0 +1,44 @@
+"""
+Runs the examples in the docstrings of the given modules as doctests, and
+exits with an error if any of them fails. The examples pin expected outputs,
+such as the normalised tower densities of
+fountain_deck_gl.format_cdr_properties.
+
+Run from the repository root:
+
+    python dev/checks/run_doctests.py fountain_deck_gl
+"""
+
+import argparse
+import doctest
+import importlib
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'utils', 'database'))
+
+DOCTEST_MODULES = ['fountain_deck_gl']
+
+
+def main(module_names):
+    failed = 0
+
+    for name in module_names:
+        module = importlib.import_module(name)
+        result = doctest.testmod(module)
+
+        print('%s: %d examples, %d failed' % (name, result.attempted,
+                                              result.failed))
+        failed += result.failed
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=DOCTEST_MODULES)
+    args = parser.parse_args()
+
+    sys.exit(main(args.modules))
@@ -1,9 +1,10 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import trip_segmenter as ts
+from ..utils.database import query_cache
 
 
-def get_airport_arrivals(db_connection, csv_path=''):
+def get_airport_arrivals(db_connection, csv_path='', use_cache=True):
     """
     Gets airport arrival data from the database and optionally saves this data
     to CSV
@@ -11,16 +12,18 @@ def get_airport_arrivals(db_connection, csv_path=''):
     Args:
         db_connection (Psycopg.connection): The database connection
         csv_path (string): file path for where to save CSV data to
+        use_cache (bool): whether to read through the local query cache
 
     Returns:
         Pandas.DataFrame: the DataFrame containing the number of passengers
             arriving per day at the Florence airport.
     """
 
-    arrivals_data = pd.read_sql("""
+    arrivals_data = query_cache.read_sql_cached("""
         SELECT "day", SUM(total_passengers) AS passengers
         FROM optourism.florence_airport_arrivals GROUP BY "day"
-        """, con=db_connection)
+        """, db_connection, ['optourism.florence_airport_arrivals'],
+        dtypes={'day': 'datetime64[ns]'}, use_cache=use_cache)
 
     if csv_path:
         arrivals_data.to_csv(csv_path)
@@ -0,0 +1,341 @@
+import numpy as np
+import pandas as pd
+
+
+CORRELATION_METHODS = ('pearson', 'spearman', 'kendall')
+
+# Upper bound on the size in bytes of the pairwise sign blocks used for
+# Kendall correlations
+SIGN_BLOCK_BYTES = 64 * 1024 ** 2
+
+
+def rank_columns(matrix):
+    """
+    Ranks every column of a matrix, giving tied values their average rank, as
+    in pandas and scipy.stats.rankdata.
+
+    Args:
+        matrix (numpy.ndarray): observations in rows, variables in columns
+
+    Returns:
+        numpy.ndarray: the float64 ranks, starting at 1
+    """
+
+    return pd.DataFrame(matrix).rank(method='average').values
+
+
+def get_sign_concordance(rows, other_rows=None):
+    """
+    Sums the products of the signs of the pairwise differences between
+    observations: entry (i, j) is the sum over pairs (a, b) of
+    sign(x[a, i] - y[b, i]) * sign(x[a, j] - y[b, j]). Off the diagonal this
+    is the number of concordant minus discordant pairs of Kendall's tau, on
+    the diagonal the number of pairs not tied in that variable. The pairs are
+    processed in blocks of rows to bound memory.
+
+    Args:
+        rows (numpy.ndarray): observations in rows, variables in columns
+        other_rows (numpy.ndarray): observations of the same variables to pair
+            every row with, if None each pair of distinct rows is used once
+
+    Returns:
+        numpy.ndarray: the variables x variables sums, as float64
+    """
+
+    within = other_rows is None
+    if within:
+        other_rows = rows
+
+    n_other, n_columns = other_rows.shape
+    block_size = max(1, SIGN_BLOCK_BYTES // (8 * max(1, n_other * n_columns)))
+    concordance = np.zeros((n_columns, n_columns))
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+
+        # Within one set of rows only the pairs from the block onwards are
+        # new, the pairs inside the block are seen in both orders
+        others = other_rows[start:] if within else other_rows
+        signs = np.sign(block[:, None, :] - others[None, :, :])
+        signs = signs.reshape(-1, n_columns)
+        concordance += signs.T.dot(signs)
+
+        if within:
+            signs = np.sign(block[:, None, :] - block[None, :, :])
+            signs = signs.reshape(-1, n_columns)
+            concordance -= signs.T.dot(signs) / 2
+
+    return concordance
+
+
+def scale_covariance(covariance):
+    """
+    Turns a covariance-like matrix into correlations by dividing each entry by
+    the square root of the product of the two matching diagonal entries.
+    Variables with a zero diagonal entry get NaN correlations.
+
+    Args:
+        covariance (numpy.ndarray): square matrix
+
+    Returns:
+        numpy.ndarray: the correlation matrix
+    """
+
+    scale = np.sqrt(np.diag(covariance))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.outer(scale, scale)
+
+    return np.clip(correlation, -1, 1)
+
+
+def get_threshold_pairs(correlation, columns, above_threshold,
+                        below_threshold):
+    """
+    Lists the pairs of distinct variables whose correlation is above or below
+    the thresholds. Both orders of a pair are listed and NaN correlations are
+    never selected.
+
+    Args:
+        correlation (numpy.ndarray): the square correlation matrix
+        columns (list): the variable labels
+        above_threshold (float): pairs above this are returned as high
+        below_threshold (float): pairs below this are returned as inverse
+
+    Returns:
+        tuple: the high and the inverse pairs, as DataFrames with column_1,
+            column_2 and value columns
+    """
+
+    columns = np.asarray(columns)
+    off_diagonal = ~np.eye(len(columns), dtype=bool)
+
+    with np.errstate(invalid='ignore'):
+        masks = (off_diagonal & (correlation > above_threshold),
+                 off_diagonal & (correlation < below_threshold))
+
+    pairs = []
+    for mask in masks:
+        i, j = np.nonzero(mask)
+        pairs.append(pd.DataFrame({'column_1': columns[i],
+                                   'column_2': columns[j],
+                                   'value': correlation[i, j]},
+                                  columns=['column_1', 'column_2', 'value']))
+
+    return tuple(pairs)
+
+
+def get_window_starts(n_rows, window, step=1):
+    """
+    Gets the first row of every full window of a rolling computation.
+
+    Args:
+        n_rows (int): number of observations
+        window (int): number of observations in a window
+        step (int): number of observations between window starts
+
+    Returns:
+        numpy.ndarray: the start rows, empty if the window is longer than the
+            observations
+    """
+
+    if window < 2 or step < 1:
+        raise ValueError('Windows need at least 2 rows and a step of 1 or '
+                         'more, got window=%d, step=%d' % (window, step))
+
+    return np.arange(0, n_rows - window + 1, step)
+
+
+def get_rolling_correlation(matrix, window, step=1, pairs=None):
+    """
+    Computes Pearson correlations between pairs of columns over sliding
+    windows of rows, for example over 7 day windows stepped daily on hourly
+    museum entries (window=168, step=24). The rows are cut into segments at
+    every window start and end, and the sums and cross products of each
+    segment are accumulated into running sums. A window's sums are the
+    difference of two running sums, so each step costs O(1) per pair however
+    long the window is.
+
+    Args:
+        matrix (numpy.ndarray): observations in rows, variables in columns
+        window (int): number of rows in a window
+        step (int): number of rows between window starts
+        pairs (tuple): arrays (i, j) of the column pairs to correlate, every
+            pair i < j if None
+
+    Returns:
+        tuple: the (windows x pairs) correlation array, the window start rows
+            and the (i, j) pair arrays. Pairs with a column that is constant
+            in a window have NaN correlations
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n_rows, n_columns = matrix.shape
+
+    if pairs is None:
+        pairs = np.triu_indices(n_columns, k=1)
+    first, second = (np.asarray(p) for p in pairs)
+
+    starts = get_window_starts(n_rows, window, step)
+    if len(starts) == 0:
+        return np.empty((0, len(first))), starts, (first, second)
+
+    # Centering keeps the running sums small, which limits cancellation when
+    # two of them are subtracted
+    centered = matrix - matrix.mean(axis=0)
+
+    boundaries = np.union1d(starts, starts + window)
+    n_segments = len(boundaries) - 1
+
+    sums = np.zeros((n_segments + 1, n_columns))
+    squares = np.zeros((n_segments + 1, n_columns))
+    products = np.zeros((n_segments + 1, len(first)))
+
+    for k in range(n_segments):
+        segment = centered[boundaries[k]:boundaries[k + 1]]
+        cross = segment.T.dot(segment)
+
+        sums[k + 1] = sums[k] + segment.sum(axis=0)
+        squares[k + 1] = squares[k] + np.diag(cross)
+        products[k + 1] = products[k] + cross[first, second]
+
+    start_segments = np.searchsorted(boundaries, starts)
+    end_segments = np.searchsorted(boundaries, starts + window)
+
+    def window_sums(running):
+        return running[end_segments] - running[start_segments]
+
+    window_total = window_sums(sums)
+    variances = window_sums(squares) - window_total ** 2 / window
+    covariance = window_sums(products) - \
+        window_total[:, first] * window_total[:, second] / window
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.sqrt(variances[:, first] *
+                                           variances[:, second])
+
+    # Rounding can leave tiny variances in windows where a column is constant
+    scale = np.maximum(1, (centered ** 2).max(axis=0))
+    constant = variances <= 1e-12 * window * scale
+    correlation[constant[:, first] | constant[:, second]] = np.nan
+
+    return np.clip(correlation, -1, 1), starts, (first, second)
+
+
+class CorrelationEngine(object):
+    """
+    Pairwise correlations between the columns of a matrix of observations,
+    such as the museum x time matrix of entries, that can be extended with new
+    observations. Pearson correlations keep running sums, so appending rows
+    costs O(rows * columns^2). Kendall correlations keep the pairwise sign
+    concordance, so appending rows only compares the new rows with the old
+    ones instead of recomputing every pair. Spearman correlations rank the
+    columns again when the correlations are read.
+    """
+
+    def __init__(self, columns, method='pearson'):
+        if method not in CORRELATION_METHODS:
+            raise ValueError('Unknown correlation method %r, use one of %s'
+                             % (method, ', '.join(CORRELATION_METHODS)))
+
+        self.columns = list(columns)
+        self.method = method
+        self.count = 0
+
+        n_columns = len(self.columns)
+        self.shift = None
+        self.sums = np.zeros(n_columns)
+        self.products = np.zeros((n_columns, n_columns))
+        self.concordance = np.zeros((n_columns, n_columns))
+        self.rows = np.empty((0, n_columns))
+
+    def append(self, rows):
+        """
+        Adds observations, for example the hourly entries of a new day.
+
+        Args:
+            rows (numpy.ndarray): observations in rows, one column per
+                variable in the order of self.columns
+
+        Returns:
+            CorrelationEngine: self
+        """
+
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim != 2 or rows.shape[1] != len(self.columns):
+            raise ValueError('Expected rows with %d columns, got shape %s'
+                             % (len(self.columns), rows.shape))
+
+        if len(rows) == 0:
+            return self
+
+        if self.method == 'pearson':
+            # Sums are taken around the first observations' means, which
+            # keeps the running sums small and the variances accurate
+            if self.shift is None:
+                self.shift = rows.mean(axis=0)
+
+            centered = rows - self.shift
+            self.sums += centered.sum(axis=0)
+            self.products += centered.T.dot(centered)
+
+        elif self.method == 'kendall':
+            self.concordance += get_sign_concordance(rows, self.rows)
+            self.concordance += get_sign_concordance(rows)
+
+        if self.method != 'pearson':
+            self.rows = np.vstack([self.rows, rows])
+
+        self.count += len(rows)
+
+        return self
+
+    def get_correlation(self):
+        """
+        Computes the correlation matrix of the observations so far. Variables
+        that are constant have NaN correlations.
+
+        Returns:
+            numpy.ndarray: the columns x columns correlation matrix
+        """
+
+        if self.method == 'pearson':
+            if self.count == 0:
+                return np.full(self.products.shape, np.nan)
+
+            covariance = self.products - np.outer(self.sums, self.sums) \
+                / self.count
+            return scale_covariance(covariance)
+
+        if self.method == 'kendall':
+            return scale_covariance(self.concordance)
+
+        ranks = rank_columns(self.rows)
+        ranks = ranks - ranks.mean(axis=0)
+
+        return scale_covariance(ranks.T.dot(ranks))
+
+    def to_frame(self):
+        """
+        Returns:
+            pandas.DataFrame: the correlation matrix labelled with the columns
+        """
+
+        return pd.DataFrame(self.get_correlation(), index=self.columns,
+                            columns=self.columns)
+
+    def get_threshold_pairs(self, above_threshold, below_threshold):
+        """
+        Lists the pairs of columns with a correlation above or below the
+        thresholds, see get_threshold_pairs.
+
+        Args:
+            above_threshold (float): pairs above this are returned as high
+            below_threshold (float): pairs below this are returned as inverse
+
+        Returns:
+            tuple: the high and the inverse pairs DataFrames
+        """
+
+        return get_threshold_pairs(self.get_correlation(), self.columns,
+                                   above_threshold, below_threshold)
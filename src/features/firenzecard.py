@@ -10,20 +10,26 @@
 import sys
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import plotly
 from plotly.graph_objs import *
 import plotly.plotly as py
 import plotly.graph_objs as go
 sys.path.append('../src/')
+from utils.database import dbutils, query_cache
+from features.correlation import CorrelationEngine, get_rolling_correlation
 #from IPython.core.debugger import Tracer
 
-def get_national_museums(db_connection, export_to_csv, export_path):
+def get_national_museums(db_connection, export_to_csv, export_path, use_cache=True):
 
     """
-    Get national museum data from DB
+    Get national museum data from DB, through the local query cache unless use_cache is False
     """
 
-    df = pd.read_sql('select * from optourism.state_national_museum_visits', con=db_connection)
+    df = query_cache.read_sql_cached('select * from optourism.state_national_museum_visits', db_connection,
+                                     ['optourism.state_national_museum_visits'],
+                                     dtypes={'visit_month': 'category'},
+                                     use_cache=use_cache)
 
     if export_to_csv:
         df.to_csv(f"{export_path}_nationalmuseums_raw.csv", index=False)
@@ -31,13 +37,16 @@ def get_national_museums(db_connection, export_to_csv, export_path):
     return df
 
 
-def get_firenze_data(db_connection, export_to_csv, export_path):
+def get_firenze_data(db_connection, export_to_csv, export_path, use_cache=True):
 
     """
-    Get FirenzeCard logs from DB
+    Get FirenzeCard logs from DB, through the local query cache unless use_cache is False
     """
 
-    df = pd.read_sql('select * from optourism.firenze_card_logs', con=db_connection)
+    df = query_cache.read_sql_cached('select * from optourism.firenze_card_logs', db_connection,
+                                     ['optourism.firenze_card_logs'],
+                                     dtypes={'museum_name': 'category', 'entry_time': 'datetime64[ns]'},
+                                     use_cache=use_cache, reader=dbutils.read_sql_copy)
 
     if export_to_csv:
         df.to_csv(f"{export_path}_firenzedata_raw.csv", index=False)
@@ -45,13 +54,14 @@ def get_firenze_data(db_connection, export_to_csv, export_path):
     return df
 
 
-def get_firenze_locations(db_connection, export_to_csv, export_path):
+def get_firenze_locations(db_connection, export_to_csv, export_path, use_cache=True):
 
     """
-    Get latitude and longitude fields from DB
+    Get latitude and longitude fields from DB, through the local query cache unless use_cache is False
     """
 
-    df = pd.read_sql('select * from optourism.firenze_card_locations', con=db_connection)
+    df = query_cache.read_sql_cached('select * from optourism.firenze_card_locations', db_connection,
+                                     ['optourism.firenze_card_locations'], use_cache=use_cache)
 
     if export_to_csv:
         df.to_csv(f"{export_path}_firenzedata_locations.csv", index=False)
@@ -59,7 +69,8 @@ def get_firenze_locations(db_connection, export_to_csv, export_path):
     return df
 
 
-def extract_features(db_connection, path_firenzedata, path_firenzelocations_data, export_to_csv, export_path):
+def extract_features(db_connection, path_firenzedata, path_firenzelocations_data, export_to_csv, export_path,
+                     museum_matrix=False):
 
     """
     Feature extraction for FirenzeCard data
@@ -71,6 +82,8 @@ def extract_features(db_connection, path_firenzedata, path_firenzelocations_data
     path_firenzelocations_data: path to firenzelocations data csv file
     export_to_csv: boolean
     export_path: path to export data
+    museum_matrix: if True, museum membership is returned as sparse user x museum matrices (see get_museum_matrix)
+    instead of is_in_museum columns
 
     Returns
     -------
@@ -89,6 +102,7 @@ def extract_features(db_connection, path_firenzedata, path_firenzelocations_data
               - number of museums visited so far
               - persons_per_card_per_museum
               - day of use
+     2. If museum_matrix is True, a dict with the 'user' and 'card_day' museum matrices from get_museum_matrix
     """
 
     if path_firenzedata:
@@ -102,112 +116,287 @@ def extract_features(db_connection, path_firenzedata, path_firenzelocations_data
         df_locations = get_firenze_locations(db_connection, True, f"{export_path}_firenzedata_locations.csv")
 
     df = pd.merge(df_locations, df, on=['museum_id', 'museum_name'], how='inner')
+    df = add_features(df, museum_columns=not museum_matrix)
+
+    if export_to_csv:
+        df.to_csv(f"{export_path}_firenzedata_feature_extracted.csv", index=False)
+
+    if museum_matrix:
+        matrices = {'user': get_museum_matrix(df, ['user_id']),
+                    'card_day': get_museum_matrix(df, ['user_id', 'date'])}
+        return df, matrices
+
+    return df
+
+
+def add_features(df, museum_columns=True):
+
+    """
+    Add the extracted features to the merged FirenzeCard logs and locations (called by extract_features).
+    Timestamps are parsed once, durations are computed with vectorized timedelta division and museum membership
+    is stored as sparse int8 indicator columns, one per museum.
+
+    Parameters
+    ----------
+    df: FirenzeCard logs merged with the museum locations
+    museum_columns: whether to add the is_in_museum indicator columns
+
+    Returns
+    -------
+    Pandas dataframe with the features listed in extract_features, ordered by entry time
+    """
 
     df['entry_time'] = pd.to_datetime(df['entry_time'])
-    df['time'] = pd.to_datetime(df['entry_time']).dt.time
-    df['date'] = pd.to_datetime(df['entry_time']).dt.date
-    df['hour'] = pd.to_datetime(df['entry_time']).dt.hour
-    df['day_of_week'] = df['entry_time'].dt.dayofweek
+    df = df.sort_values('entry_time', ascending=True, kind='mergesort')
+
+    entry_time = df['entry_time'].dt
+    df['time'] = entry_time.time
+    df['date'] = entry_time.date
+    df['hour'] = entry_time.hour
+    df['day_of_week'] = entry_time.dayofweek
 
-    df = df.sort_values('entry_time', ascending=True)
     df['total_people'] = df['total_adults'] + df['minors']
 
     # todo remove overnights from time_since_previous museum - to only count on given days
-    df['time_since_previous_museum'] = df.groupby('user_id')['entry_time'].diff()
-    df['time_since_previous_museum'] = df['time_since_previous_museum'].apply(
-        lambda x: pd.Timedelta(x) / pd.Timedelta('1 hour'))
+    one_hour = np.timedelta64(1, 'h')
+    user_entries = df.groupby('user_id')['entry_time']
+    df['time_since_previous_museum'] = user_entries.diff() / one_hour
+    df['total_duration_card_use'] = (user_entries.transform('last') - user_entries.transform('first')) / one_hour
 
-    df = df.sort_values('entry_time', ascending=True)
-    df['total_duration_card_use'] = df[df.user_id.notnull()].groupby(
-        'user_id')['entry_time'].transform(lambda x: x.iat[-1] - x.iat[0])
-    df['total_duration_card_use'] = df['total_duration_card_use'].apply(
-        lambda x: pd.Timedelta(x) / pd.Timedelta('1 hour'))
+    df['entry_is_adult'] = (df['total_adults'] == 1).astype(np.int8)
+    df['is_card_with_minors'] = (df['minors'] == 1).astype(np.int8)
 
-    df['entry_is_adult'] = np.where(df['total_adults'] == 1, 1, 0)
-    df['is_card_with_minors'] = np.where(df['minors'] == 1, 1, 0)
+    # Entries without a card are dropped, as the merge on user_id used to do
+    df['entrances_per_card_per_museum'] = df.groupby(['user_id', 'museum_id'])['museum_id'].transform('size')
+    df = df[df['user_id'].notnull()]
 
-    entrances_per_card_per_museum = pd.DataFrame(df.groupby('user_id', as_index=True)['museum_id'].
-                                                 value_counts().rename('entrances_per_card_per_museum'))
+    if not museum_columns:
+        return df
 
-    df = pd.merge(entrances_per_card_per_museum.reset_index(), df, on=['user_id', 'museum_id'], how='inner')
+    is_in_museum = pd.get_dummies(df['museum_id'], prefix='is_in_museum', sparse=True, dtype=np.int8)
 
-    for n in range(1, df['museum_id'].nunique()):
-        df['is_in_museum_' + str(n)] = np.where(df['museum_id'] == n, 1, 0)
-    if export_to_csv:
-        df.to_csv(f"{export_path}_firenzedata_feature_extracted.csv", index=False)
+    return pd.concat([df, is_in_museum], axis=1)
 
-    return df
+
+def get_museum_matrix(df, row_columns, binary=True):
+
+    """
+    Build a sparse matrix of museum entries, one row per distinct value of row_columns and one column per museum.
+    ['user_id'] gives the user x museum matrix, ['user_id', 'date'] the card-day x museum matrix.
+
+    Parameters
+    ----------
+    df: FirenzeCard logs with user_id, museum_id and the row columns
+    row_columns: list of columns identifying a row
+    binary: if True, entries are 1 when the museum was visited, otherwise the number of entries
+
+    Returns
+    -------
+    1. scipy.sparse CSR matrix of int32
+    2. Pandas index of the row keys, in row order
+    3. Pandas index of the museum ids, in column order
+    """
+
+    df = df.dropna(subset=row_columns)
+    rows = df.groupby(row_columns, sort=True).ngroup().values
+    museum_codes, museum_ids = pd.factorize(df['museum_id'], sort=True)
+
+    row_index = df.drop_duplicates(row_columns).set_index(row_columns).sort_index().index
+
+    # Duplicate (row, museum) pairs are summed when converting to CSR
+    matrix = sp.coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, museum_codes)),
+                           shape=(len(row_index), len(museum_ids))).tocsr()
+
+    if binary:
+        matrix.data[:] = 1
+
+    return matrix, row_index, pd.Index(museum_ids, name='museum_id')
+
+
+def get_covisit_counts(matrix, museum_ids):
+
+    """
+    Count co-visits between museums from a museum matrix (see get_museum_matrix), as the sparse product M'M of the
+    binary matrix. The diagonal holds the number of rows (users or card-days) that visited each museum.
+
+    Parameters
+    ----------
+    matrix: sparse row x museum matrix
+    museum_ids: museum ids of the matrix columns
+
+    Returns
+    -------
+    Pandas dataframe of museum x museum co-visit counts
+    """
+
+    visited = matrix.astype(bool).astype(np.int32)
+    counts = (visited.T @ visited).toarray()
+
+    return pd.DataFrame(counts, index=museum_ids, columns=museum_ids)
+
+
+def fill_time_gaps(counts, time_axis, groups=None):
+
+    """
+    Zero-fill a grouped count series over a full time axis. Counts are written into a dense groups x time array by
+    direct indexing, without merges, so hourly buckets over a whole season stay cheap.
+
+    Parameters
+    ----------
+    counts: Pandas series indexed by (group, time); repeated index entries are summed, times not on the axis dropped
+    time_axis: every time bucket of the result, e.g. range(24) or pd.date_range(start, end, freq='H')
+    groups: groups of the result, the sorted groups of counts if None
+
+    Returns
+    -------
+    Pandas series indexed by every (group, time) pair, in group then time order
+    """
+
+    group_values = counts.index.get_level_values(0)
+    time_axis = pd.Index(time_axis, name=counts.index.names[1])
+    groups = pd.Index(np.unique(group_values) if groups is None else groups, name=counts.index.names[0])
+
+    group_codes = groups.get_indexer(group_values)
+    time_codes = time_axis.get_indexer(counts.index.get_level_values(1))
+    found = (group_codes >= 0) & (time_codes >= 0)
+
+    flat = group_codes[found] * len(time_axis) + time_codes[found]
+    filled = np.bincount(flat, weights=counts.values[found], minlength=len(groups) * len(time_axis))
+
+    if counts.dtype.kind in 'iub':
+        filled = filled.astype(counts.dtype)
+
+    index = pd.MultiIndex.from_product([groups, time_axis])
+
+    return pd.Series(filled, index=index, name=counts.name)
 
 
-def interpolate_on_timedelta(df, groupby_object,timedelta, timedelta_range=,
-                             count_column,timeunit, start_date, end_date):
+def interpolate_on_timedelta(df, groupby_object, timedelta, timedelta_range,
+                             count_column, timeunit, start_date, end_date):
     """
-    Interpolate data on a given timedelta
+    Interpolate data on a given timedelta, adding a zero count for every group and timedelta value missing from df
+    (see fill_time_gaps). Hours and days of week run over range(timedelta_range), dates from start_date to end_date
+    with frequency timeunit.
+    """
+
+    counts = df.set_index([groupby_object, timedelta])[count_column]
+
+    if timedelta == 'date':
+        counts.index = counts.index.set_levels(pd.to_datetime(counts.index.levels[1]), level=1)
+        time_axis = pd.date_range(start_date, end_date, freq=timeunit or 'D')
+    else:
+        time_axis = range(timedelta_range)
+
+    return fill_time_gaps(counts, time_axis).reset_index()
+
+
+def get_museum_entry_cube(df, start_date, end_date):
+
+    """
+    Count museum entries in a single pass into a dense museum x date x hour cube, from which the date, hour and
+    day of week series of every museum are derived (see get_cube_series). Entries outside start_date - end_date
+    are ignored.
+
+    Parameters
+    ----------
+    df: FirenzeCard logs with museum_id, entry_time and hour columns
+    start_date: first date of the cube
+    end_date: last date of the cube, inclusive
+
+    Returns
+    -------
+    1. Numpy int64 array of entries, shaped (museums, dates, 24)
+    2. Numpy array of the museum ids along the first axis, sorted
+    3. Pandas DatetimeIndex of the dates along the second axis
+    """
+
+    dates = pd.date_range(start_date, end_date, freq='D')
+    museum_ids = np.unique(df['museum_id'].values)
+
+    museum_codes = np.searchsorted(museum_ids, df['museum_id'].values)
+    date_codes = ((pd.to_datetime(df['entry_time']).dt.normalize() - dates[0]) // pd.Timedelta(1, 'D')).values
+    hours = df['hour'].values
+
+    in_range = (date_codes >= 0) & (date_codes < len(dates))
+    flat = (museum_codes[in_range] * len(dates) + date_codes[in_range]) * 24 + hours[in_range]
+
+    cube = np.bincount(flat, minlength=len(museum_ids) * len(dates) * 24)
+
+    return cube.reshape(len(museum_ids), len(dates), 24), museum_ids, dates
+
+
+def get_cube_series(cube, museum_ids, dates, timedelta, museums=None):
+
     """
+    Reduce a museum entry cube (see get_museum_entry_cube) to the zero-filled series of each museum for a timedelta
 
-    df_interpolated = pd.DataFrame()
+    Parameters
+    ----------
+    cube: museum x date x hour entry counts
+    museum_ids: museum ids along the first axis of the cube
+    dates: dates along the second axis of the cube
+    timedelta: 'date', 'hour' or 'day_of_week'
+    museums: museum ids to keep, all museums if None
 
-    if timedelta == 'day_of_week' or timedelta == 'hour':
-        data = pd.DataFrame({timedelta: range(timedelta_range),
-                             groupby_object: [id] * timedelta_range})
+    Returns
+    -------
+    Pandas dataframe with timedelta, museum_id and total_entries columns, one row per museum and timedelta value
+    """
 
-        df_interpolated = data.merge(df, how='outer', left_on=[timedelta, groupby_object],
-                                     right_on=[timedelta, groupby_object])
-        df_interpolated = df_interpolated.fillna(0)
+    if museums is not None:
+        keep = np.isin(museum_ids, museums)
+        cube = cube[keep]
+        museum_ids = museum_ids[keep]
 
     if timedelta == 'date':
-        columns = [groupby_object, count_column]
-        data = pd.DataFrame(0, np.arange(timedelta_range), columns)
-        full_id_days = data.reindex(pd.MultiIndex.from_product([df[groupby_object].unique(),
-                                                                pd.date_range(start_date, end_date,
-                                                                              freq=timeunit)]), fill_value=0)
-        full_id_days = full_id_days.reset_index()
-        full_id_days.columns = ['drop this', timedelta, groupby_object, count_column]
-        full_id_days = full_id_days.drop('drop this', 1)
-        df_interpolated = pd.merge(full_id_days, df, how='right',
-                                   on=[groupby_object, count_column, timedelta])
+        series = cube.sum(axis=2)
+        axis = dates
+    elif timedelta == 'hour':
+        series = cube.sum(axis=1)
+        axis = np.arange(24)
+    elif timedelta == 'day_of_week':
+        series = cube.sum(axis=2).dot(np.eye(7, dtype=cube.dtype)[dates.dayofweek])
+        axis = np.arange(7)
+    else:
+        raise ValueError(f"Wrong timedelta {timedelta!r}, use 'date', 'hour' or 'day_of_week'")
 
-    return df_interpolated
+    return pd.DataFrame({timedelta: np.tile(axis, len(museum_ids)),
+                         'museum_id': np.repeat(museum_ids, len(axis)),
+                         'total_entries': series.ravel()})
 
 
 def get_museum_entries_per_timedelta_and_plot(df, museum_list, me_names, timedelta, start_date, end_date,
-                                              export_to_csv, export_path, plot):
+                                              export_to_csv, export_path, plot, cube=None):
     """
-    Get museum timeseries for a given timedelta and plot
+    Get museum timeseries for a given timedelta and plot. All series are reductions of one museum entry cube, pass
+    the cube from get_museum_entry_cube to share it between timedeltas.
     """
 
-    timedelta_range, timeunit = get_timedelta_range(df, timedelta, start_date, end_date)
+    if cube is None:
+        cube = get_museum_entry_cube(df, start_date, end_date)
+
+    museum_names = df[['museum_id', 'short_name']].drop_duplicates()
 
     museum_dfs = {}
     plot_urls = {}
 
-    museum_list.append('All Museums')
-
-    for museum_name in museum_list[:]:
+    for museum_name in museum_list + ['All Museums']:
 
         if museum_name not in me_names:
             print('Wrong museum name! Please enter one of the following museums:')
             print(me_names)
 
         if museum_name != 'All Museums':
-            df2 = df[df['short_name'].str.contains(museum_name)]
+            museums = museum_names.loc[museum_names['short_name'].str.contains(museum_name), 'museum_id'].values
         else:
-            df2 = df
+            museums = None
 
-        df2 = df2.groupby(['museum_id', 'short_name', timedelta], as_index=False)
-        ['entrances_per_card_per_museum'].sum()
-        df_interpolated = interpolate_on_timedelta(df2, 'museum_id', timedelta, timedelta_range,
-                                                   'entrances_per_card_per_museum', timeunit)
-
-        df_interpolated = df_interpolated.rename(columns={'entrances_per_card_per_museum': 'total_entries'})
-        df_interpolated['total_entries'] = df_interpolated['total_entries'].fillna(0)
+        df_interpolated = get_cube_series(*cube, timedelta, museums=museums)
 
         if export_to_csv:
             df_interpolated.to_csv(f"{export_path} total_entries_{museum_name}_per_{timedelta}_.csv",
                                    index=False)
 
-        df_interpolated = df_interpolated.groupby([timedelta, 'museum_id'], as_index=False)['total_entries'].sum()
-
         if plot:
             trace1 = go.Bar(
                 x=df_interpolated[timedelta],
@@ -272,38 +461,26 @@ def get_timedelta_range(df, tdr_timedelta, start_date, end_date):
 def get_correlation_matrix(df, lst, corr_method, cm_timedelta, timedelta_subset, timedeltamin, timedeltamax,
                            below_threshold, above_threshold, export_to_csv, export_path):
     """
-    Get correlation matrix of museum correlations and inverse correlations, for a given timedelta, at given thresholds
+    Get correlation matrix of museum correlations and inverse correlations, for a given timedelta, at given thresholds.
+    Correlations are computed by a CorrelationEngine on the timedelta x museum matrix of the museums in lst, missing
+    entries count as zero.
     """
 
     if timedelta_subset:
         df = df[(df[cm_timedelta] >= timedeltamin) & (df[cm_timedelta] <= timedeltamax)]
 
-    df = df.pivot(cm_timedelta, columns='museum_id', values='total_entries')
-    m = df.corr(corr_method).stack()
+    df = df[df['museum_id'].isin(lst)]
+    df = df.pivot(index=cm_timedelta, columns='museum_id', values='total_entries').fillna(0)
+
+    engine = CorrelationEngine(df.columns, method=corr_method).append(df.values)
+    m = engine.to_frame().stack()
     corr_matrix = m[m.index.get_level_values(0) != m.index.get_level_values(1)]
 
-    high = pd.DataFrame(corr_matrix[corr_matrix > above_threshold])
-    inverse = pd.DataFrame(corr_matrix[corr_matrix < below_threshold])
-
-    high_corr = pd.DataFrame()
-    high_corr['high_combinations_1'] = high.index.get_level_values(0)
-    high_corr['high_combinations_2'] = high.index.get_level_values(1)
-    high_corr['values'] = high.values
-    high_corr = high_corr[np.isfinite(high_corr['values'])]
-    mask1 = high_corr['high_combinations_1'].isin(lst)
-    mask2 = high_corr['high_combinations_2'].isin(lst)
-    high_corr = high_corr[mask1]
-    high_corr = high_corr[mask2]
-
-    inverse_corr = pd.DataFrame()
-    inverse_corr['inverse_combinations_1'] = inverse.index.get_level_values(0)
-    inverse_corr['inverse_combinations_2'] = inverse.index.get_level_values(1)
-    inverse_corr['values'] = inverse.values
-    inverse_corr = inverse_corr[np.isfinite(inverse_corr['values'])]
-    mask1 = inverse_corr['inverse_combinations_1'].isin(lst)
-    mask2 = inverse_corr['inverse_combinations_2'].isin(lst)
-    inverse_corr = inverse_corr[mask1]
-    inverse_corr = inverse_corr[mask2]
+    high, inverse = engine.get_threshold_pairs(above_threshold, below_threshold)
+    high_corr = high.rename(columns={'column_1': 'high_combinations_1', 'column_2': 'high_combinations_2',
+                                     'value': 'values'})
+    inverse_corr = inverse.rename(columns={'column_1': 'inverse_combinations_1',
+                                           'column_2': 'inverse_combinations_2', 'value': 'values'})
 
     if export_to_csv:
         corr_matrix.to_csv(f"{export_path}_correlated_museums_{cm_timedelta}_.csv", index=False)
@@ -311,6 +488,32 @@ def get_correlation_matrix(df, lst, corr_method, cm_timedelta, timedelta_subset,
     return m, high_corr, inverse_corr
 
 
+def get_rolling_museum_correlation(cube, window_days=7, step_days=1):
+
+    """
+    Get Pearson correlations between the hourly entries of every pair of museums over sliding windows of days, to
+    spot when museums start competing for the same visitors (see features.correlation.get_rolling_correlation)
+
+    Parameters
+    ----------
+    cube: museum entry cube from get_museum_entry_cube
+    window_days: number of days in a window
+    step_days: number of days between window starts
+
+    Returns
+    -------
+    Pandas dataframe with one row per window, indexed by its first date, and one column per (museum_1, museum_2) pair
+    """
+
+    entries, museum_ids, dates = cube
+    hourly = entries.reshape(len(museum_ids), -1).T
+
+    correlation, starts, (first, second) = get_rolling_correlation(hourly, 24 * window_days, 24 * step_days)
+    columns = pd.MultiIndex.from_arrays([museum_ids[first], museum_ids[second]], names=['museum_1', 'museum_2'])
+
+    return pd.DataFrame(correlation, index=dates[starts // 24], columns=columns)
+
+
 def plot_national_museum_entries(db_connection, export_to_csv, export_path, plotname):
 
     """
@@ -0,0 +1,155 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import igraph as ig
+
+
+GRAPH_METRICS = ('pagerank', 'betweenness', 'community')
+
+# Metrics already computed, keyed by the graph fingerprint and the parameters
+metrics_cache = {}
+
+
+def get_graph_fingerprint(edges, source='from', target='to', weight='weight'):
+    """
+    Hashes the contents of an edge list, so that metrics computed for a graph
+    can be reused for any edge list with the same edges in the same order.
+
+    Args:
+        edges (Pandas.DataFrame): the edge list
+        source (string): name of the column with the origin of an edge
+        target (string): name of the column with the destination of an edge
+        weight (string): name of the column with the weight of an edge
+
+    Returns:
+        string: the hex digest of the edge list
+    """
+
+    hashes = pd.util.hash_pandas_object(edges[[source, target, weight]],
+                                        index=False)
+
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()
+
+
+def get_pagerank(sources, targets, weights, n_nodes, damping=0.85,
+                 tolerance=1e-10, max_iterations=1000):
+    """
+    Computes the weighted PageRank of every node by power iteration on the
+    sparse transition matrix. The rank of nodes without out edges is spread
+    evenly over all nodes.
+
+    Args:
+        sources (numpy.ndarray): source node codes of the edges
+        targets (numpy.ndarray): target node codes of the edges
+        weights (numpy.ndarray): weight of each edge
+        n_nodes (int): number of nodes
+        damping (float): probability of following an edge rather than jumping
+            to a random node
+        tolerance (float): stop when the L1 change is below this
+        max_iterations (int): maximum number of iterations
+
+    Returns:
+        numpy.ndarray: the PageRank of each node, summing to 1
+    """
+
+    weights = np.asarray(weights, dtype=np.float64)
+    strength = np.bincount(sources, weights=weights, minlength=n_nodes)
+    dangling = strength == 0
+
+    # Transposed transition matrix, so each iteration is one sparse product
+    transitions_t = sp.csr_matrix(
+        (weights / strength[sources], (targets, sources)),
+        shape=(n_nodes, n_nodes))
+
+    rank = np.full(n_nodes, 1.0 / n_nodes)
+    for _ in range(max_iterations):
+        updated = damping * (transitions_t.dot(rank) +
+                             rank[dangling].sum() / n_nodes) + \
+            (1 - damping) / n_nodes
+
+        converged = np.abs(updated - rank).sum() < tolerance
+        rank = updated
+
+        if converged:
+            break
+
+    return rank / rank.sum()
+
+
+def get_graph_metrics(edges, metrics=GRAPH_METRICS, source='from', target='to',
+                      weight='weight', damping=0.85, betweenness_cutoff=None,
+                      use_cache=True):
+    """
+    Computes node metrics for a weighted, directed graph given as an edge
+    list, such as the museum network from
+    network_analysis.make_static_firenze_card_edgelist or the tower network
+    from cdr_fountain.get_network_edges. PageRank runs as a sparse power
+    iteration, which scales to the tower graph. Betweenness and communities
+    share a single igraph build. Results are cached by the fingerprint of the
+    edge list and the parameters.
+
+    Args:
+        edges (Pandas.DataFrame): the edge list
+        metrics (list): any of 'pagerank', 'betweenness' and 'community'
+        source (string): name of the column with the origin of an edge
+        target (string): name of the column with the destination of an edge
+        weight (string): name of the column with the weight of an edge
+        damping (float): the PageRank damping factor
+        betweenness_cutoff (int): only count shortest paths up to this many
+            edges, all paths if None. Exact betweenness is slow on the tower
+            graph
+        use_cache (bool): whether to reuse previously computed metrics
+
+    Returns:
+        Pandas.DataFrame: one row per node, one column per metric. Betweenness
+            treats the inverse of the weight as the length of an edge,
+            communities are the multilevel partition of the graph with edge
+            directions ignored and weights summed
+    """
+
+    unknown = set(metrics) - set(GRAPH_METRICS)
+    if unknown:
+        raise ValueError('Unknown graph metrics %s, use any of %s'
+                         % (', '.join(sorted(unknown)),
+                            ', '.join(GRAPH_METRICS)))
+
+    metrics = [metric for metric in GRAPH_METRICS if metric in metrics]
+    key = (get_graph_fingerprint(edges, source, target, weight),
+           tuple(metrics), damping, betweenness_cutoff)
+
+    if use_cache and key in metrics_cache:
+        return metrics_cache[key].copy()
+
+    codes, nodes = pd.factorize(np.concatenate([edges[source].values,
+                                                edges[target].values]))
+    sources, targets = codes[:len(edges)], codes[len(edges):]
+    weights = edges[weight].values.astype(np.float64)
+
+    result = pd.DataFrame(index=pd.Index(nodes, name='node'))
+
+    if 'pagerank' in metrics:
+        result['pagerank'] = get_pagerank(sources, targets, weights,
+                                          len(nodes), damping=damping)
+
+    if 'betweenness' in metrics or 'community' in metrics:
+        graph = ig.Graph(n=len(nodes), directed=True,
+                         edges=list(zip(sources.tolist(), targets.tolist())))
+        graph.es['weight'] = weights.tolist()
+
+    if 'betweenness' in metrics:
+        graph.es['length'] = (1 / weights).tolist()
+        result['betweenness'] = graph.betweenness(
+            directed=True, weights='length', cutoff=betweenness_cutoff)
+
+    if 'community' in metrics:
+        undirected = graph.as_undirected(mode='collapse',
+                                         combine_edges={'weight': sum})
+        result['community'] = undirected.community_multilevel(
+            weights='weight').membership
+
+    if use_cache:
+        metrics_cache[key] = result.copy()
+
+    return result
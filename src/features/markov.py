@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# Node codes of the dummy start and end of day nodes, as in the dynamic edge
+# arrays from network_analysis.make_dynamic_edge_arrays
+START_NODE, END_NODE = 0, 1
+
+
+class MarkovChain(object):
+    """
+    First or second order Markov model of the moves between locations within
+    a day, fitted from the dynamic edge arrays. Each visitor day starts at the
+    start node and ends when the end node is reached. The context of a move
+    is the current node for a first order chain, and the previous and current
+    nodes for a second order chain, encoded as previous * n_nodes + current.
+
+    The transitions of all contexts are stored CSR-style over the sorted
+    context keys, with the cumulative probabilities of each row offset by the
+    row number so that they increase over the whole array. Sampling the next
+    node of any number of visitors is then one searchsorted call.
+    """
+
+    def __init__(self, contexts, targets, counts, nodes, order):
+        self.contexts = contexts
+        self.targets = targets
+        self.counts = counts
+        self.nodes = nodes
+        self.order = order
+
+        n_nodes = len(nodes)
+        keys = contexts.astype(np.int64) * n_nodes + targets
+        keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=counts)
+
+        row_keys = keys // n_nodes
+        self.states, rows = np.unique(row_keys, return_inverse=True)
+        self.indptr = np.append(np.searchsorted(row_keys, self.states),
+                                len(keys))
+        self.next_nodes = keys % n_nodes
+
+        row_totals = np.bincount(rows, weights=weights)
+        cumulative = np.cumsum(weights) - np.repeat(
+            np.cumsum(row_totals) - row_totals, np.diff(self.indptr))
+        self.cumulative = rows + cumulative / row_totals[rows]
+        self.probabilities = weights / row_totals[rows]
+
+    def get_context(self, previous, current):
+        """
+        Args:
+            previous (numpy.ndarray): previous node codes, ignored by first
+                order chains
+            current (numpy.ndarray): current node codes
+
+        Returns:
+            numpy.ndarray: the context keys
+        """
+
+        if self.order == 1:
+            return np.asarray(current, dtype=np.int64)
+
+        return np.asarray(previous, dtype=np.int64) * len(self.nodes) + current
+
+    def sample(self, contexts, random_state):
+        """
+        Samples the next node of visitors in the given contexts. Contexts never
+        seen when fitting lead to the end node.
+
+        Args:
+            contexts (numpy.ndarray): context keys
+            random_state (numpy.random.RandomState): random number generator
+
+        Returns:
+            numpy.ndarray: the next node codes
+        """
+
+        rows = np.searchsorted(self.states, contexts)
+        known = rows < len(self.states)
+        known[known] = self.states[rows[known]] == contexts[known]
+
+        next_nodes = np.full(len(contexts), END_NODE, dtype=np.int64)
+        rows = rows[known]
+
+        draws = rows + random_state.random_sample(len(rows))
+        positions = np.searchsorted(self.cumulative, draws, side='right')
+
+        # Rounding can put the last cumulative probability of a row below 1
+        positions = np.minimum(positions, self.indptr[rows + 1] - 1)
+        next_nodes[known] = self.next_nodes[positions]
+
+        return next_nodes
+
+    def simulate(self, n_visitors, max_steps=20, random_state=None):
+        """
+        Simulates the days of synthetic visitors, all of them moving at once
+        one step at a time. A day ends at the end node or after max_steps
+        visits.
+
+        Args:
+            n_visitors (int): number of visitor days to simulate
+            max_steps (int): maximum number of visits in a day
+            random_state (int or numpy.random.RandomState): seed or generator
+
+        Returns:
+            Pandas.Series: number of simulated visits to each location
+        """
+
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+
+        n_nodes = len(self.nodes)
+        visits = np.zeros(n_nodes, dtype=np.int64)
+
+        previous = np.full(n_visitors, START_NODE, dtype=np.int64)
+        current = np.full(n_visitors, START_NODE, dtype=np.int64)
+
+        for _ in range(max_steps):
+            if len(current) == 0:
+                break
+
+            next_nodes = self.sample(self.get_context(previous, current),
+                                     random_state)
+
+            moving = next_nodes != END_NODE
+            previous, current = current[moving], next_nodes[moving]
+            visits += np.bincount(current, minlength=n_nodes)
+
+        return pd.Series(visits[END_NODE + 1:],
+                         index=self.nodes[END_NODE + 1:], name='visits')
+
+    def close(self, locations):
+        """
+        Makes the chain of a scenario where some locations are closed. Moves
+        to or through a closed location are dropped and the other moves of
+        each context are rescaled; contexts that only led to closed
+        locations end the day instead.
+
+        Args:
+            locations (list): names of the closed locations
+
+        Returns:
+            MarkovChain: the chain of the scenario
+        """
+
+        closed = self.nodes.get_indexer(list(locations))
+        closed = closed[closed >= 0]
+
+        current = self.contexts % len(self.nodes)
+        previous = self.contexts // len(self.nodes) if self.order == 2 \
+            else current
+
+        return self.remove(np.isin(self.targets, closed) |
+                           np.isin(current, closed) |
+                           np.isin(previous, closed))
+
+    def remove_edges(self, pairs):
+        """
+        Makes the chain of a scenario where the moves between some pairs of
+        locations are impossible, in both directions, like
+        network_analysis.delete_paired_edges but without changing the fitted
+        chain.
+
+        Args:
+            pairs (list): (source, target) location name pairs
+
+        Returns:
+            MarkovChain: the chain of the scenario
+        """
+
+        current = self.contexts % len(self.nodes)
+        removed = np.zeros(len(self.targets), dtype=bool)
+
+        for source, target in pairs:
+            source, target = self.nodes.get_indexer([source, target])
+            removed |= ((current == source) & (self.targets == target)) | \
+                ((current == target) & (self.targets == source))
+
+        return self.remove(removed)
+
+    def remove(self, removed):
+        """
+        Refits the chain without some of the fitted moves. Contexts left
+        without any move end the day.
+
+        Args:
+            removed (numpy.ndarray): boolean array over the fitted moves
+
+        Returns:
+            MarkovChain: the refitted chain
+        """
+
+        contexts = self.contexts[~removed]
+        lost = np.setdiff1d(self.contexts[removed], contexts)
+
+        return MarkovChain(
+            np.concatenate([contexts, lost]),
+            np.concatenate([self.targets[~removed],
+                            np.full(len(lost), END_NODE, dtype=np.int64)]),
+            np.concatenate([self.counts[~removed], np.ones(len(lost))]),
+            self.nodes, self.order)
+
+    def get_stationary_distribution(self, tolerance=1e-10,
+                                    max_iterations=10000):
+        """
+        Computes the long run share of visits of each location by power
+        iteration on the sparse transition matrix, with each visitor day
+        restarting at the start node when it ends. Second order chains iterate
+        over their (previous, current) states and sum over the previous node.
+        Half of the probability stays put at each iteration, which leaves the
+        stationary distribution unchanged and avoids oscillating when the
+        chain is periodic.
+
+        Args:
+            tolerance (float): stop when the L1 change is below this
+            max_iterations (int): maximum number of iterations
+
+        Returns:
+            Pandas.Series: share of the visits of each location
+        """
+
+        n_nodes = len(self.nodes)
+        rows = np.repeat(np.arange(len(self.states)), np.diff(self.indptr))
+        next_nodes = self.next_nodes
+
+        if self.order == 1:
+            columns = np.searchsorted(self.states, next_nodes)
+        else:
+            current = self.states[rows] % n_nodes
+            columns = np.searchsorted(self.states,
+                                      current * n_nodes + next_nodes)
+
+        # Ended days, and moves into contexts never seen as a context, restart
+        restart = np.searchsorted(self.states, START_NODE)
+        columns = np.minimum(columns, len(self.states) - 1)
+        unknown = self.states[columns] != self.get_context(
+            self.states[rows] % n_nodes, next_nodes)
+        columns[(next_nodes == END_NODE) | unknown] = restart
+
+        transitions = sp.csr_matrix((self.probabilities, (rows, columns)),
+                                    shape=(len(self.states),) * 2)
+        transitions_t = transitions.T.tocsr()
+
+        distribution = np.full(len(self.states), 1.0 / len(self.states))
+        for _ in range(max_iterations):
+            updated = 0.5 * (distribution + transitions_t.dot(distribution))
+            updated /= updated.sum()
+
+            converged = np.abs(updated - distribution).sum() < tolerance
+            distribution = updated
+
+            if converged:
+                break
+
+        shares = np.bincount(self.states % n_nodes, weights=distribution,
+                             minlength=n_nodes)[END_NODE + 1:]
+
+        return pd.Series(shares / shares.sum(),
+                         index=self.nodes[END_NODE + 1:], name='share')
+
+
+def fit_markov_chain(sources, targets, counts, nodes, order=1):
+    """
+    Fit a first or second order Markov chain to the dynamic edge arrays from
+    network_analysis.make_dynamic_edge_arrays, weighting each move by the
+    number of people making it. The second order context of the first move of
+    a day is (start, start).
+
+    Args:
+        sources (numpy.ndarray): source node codes, days start at START_NODE
+        targets (numpy.ndarray): target node codes, days end at END_NODE
+        counts (numpy.ndarray): number of people moving along each edge
+        nodes (Pandas.Index): node names by code
+        order (int): 1 or 2
+
+    Returns:
+        MarkovChain: the fitted chain
+    """
+
+    if order not in (1, 2):
+        raise ValueError('Only first and second order chains are supported, '
+                         'got order=%r' % order)
+
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+
+    if order == 1:
+        contexts = sources
+    else:
+        previous = np.empty_like(sources)
+        previous[:1] = START_NODE
+        previous[1:] = sources[:-1]
+        previous[sources == START_NODE] = START_NODE
+        contexts = previous * len(nodes) + sources
+
+    return MarkovChain(contexts, targets, np.asarray(counts, dtype=np.float64),
+                       pd.Index(nodes), order)
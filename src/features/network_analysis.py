@@ -1,8 +1,12 @@
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import matplotlib.ticker as ticker
 from pylab import *
 import igraph as ig
 import matplotlib.pyplot as plt
+from .graph_metrics import get_graph_metrics
+from .path_index import PathIndex, get_path_offsets
 
 
 def prepare_firenzedata(records, nodes):
@@ -102,6 +106,182 @@ def plot_frequencies_total(data, use_log_scale=False):
     plt.show()
 
 
+# Node codes of the dummy start and end of day nodes in the edge arrays, the
+# locations are coded from FIRST_LOCATION_CODE on
+START_NODE, END_NODE = 0, 1
+FIRST_LOCATION_CODE = 2
+
+# Static edge lists with at most this many possible (source, target) pairs are
+# aggregated with a dense bincount, larger ones through the distinct pairs
+DENSE_PAIR_LIMIT = 2 ** 24
+
+
+def sort_daily_visits(
+        data,
+        user_id='user_id',
+        timestamp='entry_time',
+        date='date',
+        location='short_name',
+        count='total_people'
+):
+    """
+    Sort the logs by user, timestamp, date and location on integer codes and
+    merge the visits of a user to the same location at the same timestamp,
+    summing their counts. Rows with a missing key are dropped, as by a
+    groupby on the keys.
+
+    Args:
+        data (Pandas.DataFrame): the logs, with the columns specified below.
+        user_id (string): name of the user id column in data.
+        timestamp (string): name of the timestamp column in data.
+        date (string): name of the column in data with the day portion of the
+            timestamp.
+        location (string): name of the location column in data.
+        count (string): name of the counts column in data.
+
+    Returns:
+        tuple: the users, dates, location codes, counts and timestamps arrays
+            of the sorted visits, and a Pandas.Index of the sorted locations
+            by code
+    """
+
+    users, user_values = pd.factorize(data[user_id], sort=True)
+    times = pd.factorize(data[timestamp], sort=True)[0]
+    days, day_values = pd.factorize(data[date], sort=True)
+    places, locations = pd.factorize(data[location], sort=True)
+
+    order = np.lexsort((places, days, times, users))
+    order = order[(users[order] >= 0) & (times[order] >= 0) &
+                  (days[order] >= 0) & (places[order] >= 0)]
+
+    users, times, days, places = (users[order], times[order], days[order],
+                                  places[order])
+
+    new_visit = np.ones(len(order), dtype=bool)
+    new_visit[1:] = (users[1:] != users[:-1]) | (times[1:] != times[:-1]) | \
+        (days[1:] != days[:-1]) | (places[1:] != places[:-1])
+    visits = np.flatnonzero(new_visit)
+
+    counts = data[count].values[order]
+    counts = np.add.reduceat(counts, visits) if len(visits) else counts
+    timestamps = data[timestamp].values[order][visits]
+
+    return (np.asarray(user_values)[users[visits]],
+            np.asarray(day_values)[days[visits]],
+            places[visits], counts, timestamps, pd.Index(locations))
+
+
+def get_day_starts(users, days):
+    """
+    Flag the visits sorted by sort_daily_visits that are the first of a day
+    for their user.
+
+    Args:
+        users (numpy.ndarray): the user of each visit
+        days (numpy.ndarray): the date of each visit
+
+    Returns:
+        numpy.ndarray: boolean array, True at the first visit of each day
+    """
+
+    new_day = np.ones(len(users), dtype=bool)
+    new_day[1:] = (users[1:] != users[:-1]) | (days[1:] != days[:-1])
+
+    return new_day
+
+
+def make_dynamic_edge_arrays(
+        data,
+        user_id='user_id',
+        timestamp='entry_time',
+        date='date',
+        location='short_name',
+        count='total_people'
+):
+    """
+    Make integer-coded arrays of the sequential visits of one location to the
+    next in a day per user, in a single pass over the logs sorted by user and
+    timestamp. Visits of a user to the same location at the same timestamp are
+    merged. Each day of a user starts with an edge from the start node to the
+    first location and ends with an edge from the last location to the end
+    node, which carries the timestamp of the last visit.
+
+    Args:
+        data (Pandas.DataFrame): the logs, with the columns specified below.
+        user_id (string): name of the user id column in data.
+        timestamp (string): name of the timestamp column in data.
+        date (string): name of the column in data with the day portion of the
+            timestamp.
+        location (string): name of the location column in data.
+        count (string): name of the counts column in data.
+
+    Returns:
+        tuple: the source codes, target codes, counts and timestamps arrays of
+            the edges, ordered by user and timestamp, and a Pandas.Index of
+            the node names by code: 'start', 'end' and then the sorted
+            locations
+    """
+
+    users, days, places, counts, timestamps, locations = sort_daily_visits(
+        data, user_id, timestamp, date, location, count)
+
+    places = places + FIRST_LOCATION_CODE
+    new_day = get_day_starts(users, days)
+    last_of_day = np.roll(new_day, -1)
+
+    sources = np.empty_like(places)
+    sources[new_day] = START_NODE
+    sources[~new_day] = places[:-1][~new_day[1:]]
+
+    # Interleave the end of day edges right after the last visit of each day
+    ends = np.flatnonzero(last_of_day)
+    edge_order = np.argsort(np.concatenate([2 * np.arange(len(places)),
+                                            2 * ends + 1]), kind='mergesort')
+
+    def interleave(visit_values, end_values):
+        return np.concatenate([visit_values, end_values])[edge_order]
+
+    nodes = pd.Index(['start', 'end'] + list(locations), dtype=object)
+
+    return (interleave(sources, places[ends]),
+            interleave(places, np.full(len(ends), END_NODE, dtype=places.dtype)),
+            interleave(counts, counts[ends]),
+            interleave(timestamps, timestamps[ends]),
+            nodes)
+
+
+def make_static_edge_arrays(sources, targets, counts, n_nodes):
+    """
+    Aggregate integer-coded dynamic edges over time, summing the counts of each
+    (source, target) pair with a bincount over the flattened pair index.
+
+    Args:
+        sources (numpy.ndarray): source node codes of the edges
+        targets (numpy.ndarray): target node codes of the edges
+        counts (numpy.ndarray): number of people moving along each edge
+        n_nodes (int): number of node codes
+
+    Returns:
+        tuple: the source codes, target codes and summed weights of every pair
+            with edges, ordered by source and target
+    """
+
+    pairs = sources.astype(np.int64) * n_nodes + targets
+
+    if n_nodes ** 2 <= DENSE_PAIR_LIMIT:
+        weights = np.bincount(pairs, weights=counts, minlength=n_nodes ** 2)
+        pairs = np.flatnonzero(np.bincount(pairs, minlength=n_nodes ** 2))
+        weights = weights[pairs]
+    else:
+        pairs, inverse = np.unique(pairs, return_inverse=True)
+        weights = np.bincount(inverse, weights=counts)
+
+    if np.asarray(counts).dtype.kind in 'iub':
+        weights = weights.astype(np.int64)
+
+    return pairs // n_nodes, pairs % n_nodes, weights
+
+
 def make_dynamic_firenze_card_edgelist(
         data,
         user_id='user_id',
@@ -113,7 +293,9 @@ def make_dynamic_firenze_card_edgelist(
     """
     Make an edge list for all of the sequential visits of one museum to the next
     in a day per user. Each edge is directed. There is a dummy start node to
-    indicate the transition from being home to the first museum visited that day
+    indicate the transition from being home to the first museum visited that
+    day and a dummy end node for the transition from the last museum back home.
+    See make_dynamic_edge_arrays.
 
     Args:
         data (Pandas.DataFrame): The firenze card logs data includes the
@@ -132,30 +314,22 @@ def make_dynamic_firenze_card_edgelist(
             from, to, number of people, and timestamp
     """
 
-    edges = data.groupby([user_id, timestamp, date, location]) \
-        .sum()[count].to_frame()
-
-    edges.reset_index(inplace=True)
-
-    # start is the name of the dummy node for edges from home to the first
-    # location visited
-    edges['from'] = 'start'
-
-    edges['to'] = edges[location]
-    make_link = (edges[user_id].shift(1) == edges[user_id]) & \
-                (edges[date].shift(1) == edges[date])
-
-    edges['from'][make_link] = edges[location].shift(1)[make_link]
+    sources, targets, counts, timestamps, nodes = make_dynamic_edge_arrays(
+        data, user_id, timestamp, date, location, count)
 
     # TODO: drop the 'count' column if it's all 1s
-    return edges[['from', 'to', count, timestamp]]
+    return pd.DataFrame({'from': nodes.values[sources],
+                         'to': nodes.values[targets],
+                         count: counts,
+                         timestamp: timestamps},
+                        columns=['from', 'to', count, timestamp])
 
 
 def make_static_firenze_card_edgelist(edges, source='from', target='to',
                                       count='total_people'):
     """
     Create a static edge list for the firenze card entry logs from the dynamic
-    edge list.
+    edge list, which already holds the start and end of day edges.
 
     Args:
         edges (Pandas.DataFrame): dynamic edgelist created by
@@ -169,26 +343,159 @@ def make_static_firenze_card_edgelist(edges, source='from', target='to',
             time.
     """
 
-    # TODO: Need to create an "end" of day node
-    supp = edges[edges[source].shift(-1) == 'start'][[target, count]]
+    codes, nodes = pd.factorize(np.concatenate([edges[source].values,
+                                                edges[target].values]))
+
+    sources, targets, weights = make_static_edge_arrays(
+        codes[:len(edges)], codes[len(edges):], edges[count].values,
+        len(nodes))
+
+    return pd.DataFrame({'from': nodes[sources], 'to': nodes[targets],
+                         'weight': weights}, columns=['from', 'to', 'weight'])
+
+
+# Ways of slicing transitions by time for make_transition_cube
+TRANSITION_SLICES = ('hour', 'day_of_week', 'date')
+
+
+class TransitionCube(object):
+    """
+    A stack of transition matrices, one per time slice (hour of day, day of
+    week or date), with source nodes in rows and target nodes in columns. The
+    igraph graph of a slice is only built when it is asked for, and then kept.
+    """
+
+    def __init__(self, matrices, keys, nodes, by):
+        self.matrices = matrices
+        self.keys = keys
+        self.nodes = nodes
+        self.by = by
+        self.graphs = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_slice_index(self, key):
+        """
+        Args:
+            key: the hour, day of week or date of a slice
+
+        Returns:
+            int: the position of the slice in the cube
+        """
+
+        position = self.keys.get_indexer([key])[0]
+        if position < 0:
+            raise KeyError('No %s slice %r in the transition cube'
+                           % (self.by, key))
+
+        return position
+
+    def get_matrix(self, key):
+        """
+        Args:
+            key: the hour, day of week or date of a slice
+
+        Returns:
+            numpy.ndarray: the nodes x nodes transition counts of the slice
+        """
+
+        return self.matrices[self.get_slice_index(key)]
+
+    def get_frame(self, key):
+        """
+        Args:
+            key: the hour, day of week or date of a slice
+
+        Returns:
+            Pandas.DataFrame: the transition counts labelled with the nodes
+        """
+
+        return pd.DataFrame(self.get_matrix(key), index=self.nodes,
+                            columns=self.nodes)
+
+    def get_graph(self, key):
+        """
+        Builds, or returns the already built, weighted directed graph of a
+        slice. Every node is in the graph of every slice, so vertex ids match
+        between slices.
+
+        Args:
+            key: the hour, day of week or date of a slice
+
+        Returns:
+            igraph.Graph: the graph of the slice, with weight, indeg, outdeg
+                and label attributes as in make_firenze_card_static_graph
+        """
+
+        position = self.get_slice_index(key)
+
+        if position not in self.graphs:
+            matrix = self.matrices[position]
+            sources, targets = np.nonzero(matrix)
+
+            g = ig.Graph(n=len(self.nodes), directed=True,
+                         edges=list(zip(sources.tolist(), targets.tolist())))
+            g.vs['name'] = list(self.nodes)
+            g.vs['label'] = g.vs['name']
+            g.es['weight'] = matrix[sources, targets].tolist()
+            g.vs['indeg'] = matrix.sum(axis=0).tolist()
+            g.vs['outdeg'] = matrix.sum(axis=1).tolist()
+
+            self.graphs[position] = g
+
+        return self.graphs[position]
+
+
+def make_transition_cube(sources, targets, counts, timestamps, nodes,
+                         by='hour'):
+    """
+    Build the transition matrices of every time slice in one pass over the
+    dynamic edge arrays, with a bincount over the flattened
+    (slice, source, target) index.
+
+    Args:
+        sources (numpy.ndarray): source node codes, from
+            make_dynamic_edge_arrays
+        targets (numpy.ndarray): target node codes
+        counts (numpy.ndarray): number of people moving along each edge
+        timestamps (numpy.ndarray): time of each edge
+        nodes (Pandas.Index): node names by code
+        by (string): 'hour' (of day), 'day_of_week' or 'date'
+
+    Returns:
+        TransitionCube: the slices x nodes x nodes transition counts
+    """
+
+    if by not in TRANSITION_SLICES:
+        raise ValueError('Unknown slice %r, use one of %s'
+                         % (by, ', '.join(TRANSITION_SLICES)))
 
-    supp.columns = [source, count]
-    supp[target] = 'end'
-    supp = supp[[source, target, count]]
+    times = pd.DatetimeIndex(timestamps)
 
-    supp_edges = supp.groupby([source, target])[count].sum().to_frame() \
-        .reset_index()
+    if by == 'hour':
+        slices, keys = times.hour.values, pd.Index(range(24), name=by)
+    elif by == 'day_of_week':
+        slices, keys = times.dayofweek.values, pd.Index(range(7), name=by)
+    else:
+        slices, keys = pd.factorize(times.normalize(), sort=True)
+        keys = pd.DatetimeIndex(keys, name=by)
 
-    static = pd.concat([edges.groupby([source, target])[count].sum()
-                       .to_frame().reset_index(), supp_edges])
+    n_nodes = len(nodes)
+    flat = (slices.astype(np.int64) * n_nodes + sources) * n_nodes + targets
 
-    static.columns = ['from', 'to', 'weight']
+    matrices = np.bincount(flat, weights=counts,
+                           minlength=len(keys) * n_nodes ** 2)
+    if np.asarray(counts).dtype.kind in 'iub':
+        matrices = matrices.astype(np.int64)
 
-    return static
+    return TransitionCube(matrices.reshape(len(keys), n_nodes, n_nodes),
+                          keys, nodes, by)
 
 
 def make_firenze_card_static_graph(data, nodes, join_column='short_name',
-                                   lon='longitude', lat='latitude'):
+                                   lon='longitude', lat='latitude',
+                                   metrics=()):
     """
     Create an iGraph network graph from the static edge list created from the
     firenze card entry logs.
@@ -202,6 +509,8 @@ def make_firenze_card_static_graph(data, nodes, join_column='short_name',
             data frames.
         lon (string): the longitude column name
         lat (string): the latitude column name
+        metrics (list): node metrics from graph_metrics.get_graph_metrics to
+            store as vertex attributes, e.g. ['pagerank', 'community']
 
     Returns:
         igraph.Graph: the museum network graph instance
@@ -228,6 +537,12 @@ def make_firenze_card_static_graph(data, nodes, join_column='short_name',
     # Latitude is flipped, need to multiply by -1 to get correct orientation
     g.vs['y'] = (-1 * location[lat]).values.tolist()
 
+    if metrics:
+        node_metrics = get_graph_metrics(data, metrics).loc[g.vs['name']]
+
+        for metric in node_metrics.columns:
+            g.vs[metric] = node_metrics[metric].tolist()
+
     return g
 
 
@@ -295,29 +610,107 @@ def plot_firenze_card_static_graph(
     ig.plot(graph, 'graph.svg', bbox=(1000, 1000), **visual_style)
 
 
-def make_origin_destination_matrix(graph):
+def make_od_matrix(sources, targets, counts, n_nodes):
+    """
+    Create a sparse origin-destination matrix straight from integer-coded edge
+    arrays, summing the counts of repeated (source, target) pairs. Rows and
+    columns follow the node codes, so the index is stable between matrices
+    built from the same nodes. Works for tower networks as well as museums.
+
+    Args:
+        sources (numpy.ndarray): source node codes of the edges
+        targets (numpy.ndarray): target node codes of the edges
+        counts (numpy.ndarray): number of people moving along each edge
+        n_nodes (int): number of node codes
+
+    Returns:
+        scipy.sparse.csr_matrix: the n_nodes x n_nodes OD matrix
+    """
+
+    return sp.coo_matrix((counts, (sources, targets)),
+                         shape=(n_nodes, n_nodes)).tocsr()
+
+
+def normalize_od_matrix(matrix, by='row'):
+    """
+    Normalize an OD matrix to transition probabilities. Row normalized
+    matrices hold the probability of each destination given the origin,
+    column normalized ones the probability of each origin given the
+    destination. Rows or columns without any trips stay zero.
+
+    Args:
+        matrix (scipy.sparse.spmatrix): the OD matrix
+        by (string): 'row' or 'column'
+
+    Returns:
+        scipy.sparse.csr_matrix: the normalized matrix
+    """
+
+    if by not in ('row', 'column'):
+        raise ValueError("Normalize by 'row' or 'column', not %r" % by)
+
+    totals = np.asarray(matrix.sum(axis=1 if by == 'row' else 0)).ravel()
+    scale = sp.diags(np.divide(1.0, totals, out=np.zeros(len(totals)),
+                               where=totals != 0))
+
+    if by == 'row':
+        return (scale @ matrix).tocsr()
+
+    return (matrix @ scale).tocsr()
+
+
+def order_od_matrix(matrix, by='row'):
+    """
+    Order the rows and columns of an OD matrix by decreasing row (trips out)
+    or column (trips in) sums. Ties keep their node order.
+
+    Args:
+        matrix (scipy.sparse.spmatrix): the OD matrix
+        by (string): 'row' or 'column'
+
+    Returns:
+        tuple: the reordered matrix and the node codes in their new order
+    """
+
+    totals = np.asarray(matrix.sum(axis=1 if by == 'row' else 0)).ravel()
+    order = np.argsort(-totals, kind='mergesort')
+    matrix = sp.csr_matrix(matrix)
+
+    return matrix[order][:, order], order
+
+
+def make_origin_destination_matrix(graph, sparse=False):
     """
     Create a transition matrix for all possible transitions between pairs of
-    museums from the igraph network graph.
+    museums from the igraph network graph, built from the graph's edge list
+    with make_od_matrix. The matrix is only densified at the end, pass
+    sparse=True for the CDR graph, whose dense towers x towers matrix does not
+    fit in memory.
 
     Args:
         graph (igraph.Graph): the graph object for a weighted, directed graph
+        sparse (bool): whether to return the sparse matrix and its labels
+            rather than a dense DataFrame
 
     Return:
-        Pandas.DataFrame: the corresponding transition matrix for the graph,
-            ordered by column sums
+        Pandas.DataFrame or tuple (scipy.sparse.csr_matrix, numpy.ndarray):
+            the corresponding transition matrix for the graph, ordered by row
+            sums and labelled with the node names, for example for
+            plot_origin_destination_matrix_heatmap. The sparse matrix and the
+            names of its rows and columns if sparse is True
     """
 
-    transition_matrix = pd.DataFrame(
-        graph.get_adjacency(attribute='weight').data,
-        columns=graph.vs['name'],
-        index=graph.vs['name']
-    )
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    matrix = make_od_matrix(edges[:, 0], edges[:, 1], graph.es['weight'],
+                            graph.vcount())
+
+    matrix, order = order_od_matrix(matrix)
+    names = np.asarray(graph.vs['name'], dtype=object)[order]
 
-    order = transition_matrix.sum(1).sort_values(ascending=False) \
-        .to_frame().index
+    if sparse:
+        return matrix, names
 
-    return transition_matrix[order].reindex(order)
+    return pd.DataFrame(matrix.toarray(), columns=names, index=names)
 
 
 def plot_origin_destination_matrix_heatmap(transition_matrix):
@@ -325,7 +718,8 @@ def plot_origin_destination_matrix_heatmap(transition_matrix):
     Plot the heat map for the transition matrix created from the network graph
 
     Args:
-        transition_matrix (Pandas.DataFrame): a transition matrix
+        transition_matrix (Pandas.DataFrame): a transition matrix, from
+            make_origin_destination_matrix
     """
 
     fig = plt.figure(figsize=(10, 10))
@@ -344,6 +738,72 @@ def plot_origin_destination_matrix_heatmap(transition_matrix):
     plt.show()
 
 
+def make_daily_path_arrays(
+        data,
+        user_id='user_id',
+        timestamp='entry_time',
+        date='date',
+        location='short_name',
+        count='total_people'
+):
+    """
+    Make the daily paths of every user as location codes stored one path
+    after another in a flat array, with CSR offsets.
+
+    Args:
+        data (Pandas.DataFrame): the logs, with the columns specified below.
+        user_id (string): name of the user id column in data.
+        timestamp (string): name of the timestamp column in data.
+        date (string): name of the column in data with the day portion of the
+            timestamp.
+        location (string): name of the location column in data.
+        count (string): name of the counts column in data.
+
+    Returns:
+        tuple: the location codes of the steps, the path offsets, the user and
+            the date of each path, and a Pandas.Index of the locations by code
+    """
+
+    users, days, places, _, _, locations = sort_daily_visits(
+        data, user_id, timestamp, date, location, count)
+
+    new_day = get_day_starts(users, days)
+
+    return (places, get_path_offsets(new_day), users[new_day], days[new_day],
+            locations)
+
+
+def make_daily_path_index(
+        data,
+        user_id='user_id',
+        timestamp='entry_time',
+        date='date',
+        location='short_name',
+        count='total_people'
+):
+    """
+    Create a counted n-gram index of the daily paths of every user, see
+    path_index.PathIndex.
+
+    Args:
+        data (Pandas.DataFrame): the logs, with the columns specified below.
+        user_id (string): name of the user id column in data.
+        timestamp (string): name of the timestamp column in data.
+        date (string): name of the column in data with the day portion of the
+            timestamp.
+        location (string): name of the location column in data.
+        count (string): name of the counts column in data.
+
+    Returns:
+        PathIndex: the index over the daily paths
+    """
+
+    values, offsets, _, _, locations = make_daily_path_arrays(
+        data, user_id, timestamp, date, location, count)
+
+    return PathIndex(values, offsets, locations)
+
+
 def make_firenze_card_daily_paths(
         data,
         user_id='user_id',
@@ -366,27 +826,29 @@ def make_firenze_card_daily_paths(
         count (string): the name of a column with the counts
 
     Returns:
-        Pandas.DataFrame: a data frame of daily paths per used
+        Pandas.DataFrame: a data frame of daily paths per user, one column
+            per day of use in order
     """
 
-    temp = data.groupby([user_id, timestamp, date, code]).sum()[count].to_frame()
-    temp.reset_index(inplace=True)
-
-    temp['start'] = ' '
-    temp['target'] = temp[code]
+    values, offsets, users, _, codes = make_daily_path_arrays(
+        data, user_id, timestamp, date, code, count)
 
-    make_link = (temp[user_id].shift(1) == temp[user_id]) & \
-                (temp[date].shift(1) == temp[date])
+    if len(values) == 0:
+        return pd.DataFrame(index=pd.Index([], name=user_id))
 
-    temp['start'][make_link] = temp[code].shift(1)[make_link]
-    temp['start'][temp['start'].shift(-1) == ' '] = \
-        (temp['start'] + temp['target'])[temp['start'].shift(-1) == ' ']
+    # Summing object arrays concatenates the codes of each path
+    steps = np.asarray(codes, dtype=object)[values]
+    paths = np.add.reduceat(steps, offsets[:-1])
 
-    temp.iloc[-1:]['start'] = temp.iloc[-1:]['start'] + temp.iloc[-1:]['target']
+    first_of_user = np.ones(len(users), dtype=bool)
+    first_of_user[1:] = users[1:] != users[:-1]
+    day_of_use = np.arange(len(users)) - \
+        np.maximum.accumulate(np.where(first_of_user, np.arange(len(users)), 0))
 
-    paths = temp.groupby('user_id')['start'].sum().to_frame()
+    paths = pd.Series(paths, index=pd.MultiIndex.from_arrays(
+        [users, day_of_use], names=[user_id, None])).unstack()
 
-    return paths['start'].apply(lambda x: pd.Series(x.strip().split(' ')))
+    return paths
     # TODO: Check to see how many cards have variable numbers of children entering
 
 
@@ -425,25 +887,16 @@ def aggregate_firenze_card_daily_paths(data):
 
     Args:
         data (Pandas.DataFrame): the paths data frame from
-            make_firenze_card_daily_paths.
+            make_firenze_card_daily_paths, with any number of days per user.
 
     Returns:
         Pandas.DataFrame: data frame of  paths aggregated across people and days
     """
-    # TODO: NEED TO HAVE IMPORTED FREQUENCY!
-
-    pt = pd.concat([frequency(data, 0), frequency(data, 1), frequency(data, 2),
-                    frequency(data, 3)])
-
-    pt['daily_path'] = pt[0].replace(np.nan, '', regex=True) + \
-                       pt[1].replace(np.nan, '', regex=True) + \
-                       pt[2].replace(np.nan,'',regex=True) + \
-                       pt[3].replace(np.nan, '', regex=True)
-
-    pt.drop([0, 1, 2, 3, 'ccdf', 'cumulative'], axis=1, inplace=True)
 
-    pt_grouped = pt.groupby('daily_path').sum()
-    pt_grouped.sort_values('frequency', inplace=True, ascending=False)
+    pt_grouped = data.stack().dropna().value_counts().to_frame('frequency')
+    pt_grouped.index.name = 'daily_path'
+    pt_grouped.sort_values('frequency', inplace=True, ascending=False,
+                           kind='mergesort')
 
     return pt_grouped
 
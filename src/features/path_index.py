@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+
+def get_path_offsets(path_starts):
+    """
+    Gets the CSR offsets of paths stored one after another in a flat array.
+
+    Args:
+        path_starts (numpy.ndarray): boolean array, True at the first step of
+            each path
+
+    Returns:
+        numpy.ndarray: offsets such that path i is
+            values[offsets[i]:offsets[i + 1]]
+    """
+
+    return np.append(np.flatnonzero(path_starts), len(path_starts))
+
+
+class PathIndex(object):
+    """
+    Paths of node codes, such as the museums visited by a card in a day,
+    stored CSR-style in one flat array with offsets, and a counted n-gram
+    index over them. N-grams are encoded as integers in base len(nodes), so
+    sorting the keys sorts the n-grams lexicographically and the n-grams
+    sharing a prefix form one contiguous range of keys. A searchsorted on the
+    sorted keys then answers prefix queries, as a prefix trie would.
+    """
+
+    def __init__(self, values, offsets, nodes):
+        self.values = np.asarray(values, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nodes = pd.Index(nodes)
+        self.ngram_counts = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """
+        Returns:
+            numpy.ndarray: the number of steps of each path
+        """
+
+        return np.diff(self.offsets)
+
+    def get_path(self, i):
+        """
+        Args:
+            i (int): the path number
+
+        Returns:
+            list: the node names of the path
+        """
+
+        steps = self.values[self.offsets[i]:self.offsets[i + 1]]
+
+        return list(self.nodes[steps])
+
+    def check_ngram_length(self, n):
+        """
+        Checks that n-grams of length n can be encoded in an int64 key.
+
+        Args:
+            n (int): the n-gram length
+        """
+
+        if n < 1 or len(self.nodes) ** n >= 2 ** 63:
+            raise ValueError('Cannot index %d-grams of %d nodes'
+                             % (n, len(self.nodes)))
+
+    def get_ngram_counts(self, n):
+        """
+        Counts every n-gram of consecutive steps within a path. The counts are
+        computed once per length and then kept.
+
+        Args:
+            n (int): the n-gram length
+
+        Returns:
+            tuple: the sorted n-gram keys and the number of times each occurs
+        """
+
+        self.check_ngram_length(n)
+
+        if n not in self.ngram_counts:
+            path_ends = np.repeat(self.offsets[1:], self.lengths)
+            starts = np.arange(len(self.values))
+            starts = starts[starts + n <= path_ends]
+
+            keys = np.zeros(len(starts), dtype=np.int64)
+            for step in range(n):
+                keys = keys * len(self.nodes) + self.values[starts + step]
+
+            self.ngram_counts[n] = np.unique(keys, return_counts=True)
+
+        return self.ngram_counts[n]
+
+    def decode(self, keys, n):
+        """
+        Decodes n-gram keys into node codes.
+
+        Args:
+            keys (numpy.ndarray): n-gram keys from get_ngram_counts
+            n (int): the n-gram length
+
+        Returns:
+            numpy.ndarray: (keys x n) array of node codes
+        """
+
+        codes = np.empty((len(keys), n), dtype=np.int64)
+        keys = np.array(keys, dtype=np.int64)
+
+        for step in range(n - 1, -1, -1):
+            codes[:, step] = keys % len(self.nodes)
+            keys //= len(self.nodes)
+
+        return codes
+
+    def get_top_ngrams(self, n, prefix=(), top=50):
+        """
+        Finds the most frequent n-grams, optionally only those starting with a
+        given sequence of nodes, e.g. the top 50 3-museum sequences starting
+        at the Uffizi with get_top_ngrams(3, ['Uffizi']).
+
+        Args:
+            n (int): the n-gram length
+            prefix (list): node names the n-grams must start with
+            top (int): maximum number of n-grams to return, all if None
+
+        Returns:
+            Pandas.DataFrame: ngram (tuple of node names) and frequency
+                columns, most frequent first
+        """
+
+        keys, counts = self.get_ngram_counts(n)
+
+        if len(prefix) > n:
+            raise ValueError('Prefix of %d nodes is longer than the %d-grams'
+                             % (len(prefix), n))
+
+        if len(prefix):
+            prefix_codes = self.nodes.get_indexer(list(prefix))
+
+            if (prefix_codes < 0).any():
+                keys, counts = keys[:0], counts[:0]
+            else:
+                span = len(self.nodes) ** (n - len(prefix))
+                low = 0
+                for code in prefix_codes:
+                    low = low * len(self.nodes) + int(code)
+
+                first, last = np.searchsorted(keys, [low * span,
+                                                     (low + 1) * span])
+                keys, counts = keys[first:last], counts[first:last]
+
+        order = np.argsort(-counts, kind='mergesort')[:top]
+        codes = self.decode(keys[order], n)
+        names = np.asarray(self.nodes, dtype=object)[codes]
+
+        return pd.DataFrame({'ngram': [tuple(row) for row in names],
+                             'frequency': counts[order]},
+                            columns=['ngram', 'frequency'])
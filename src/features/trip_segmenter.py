@@ -1,9 +1,49 @@
+import numpy as np
 import pandas as pd
 import logging as log
-from ..utils.database import dbutils
+from ..utils.database import dbutils, query_cache
 
 
-def get_daily_call_counts(db_connection, timeseries_table):
+# Integer codes for the position of a day within a trip, TRIP_LABELS[code] is
+# the label that get_trips writes in the trip column
+NOT_ON_TRIP, TRIP_FIRST, TRIP_LAST, TRIP_CONTINUE, TRIP_END, TRIP_START = \
+    range(6)
+TRIP_LABELS = ['', 'first', 'last', 'continue', 'end', 'start']
+
+DAILY_CALL_COUNT_COLUMNS = ['cust_id', 'same_cust', 'date', 'date_diff',
+                            'calls', 'calls_in_florence', 'calls_near_airport']
+
+
+def get_daily_call_counts_query(timeseries_table):
+    """
+    Builds the query for the per customer daily call counts. The rows are
+    ordered by customer and date so that the LAG window columns compare each
+    row with the previous day of the same customer and so that all of the rows
+    for one customer are contiguous.
+
+    Args:
+        timeseries_table (string): The name of the database table that contains
+                                   the time series data
+
+    Returns:
+        string: the SQL query
+    """
+
+    return """
+        SELECT cust_id, 
+        (cust_id - LAG(cust_id) OVER w)=0 AS same_cust, 
+        date_ AS date, 
+        EXTRACT(DAYS FROM date_ - LAG(date_) OVER w) - 1 AS date_diff, 
+        calls, 
+        calls_in_florence_city AS calls_in_florence,
+        calls_near_airport
+        FROM %s
+        WINDOW w AS (ORDER BY cust_id, date_)
+        ORDER BY cust_id, date_
+    """ % timeseries_table
+
+
+def get_daily_call_counts(db_connection, timeseries_table, use_cache=True):
     """
     Gets the time series data per customer from the database. This data
     contains every unique customer ID from the time series set along with
@@ -14,6 +54,7 @@ def get_daily_call_counts(db_connection, timeseries_table):
         db_connection (Psycopg.connection): The database connection
         timeseries_table (string): The name of the database table that contains
                                    the time series data
+        use_cache (bool): whether to read through the local query cache
 
     Returns:
         Pandas.DataFrame: The time series data for each unique user. It has the
@@ -23,20 +64,111 @@ def get_daily_call_counts(db_connection, timeseries_table):
 
     log.info('Start reading from DB')
 
-    query = """
-        SELECT cust_id, 
-        (cust_id - LAG(cust_id) OVER ())=0 AS same_cust, 
-        date_ AS date, 
-        EXTRACT(DAYS FROM date_ - LAG(date_) OVER ()) - 1 AS date_diff, 
-        calls, 
-        calls_in_florence_city AS calls_in_florence,
-        calls_near_airport
-        FROM %s
-    """ % timeseries_table
+    query = get_daily_call_counts_query(timeseries_table)
+    counts = query_cache.read_sql_cached(query, db_connection,
+                                         [timeseries_table],
+                                         dtypes={'date': 'datetime64[ns]'},
+                                         use_cache=use_cache,
+                                         reader=dbutils.read_sql_copy)
 
     log.info('Finished reading from DB')
 
-    return pd.read_sql(query, con=db_connection)
+    return counts
+
+
+def iter_daily_call_counts(db_connection, timeseries_table, chunk_size=1000000,
+                           chunk_unit='rows', fetch_size=50000):
+    """
+    Streams the time series data per customer from the database with a server
+    side cursor, yielding DataFrames of bounded size instead of loading the
+    whole table. A customer is never split across two chunks, so every chunk
+    can be passed to get_trips on its own. With 'rows', a chunk only exceeds
+    chunk_size when a single customer has more rows than fit in one chunk. The
+    size in 'bytes' is only known after a fetch, so a chunk can also exceed
+    chunk_size by up to the size of fetch_size rows.
+
+    Args:
+        db_connection (Psycopg.connection): The database connection
+        timeseries_table (string): The name of the database table that contains
+                                   the time series data
+        chunk_size (int): The target size of each chunk, in chunk_unit
+        chunk_unit (string): Either 'rows' or 'bytes'. With 'bytes' the size of
+                             a chunk is measured as the memory used by its
+                             DataFrame
+        fetch_size (int): The number of rows fetched from the server per round
+                          trip
+
+    Yields:
+        Pandas.DataFrame: The time series data for a set of whole customers. It
+                          has the same columns as get_daily_call_counts
+    """
+
+    if chunk_unit not in ('rows', 'bytes'):
+        raise ValueError("chunk_unit must be 'rows' or 'bytes', got %r"
+                         % chunk_unit)
+
+    log.info('Start streaming from DB')
+
+    query = get_daily_call_counts_query(timeseries_table)
+    cursor = db_connection.cursor(name='daily_call_counts')
+    cursor.itersize = fetch_size
+
+    try:
+        cursor.execute(query)
+
+        pending = []
+        pending_size = 0
+
+        while True:
+            records = cursor.fetchmany(fetch_size)
+            if not records:
+                break
+
+            batch = pd.DataFrame.from_records(records,
+                                              columns=DAILY_CALL_COUNT_COLUMNS)
+            pending.append(batch)
+
+            if chunk_unit == 'rows':
+                pending_size += len(batch)
+            else:
+                pending_size += batch.memory_usage(index=True, deep=True).sum()
+
+            while pending_size >= chunk_size:
+                counts = pd.concat(pending, ignore_index=True)
+                cust_ids = counts['cust_id'].values
+
+                # Hold back the last customer, its rows may continue in the
+                # next fetch from the server
+                starts = (cust_ids[1:] != cust_ids[:-1]).nonzero()[0] + 1
+                if len(starts) == 0:
+                    pending = [counts]
+                    break
+
+                # In rows, cut after the last customer that fits in the chunk,
+                # or after the first one if it alone is larger than a chunk
+                split = starts[-1]
+                if chunk_unit == 'rows' and split > chunk_size:
+                    fits = np.searchsorted(starts, chunk_size, side='right')
+                    split = starts[max(fits - 1, 0)]
+
+                tail = counts.iloc[split:].reset_index(drop=True)
+                pending = [tail]
+
+                if chunk_unit == 'rows':
+                    pending_size = len(tail)
+                else:
+                    pending_size = tail.memory_usage(index=True,
+                                                     deep=True).sum()
+
+                yield counts.iloc[:split].copy()
+
+        if pending:
+            yield pd.concat(pending, ignore_index=True)
+
+    finally:
+        cursor.close()
+
+    log.info('Finished streaming from DB')
 
 
 # TODO: cleanup or snip
@@ -50,40 +182,141 @@ def get_active_counts(counts):
     return counts_subset
 
 
-def get_italian_trips(db_connection):
+def get_italian_trips(db_connection, only_start=False, chunk_size=None,
+                      chunk_unit='rows', workers=1):
     """
     Gets the time series data for all Italian visitors from the database
 
     Args:
         db_connection (Psycopg.connection): The database connection
+        only_start (bool): whether to only label the start of trips
+        chunk_size (int): if set, stream the data from the database in chunks
+                          of this size instead of reading it all at once
+        chunk_unit (string): Either 'rows' or 'bytes', the unit of chunk_size
+        workers (int): the number of processes to segment the trips with
 
     Returns:
         Pandas.DataFrame: The time series data for each unique Italian visitor.
                           It has the columns cust_id, date, date_diff, calls,
                           calls_in_florence, calls_near_airport
     """
-    counts = get_daily_call_counts(db_connection,
-                                   'optourism.italians_timeseries_daily')
 
-    return get_trips(counts)
+    return get_table_trips(db_connection, 'optourism.italians_timeseries_daily',
+                           only_start=only_start, chunk_size=chunk_size,
+                           chunk_unit=chunk_unit, workers=workers)
 
 
-def get_foreign_trips(db_connection):
+def get_foreign_trips(db_connection, only_start=False, chunk_size=None,
+                      chunk_unit='rows', workers=1):
     """
     Gets the time series data for all Foreign visitors from the database
 
     Args:
         db_connection (Psycopg.connection): The database connection
+        only_start (bool): whether to only label the start of trips
+        chunk_size (int): if set, stream the data from the database in chunks
+                          of this size instead of reading it all at once
+        chunk_unit (string): Either 'rows' or 'bytes', the unit of chunk_size
+        workers (int): the number of processes to segment the trips with
 
     Returns:
         Pandas.DataFrame: The time series data for each unique Foreign visitor.
                           It has the columns cust_id, date, date_diff, calls,
                           calls_in_florence, calls_near_airport
     """
-    counts = get_daily_call_counts(db_connection,
-                                   'optourism.foreigners_timeseries_daily')
 
-    return get_trips(counts)
+    return get_table_trips(db_connection,
+                           'optourism.foreigners_timeseries_daily',
+                           only_start=only_start, chunk_size=chunk_size,
+                           chunk_unit=chunk_unit, workers=workers)
+
+
+def get_table_trips(db_connection, timeseries_table, only_start=False,
+                    chunk_size=None, chunk_unit='rows', workers=1):
+    """
+    Gets the trips for every customer in a time series table. When chunk_size
+    is set the table is streamed and segmented chunk by chunk, and only the
+    results are concatenated. Either way the whole result is returned in
+    memory, use iter_trips to process the trips with bounded memory.
+
+    Args:
+        db_connection (Psycopg.connection): The database connection
+        timeseries_table (string): The name of the database table that contains
+                                   the time series data
+        only_start (bool): whether to only label the start of trips
+        chunk_size (int): if set, the size of the chunks to stream
+        chunk_unit (string): Either 'rows' or 'bytes', the unit of chunk_size
+        workers (int): the number of processes to segment the trips with
+
+    Returns:
+        tuple (Pandas.DataFrame, Pandas.DataFrame): the labeled counts and the
+            trips grouped by customer, as returned by get_trips
+    """
+
+    if chunk_size is None:
+        counts = get_daily_call_counts(db_connection, timeseries_table)
+        return get_trips(counts, only_start=only_start, workers=workers)
+
+    results = list(iter_trips(db_connection, timeseries_table, chunk_size,
+                              chunk_unit=chunk_unit, only_start=only_start,
+                              workers=workers))
+
+    if not results:
+        return pd.DataFrame(columns=DAILY_CALL_COUNT_COLUMNS), pd.DataFrame()
+
+    counts = pd.concat([r[0] for r in results], ignore_index=True)
+    trips_group = pd.concat([r[1] for r in results])
+
+    return counts, trips_group
+
+
+def iter_trips(db_connection, timeseries_table, chunk_size, chunk_unit='rows',
+               only_start=False, gap_length=3, workers=1):
+    """
+    Streams the time series table and segments it into trips one chunk at a
+    time, so that only one chunk of customers is held in memory. Trip ids
+    continue from one chunk to the next, so they are unique across the table
+    and the same as when the whole table is segmented at once.
+
+    Args:
+        db_connection (Psycopg.connection): The database connection
+        timeseries_table (string): The name of the database table that contains
+                                   the time series data
+        chunk_size (int): The target size of each chunk, in chunk_unit
+        chunk_unit (string): Either 'rows' or 'bytes'
+        only_start (bool): whether to only label the start of trips
+        gap_length (int): the maximum gap in days within one trip
+        workers (int): the number of processes to segment each chunk with
+
+    Yields:
+        tuple (Pandas.DataFrame, Pandas.DataFrame): the output of get_trips for
+            each chunk
+    """
+
+    chunks = iter_daily_call_counts(db_connection, timeseries_table,
+                                    chunk_size=chunk_size,
+                                    chunk_unit=chunk_unit)
+
+    trip_count = 0
+
+    for counts in chunks:
+        counts, trips_group = get_trips(counts, only_start=only_start,
+                                        gap_length=gap_length,
+                                        workers=workers)
+
+        if trip_count:
+            trip_ids = counts['trip_id'].values
+            counts['trip_id'] = np.where(trip_ids != 0, trip_ids + trip_count,
+                                         0).astype(np.int32)
+
+            trips_group.index = pd.MultiIndex.from_arrays(
+                [trips_group.index.get_level_values('cust_id'),
+                 trips_group.index.get_level_values('trip_id') + trip_count],
+                names=['cust_id', 'trip_id'])
+
+        trip_count += len(trips_group)
+
+        yield counts, trips_group
 
 
 def frequency(dataframe, column_name):
@@ -115,91 +348,408 @@ def frequency(dataframe, column_name):
     return out
 
 
-def get_trips(counts, only_start=False, gap_length=3):
-    counts.iloc[0, 1] = False
+def get_customer_boundaries(cust_ids):
+    """
+    Finds the first and last row of every customer in an array of customer ids
+    sorted by customer.
 
-    same_cust_false = counts['same_cust'] == False
-    same_cust_true = ~same_cust_false
+    Args:
+        cust_ids (numpy.ndarray): customer id of each row, sorted
 
-    counts.loc[same_cust_false, 'date_diff'] = None
-    gap_threshold = counts['date_diff'] < gap_length
+    Returns:
+        tuple (numpy.ndarray, numpy.ndarray): boolean arrays that are True on
+            the first and on the last row of each customer
+    """
 
-    counts['in_florence'] = (counts['calls_in_florence'] > 0) | \
-                            (counts['calls_near_airport'] > 0)
+    n = len(cust_ids)
+    first_row = np.ones(n, dtype=bool)
+    last_row = np.ones(n, dtype=bool)
 
-    in_florence_true = counts['in_florence'] == True
+    if n > 1:
+        changed = cust_ids[1:] != cust_ids[:-1]
+        first_row[1:] = changed
+        last_row[:-1] = changed
 
-    counts['calls_out_florence'] = counts['calls'] - counts['calls_in_florence']
-    counts['out_florence'] = counts['calls_out_florence'] > 0
+    return first_row, last_row
 
-    counts['was_in_florence'] = counts['in_florence'].shift(1)
-    counts['willbe_in_florence'] = counts['in_florence'].shift(-1)
-    counts.loc[same_cust_false, 'was_in_florence'] = None
 
-    was_in_florence_true = counts['was_in_florence'] == True
-    was_in_florence_false = ~was_in_florence_true
-    willbe_in_florence_true = counts['willbe_in_florence'] == True
-    willbe_in_florence_false = ~willbe_in_florence_true
+def label_trips(cust_ids, dates, in_florence, only_start=False, gap_length=3):
+    """
+    Labels each customer day with its position within a trip to Florence. The
+    rules are the ones of get_trips, evaluated within each customer only: a
+    day in Florence is the 'start' of a trip when the customer was not in
+    Florence on the previous day with calls, a 'continue' or 'end' when they
+    were and the gap between the days is shorter than gap_length, 'first' and
+    'last' on the first and last days of a customer.
 
-    counts['was_out_florence'] = counts['out_florence'].shift(1)
-    counts['willbe_out_florence'] = counts['out_florence'].shift(-1)
-    counts.loc[same_cust_false, 'was_out_florence'] = None
+    Args:
+        cust_ids (numpy.ndarray): customer id of each row
+        dates (numpy.ndarray): date of each row, sorted within each customer
+        in_florence (numpy.ndarray): whether the customer made calls in
+            Florence or near the airport on that day
+        only_start (bool): whether to skip the 'last' and 'end' labels
+        gap_length (int): the gap in days from which a new trip starts
 
-    counts['trip'] = ''
+    Returns:
+        numpy.ndarray: int8 trip code of each row, see TRIP_LABELS
+    """
+
+    n = len(cust_ids)
+    first_row, last_row = get_customer_boundaries(cust_ids)
+    days = np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+    in_florence = np.asarray(in_florence, dtype=bool)
+
+    same_cust = ~first_row
+
+    within_gap = np.zeros(n, dtype=bool)
+    within_gap[1:] = (days[1:] - days[:-1] - 1) < gap_length
+    within_gap &= same_cust
+
+    was_in_florence = np.zeros(n, dtype=bool)
+    was_in_florence[1:] = in_florence[:-1]
+    was_in_florence &= same_cust
+
+    willbe_in_florence = np.zeros(n, dtype=bool)
+    willbe_in_florence[:-1] = in_florence[1:]
+    willbe_in_florence &= ~last_row
+
+    continues_trip = same_cust & within_gap & in_florence
 
-    # Do less specific first
-    counts.loc[
-        same_cust_false &
-        in_florence_true,
-        'trip'
-    ] = 'first'
+    # The conditions are in order of precedence, the first one that holds
+    # gives the label
+    conditions = [continues_trip & ~was_in_florence]
+    codes = [TRIP_START]
 
     if not only_start:
-        counts.loc[
-            same_cust_true &
-            (counts['same_cust'].shift(-1) == False) &
-            in_florence_true,
-            'trip'
-        ] = 'last'
-
-    # And more specific next
-    counts.loc[
-        same_cust_true &
-        gap_threshold &
-        was_in_florence_true &
-        in_florence_true,
-        'trip'
-    ] = 'continue'
+        conditions.append(continues_trip & ~willbe_in_florence)
+        codes.append(TRIP_END)
+
+    conditions.append(continues_trip)
+    codes.append(TRIP_CONTINUE)
 
     if not only_start:
-        counts.loc[
-            same_cust_true &
-            gap_threshold &
-            was_in_florence_true &
-            in_florence_true &
-            willbe_in_florence_false,
-            'trip'
-        ] = 'end'
-
-    counts.loc[
-        same_cust_true &
-        gap_threshold &
-        was_in_florence_false &
-        in_florence_true,
-        'trip'
-    ] = 'start'
-
-    counts['on_trip'] = counts['trip'] != ''
-
-    trips = counts[['cust_id', 'same_cust', 'date', 'date_diff',
-                    'calls_in_florence', 'calls_out_florence', 'trip',
-                    'on_trip']]
-
-    num = ((trips['on_trip'].shift(1) != trips['on_trip']).astype(int).cumsum())
-    trips['trip_id'] = num * (trips['on_trip']).astype(int)
-
-    trips_group = trips[trips['trip_id'] != 0][['cust_id', 'trip_id']]
-    trips_group = trips_group.groupby(['cust_id', 'trip_id']).size().to_frame()
+        conditions.append(same_cust & last_row & in_florence)
+        codes.append(TRIP_LAST)
+
+    conditions.append(first_row & in_florence)
+    codes.append(TRIP_FIRST)
+
+    return np.select(conditions, codes, NOT_ON_TRIP).astype(np.int8)
+
+
+def number_trips(cust_ids, codes):
+    """
+    Numbers the trips in a labeled array of customer days. A trip is a run of
+    consecutive labeled days of one customer.
+
+    Args:
+        cust_ids (numpy.ndarray): customer id of each row, sorted
+        codes (numpy.ndarray): trip code of each row from label_trips
+
+    Returns:
+        tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray): the trip id of
+            each row (0 for days not on a trip, trips are numbered from 1) and
+            the row positions of the first and last day of each trip
+    """
+
+    n = len(cust_ids)
+    first_row, last_row = get_customer_boundaries(cust_ids)
+    on_trip = codes != NOT_ON_TRIP
+
+    prev_on_trip = np.zeros(n, dtype=bool)
+    prev_on_trip[1:] = on_trip[:-1]
+    next_on_trip = np.zeros(n, dtype=bool)
+    next_on_trip[:-1] = on_trip[1:]
+
+    trip_first = on_trip & (first_row | ~prev_on_trip)
+    trip_last = on_trip & (last_row | ~next_on_trip)
+
+    trip_ids = np.cumsum(trip_first, dtype=np.int64).astype(np.int32)
+    trip_ids[~on_trip] = 0
+
+    return trip_ids, np.flatnonzero(trip_first), np.flatnonzero(trip_last)
+
+
+def make_trip_table(cust_ids, dates, trip_starts, trip_ends):
+    """
+    Makes the table of trips from the positions of their first and last days.
+
+    Args:
+        cust_ids (numpy.ndarray): customer id of each row
+        dates (numpy.ndarray): date of each row
+        trip_starts (numpy.ndarray): row position of the first day of each trip
+        trip_ends (numpy.ndarray): row position of the last day of each trip
+
+    Returns:
+        Pandas.DataFrame: one row per trip with the columns cust_id, trip_id,
+            start, end and length (number of days with calls)
+    """
+
+    return pd.DataFrame({
+        'cust_id': np.asarray(cust_ids)[trip_starts],
+        'trip_id': np.arange(1, len(trip_starts) + 1, dtype=np.int32),
+        'start': np.asarray(dates)[trip_starts],
+        'end': np.asarray(dates)[trip_ends],
+        'length': (trip_ends - trip_starts + 1).astype(np.int32)
+    }, columns=['cust_id', 'trip_id', 'start', 'end', 'length'])
+
+
+def segment_trips(cust_ids, dates, calls_in_florence, calls_near_airport,
+                  only_start=False, gap_length=3):
+    """
+    Segments customer days into trips to Florence. Works on plain arrays sorted
+    by customer and date and never compares a row with a row of another
+    customer, so any set of whole customers can be segmented on its own.
+
+    Args:
+        cust_ids (numpy.ndarray): customer id of each row
+        dates (numpy.ndarray): date of each row
+        calls_in_florence (numpy.ndarray): number of calls in Florence city
+        calls_near_airport (numpy.ndarray): number of calls near the airport
+        only_start (bool): whether to skip the 'last' and 'end' labels
+        gap_length (int): the gap in days from which a new trip starts
+
+    Returns:
+        tuple (numpy.ndarray, numpy.ndarray, Pandas.DataFrame): the trip code of
+            each row, the trip id of each row and the trip table from
+            make_trip_table
+    """
+
+    cust_ids = np.asarray(cust_ids)
+    in_florence = (np.asarray(calls_in_florence) > 0) | \
+                  (np.asarray(calls_near_airport) > 0)
+
+    codes = label_trips(cust_ids, dates, in_florence, only_start=only_start,
+                        gap_length=gap_length)
+    trip_ids, trip_starts, trip_ends = number_trips(cust_ids, codes)
+    trips = make_trip_table(cust_ids, dates, trip_starts, trip_ends)
+
+    return codes, trip_ids, trips
+
+
+def hash_customers(cust_ids, shards):
+    """
+    Assigns every customer to one of a number of shards with a multiplicative
+    hash of the customer id, so that shards get a similar number of customers
+    whatever the order of the ids.
+
+    Args:
+        cust_ids (numpy.ndarray): integer customer id of each row
+        shards (int): the number of shards
+
+    Returns:
+        numpy.ndarray: the shard of each row
+    """
+
+    hashed = np.asarray(cust_ids).astype(np.uint64) * \
+        np.uint64(11400714819323198485)
+
+    return ((hashed >> np.uint64(32)) % np.uint64(shards)).astype(np.int64)
+
+
+def share_array(array):
+    """
+    Copies an array into a new block of shared memory.
+
+    Args:
+        array (numpy.ndarray): the array to share
+
+    Returns:
+        tuple (SharedMemory, tuple): the shared memory block, which the caller
+            must unlink, and the (name, shape, dtype) spec to attach to it
+    """
+
+    from multiprocessing import shared_memory
+
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[:] = array
+    del view
+
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def segment_shard(spec):
+    """
+    Labels the trips of one shard of customers in a worker process. The inputs
+    and the output codes are views of shared memory blocks, the shard is the
+    rows start:stop of those blocks.
+
+    Args:
+        spec (tuple): the shared array specs for cust_ids, days and in_florence,
+            the spec of the output codes, start, stop, only_start and
+            gap_length
+
+    Returns:
+        tuple (numpy.ndarray, numpy.ndarray): positions, in the shared arrays,
+            of the first and last day of each trip in the shard
+    """
+
+    from multiprocessing import shared_memory
+
+    inputs, output, start, stop, only_start, gap_length = spec
+
+    blocks = [shared_memory.SharedMemory(name=name)
+              for name, _, _ in inputs + [output]]
+
+    try:
+        cust_ids, days, in_florence, codes = [
+            np.ndarray(shape, dtype=dtype, buffer=block.buf)[start:stop]
+            for (_, shape, dtype), block in zip(inputs + [output], blocks)]
+
+        codes[:] = label_trips(cust_ids, days, in_florence,
+                               only_start=only_start, gap_length=gap_length)
+        _, trip_starts, trip_ends = number_trips(cust_ids, codes)
+
+        # Views must be released before the blocks can be closed
+        del cust_ids, days, in_florence, codes
+
+    finally:
+        for block in blocks:
+            block.close()
+
+    return trip_starts + start, trip_ends + start
+
+
+def segment_trips_parallel(cust_ids, dates, calls_in_florence,
+                           calls_near_airport, workers, only_start=False,
+                           gap_length=3):
+    """
+    Segments customer days into trips like segment_trips, with the customers
+    hash partitioned into one shard per worker and each shard labeled in a
+    separate process. The shards are handed to the workers as shared memory
+    buffers, only their slice bounds are pickled, and the per shard trip tables
+    are merged back in the original row order. Falls back to segment_trips
+    where shared memory is not available (before Python 3.8).
+
+    Args:
+        cust_ids (numpy.ndarray): integer customer id of each row
+        dates (numpy.ndarray): date of each row
+        calls_in_florence (numpy.ndarray): number of calls in Florence city
+        calls_near_airport (numpy.ndarray): number of calls near the airport
+        workers (int): the number of worker processes and shards
+        only_start (bool): whether to skip the 'last' and 'end' labels
+        gap_length (int): the gap in days from which a new trip starts
+
+    Returns:
+        tuple (numpy.ndarray, numpy.ndarray, Pandas.DataFrame): the same output
+            as segment_trips
+    """
+
+    cust_ids = np.asarray(cust_ids)
+    n = len(cust_ids)
+
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import shared_memory
+    except ImportError:
+        if workers > 1:
+            log.warning('Shared memory is not available, segmenting trips in '
+                        'a single process')
+        workers = 1
+
+    if workers <= 1 or n == 0:
+        return segment_trips(cust_ids, dates, calls_in_florence,
+                             calls_near_airport, only_start=only_start,
+                             gap_length=gap_length)
+
+    days = np.asarray(dates).astype('datetime64[D]')
+    in_florence = (np.asarray(calls_in_florence) > 0) | \
+                  (np.asarray(calls_near_airport) > 0)
+
+    # A stable sort keeps the (cust_id, date) order within every shard
+    shards = hash_customers(cust_ids, workers)
+    order = np.argsort(shards, kind='mergesort')
+    bounds = np.searchsorted(shards[order], np.arange(workers + 1))
+
+    blocks = []
+
+    try:
+        inputs = []
+        for array in (cust_ids, days, in_florence):
+            block, spec = share_array(array[order])
+            blocks.append(block)
+            inputs.append(spec)
+
+        block, output = share_array(np.zeros(n, dtype=np.int8))
+        blocks.append(block)
+
+        specs = [(inputs, output, bounds[i], bounds[i + 1], only_start,
+                  gap_length) for i in range(workers)
+                 if bounds[i + 1] > bounds[i]]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(segment_shard, specs))
+
+        codes = np.empty(n, dtype=np.int8)
+        codes[order] = np.ndarray(n, dtype=np.int8, buffer=block.buf)
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    trip_starts = order[np.concatenate([r[0] for r in results])]
+    trip_ends = order[np.concatenate([r[1] for r in results])]
+
+    # Trips of one customer are contiguous rows in both orders, so sorting by
+    # first day numbers them exactly as segment_trips does
+    by_start = np.argsort(trip_starts)
+    trip_starts = trip_starts[by_start]
+    trip_ends = trip_ends[by_start]
+
+    numbers = np.arange(1, len(trip_starts) + 1, dtype=np.int32)
+    trip_ids = np.zeros(n + 1, dtype=np.int32)
+    trip_ids[trip_starts] += numbers
+    trip_ids[trip_ends + 1] -= numbers
+    trip_ids = np.cumsum(trip_ids[:-1], dtype=np.int32)
+
+    trips = make_trip_table(cust_ids, dates, trip_starts, trip_ends)
+
+    return codes, trip_ids, trips
+
+
+def get_trips(counts, only_start=False, gap_length=3, workers=1):
+    """
+    Labels the daily call counts with trips to Florence using segment_trips,
+    or segment_trips_parallel when more than one worker is requested.
+
+    Args:
+        counts (Pandas.DataFrame): The time series data from
+                                   get_daily_call_counts, sorted by customer
+                                   and date
+        only_start (bool): whether to skip the 'last' and 'end' labels
+        gap_length (int): the gap in days from which a new trip starts
+        workers (int): the number of processes to segment with
+
+    Returns:
+        tuple (Pandas.DataFrame, Pandas.DataFrame): the counts with the added
+            columns in_florence, calls_out_florence, out_florence, trip,
+            on_trip and trip_id, and the length of each trip indexed by
+            cust_id and trip_id
+    """
+
+    codes, trip_ids, trips = segment_trips_parallel(
+        counts['cust_id'].values, counts['date'].values,
+        counts['calls_in_florence'].values, counts['calls_near_airport'].values,
+        workers, only_start=only_start, gap_length=gap_length)
+
+    first_row, _ = get_customer_boundaries(counts['cust_id'].values)
+
+    counts['same_cust'] = ~first_row
+    counts.loc[first_row, 'date_diff'] = None
+
+    counts['in_florence'] = (counts['calls_in_florence'] > 0) | \
+                            (counts['calls_near_airport'] > 0)
+    counts['calls_out_florence'] = counts['calls'] - counts['calls_in_florence']
+    counts['out_florence'] = counts['calls_out_florence'] > 0
+
+    counts['trip'] = pd.Categorical.from_codes(codes, TRIP_LABELS)
+    counts['on_trip'] = codes != NOT_ON_TRIP
+    counts['trip_id'] = trip_ids
+
+    trips_group = trips.set_index(['cust_id', 'trip_id'])[['length']]
+    trips_group.columns = [0]
 
     return counts, trips_group
 
@@ -266,11 +816,12 @@ def get_trip_length_for_onetime_visitors(grouped_counts):
     return frequency(df, 0)
 
 
-def main():
-    connection = dbutils.connect()
-
-    italian_trips, italian_grouped = get_italian_trips(connection)
-    foreign_trips, foreign_grouped = get_foreign_trips(connection)
+def main(workers=1):
+    with dbutils.connection() as connection:
+        italian_trips, italian_grouped = get_italian_trips(connection,
+                                                           workers=workers)
+        foreign_trips, foreign_grouped = get_foreign_trips(connection,
+                                                           workers=workers)
 
     italian_lengths = get_trip_length_for_onetime_visitors(italian_grouped)
     foreign_lengths = get_trip_length_for_onetime_visitors(foreign_grouped)
@@ -4,12 +4,14 @@ by the fountain visualization made with Deck.GL
 """
 
 from utils.database import dbutils
+from utils.streaming import json_stream
 from features import network_analysis as na
 from output import cdr_fountain as cdr
 import json
 import os
+import numpy as np
 import pandas as pd
-import math
+from collections import defaultdict
 
 
 class FountainType:
@@ -17,6 +19,30 @@ class FountainType:
     CDR = 2
 
 
+class OutputFormat:
+    GEOJSON = 'geojson'
+    BINARY = 'binary'
+
+
+# Start of every binary fountain file, followed by the format version and the
+# length of the JSON header as little-endian uint32
+BINARY_FOUNTAIN_MAGIC = b'FNTN'
+BINARY_FOUNTAIN_VERSION = 1
+
+# Numpy dtype of each typed array type in a binary fountain file
+BINARY_BUFFER_TYPES = {
+    'Float32Array': '<f4',
+    'Uint32Array': '<u4'
+}
+
+# Semi-major axis in meters and squared eccentricity of the WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+# Unit circle points already computed, keyed by the number of points
+circle_templates = {}
+
+
 def create_geojson(
         nodes,
         edges,
@@ -52,7 +78,85 @@ def create_geojson(
         tuple (dict, dict): the geojson object containing all of the feature
             definitions and the object containing all the location names by id
     """
-    location_dict = {
+    location_dict = create_location_dict()
+
+    features = list(iter_features(nodes, edges, location_dict,
+                                  to_col_name=to_col_name,
+                                  from_col_name=from_col_name,
+                                  weight_col_name=weight_col_name,
+                                  geometries=geometries, props=props,
+                                  fountain_type=fountain_type))
+
+    geojson = {
+        'type': 'FeatureCollection',
+        'features': features
+    }
+
+    return geojson, location_dict
+
+
+def iter_features(
+        nodes,
+        edges,
+        location_dict,
+        to_col_name="to",
+        from_col_name="from",
+        weight_col_name="weight",
+        geometries=None,
+        props=None,
+        fountain_type=FountainType.CDR
+):
+    """
+    Create the geojson features of the fountain one node at a time, so they
+    can be written out as they are made instead of being held in a list. The
+    edges are indexed and the node circles created once before the first
+    feature.
+
+    Args:
+        nodes (list): The list of nodes that will be used for the visualization.
+            Each node in the list is a tuple of (id, lat, lon, name, full_name)
+        edges (Pandas.DataFrame): The weight for each edge to and from a pair
+            of nodes contained in the node list. Should contain a column for to,
+            from, and weight of that edge. Optional args for those column names.
+        location_dict (dict): dictionary of all of the names and printable names
+            for every location by node_id, filled in as the features are made
+        to_col_name (string): Name of the edges DataFrame column for to node
+        from_col_name (string): Name of the edges DataFrame column for from node
+        weight_col_name (string): Name of the edges DataFrame column for weight
+        geometries (dict): polygon geometry and area for each unique region id
+        props (dict): Additional properties to include in a geojson Feature
+        fountain_type (int): Type of fountain to create feature for
+
+    Yields:
+        dict: the geojson feature of each node, in the order of the nodes
+    """
+
+    updated_edges = create_percentage_columns(edges, to_col_name,
+                                              from_col_name, weight_col_name)
+
+    edge_index = create_edge_index(updated_edges, to_col_name, from_col_name,
+                                   weight_col_name)
+    geometries = create_node_geometries(nodes, geometries)
+
+    for datum in nodes:
+        yield create_feature(datum, updated_edges, location_dict,
+                             geometries=geometries,
+                             props=props,
+                             to_col_name=to_col_name,
+                             from_col_name=from_col_name,
+                             weight_col_name=weight_col_name,
+                             fountain_type=fountain_type,
+                             edge_index=edge_index)
+
+
+def create_location_dict():
+    """
+    Returns:
+        dict: the names and printable names of the locations that are not
+            fountain nodes, by id
+    """
+
+    return {
         'source': {
             'name': 'Unknown',
             'fullName': 'Unknown'
@@ -69,47 +173,43 @@ def create_geojson(
         }
     }
 
-    groupby_names = [to_col_name, from_col_name, weight_col_name]
-    group_perc = create_percentage_column(edges, 'perc_to', weight_col_name,
-                                          groupby_names)
-    groupby_names = [from_col_name, to_col_name, weight_col_name, 'perc_to']
-    updated_edges = create_percentage_column(group_perc, 'perc_from',
-                                             weight_col_name, groupby_names)
-
-    features = [create_feature(f, updated_edges, location_dict,
-                               geometries=geometries,
-                               props=props,
-                               fountain_type=fountain_type) for f in nodes]
-
-    geojson = {
-        'type': 'FeatureCollection',
-        'features': features
-    }
-
-    return geojson, location_dict
-
 
-def create_percentage_column(df, perc_col_name, weight_col_name, group_names):
+def create_percentage_columns(edges, to_col_name="to", from_col_name="from",
+                              weight_col_name="weight"):
     """
-    Takes a dataframe with a weight column and calculates what percentage each
-    weight is of the total sum of all of the weights.
+    Calculates what percentage each edge weight is of the total weight into
+    its to node (perc_to) and out of its from node (perc_from). The to and
+    from ids are factorized together once and the node totals come from a
+    bincount over the codes.
 
     Args:
-    df (Pandas.DataFrame): dataframe to add a percentage column to
-    perc_col_name (string): name to give to the new percentage column
-    weight_col_name (string): name of the column to be used for the percentage
-        calculation
-    group_names (list): list of the names of the columns on which to groupby
+        edges (Pandas.DataFrame): the edges, with to, from and weight columns
+        to_col_name (string): Name of the edges DataFrame column for to node
+        from_col_name (string): Name of the edges DataFrame column for from node
+        weight_col_name (string): Name of the edges DataFrame column for weight
 
     Returns:
+        Pandas.DataFrame: a copy of the edges that have both node ids, in the
+            same order, with perc_to and perc_from columns added
     """
-    df[perc_col_name] = df[weight_col_name]
-    group_sum = df.groupby(group_names).agg({perc_col_name: 'sum'})
 
-    group_perc = group_sum.groupby(level=0) \
-        .apply(lambda x: 100 * x / float(x.sum()))
+    edges = edges[edges[to_col_name].notnull() &
+                  edges[from_col_name].notnull()].copy()
+
+    weights = edges[weight_col_name].values.astype(np.float64)
+
+    codes, ids = pd.factorize(np.concatenate([edges[to_col_name].values,
+                                              edges[from_col_name].values]))
+    to_codes, from_codes = codes[:len(edges)], codes[len(edges):]
+
+    to_totals = np.bincount(to_codes, weights=weights, minlength=len(ids))
+    from_totals = np.bincount(from_codes, weights=weights, minlength=len(ids))
 
-    return group_perc.reset_index()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edges['perc_to'] = 100 * weights / to_totals[to_codes]
+        edges['perc_from'] = 100 * weights / from_totals[from_codes]
+
+    return edges
 
 
 def process_geometries_geojson(geometries):
@@ -142,7 +242,8 @@ def create_feature(
         to_col_name="to",
         from_col_name="from",
         weight_col_name="weight",
-        fountain_type=FountainType.CDR
+        fountain_type=FountainType.CDR,
+        edge_index=None
 ):
     """
     Create a feature geojson object for the specified node in the fountain
@@ -162,6 +263,8 @@ def create_feature(
         weight_col_name (string): Name of the edges DataFrame column for to node
             Only used for creating geojson from CDR data, not museums
         fountain_type (int): Type of fountain to create feature for
+        edge_index (tuple): the flows of every node from create_edge_index,
+            built from edges if None. Pass it when creating many features
 
     Returns (dict): a geojson feature definition object for the supplied datum
     """
@@ -171,12 +274,11 @@ def create_feature(
     lon = float(lon)
     node_id = str(node_id)
 
-    edges[to_col_name] = edges[to_col_name].apply(
-        lambda row: str(int(row)) if isinstance(row, float) else str(row))
-    edges[from_col_name] = edges[from_col_name].apply(
-        lambda row: str(int(row)) if isinstance(row, float) else str(row))
+    if edge_index is None:
+        edge_index = create_edge_index(edges, to_col_name, from_col_name,
+                                       weight_col_name)
 
-    edges = edges.loc[(edges[to_col_name] == node_id) | (edges[from_col_name] == node_id)]
+    in_flows, out_flows, in_weights = edge_index
 
     if geometries is not None and node_id in geometries:
         geometry = geometries[node_id]['geometry']
@@ -188,8 +290,7 @@ def create_feature(
         start_props = props[node_id]
 
     if fountain_type is FountainType.MUSEUM:
-        total_fc_visits = edges[(edges[to_col_name] == node_id)].sum()
-        total_fc_visits = str(int(total_fc_visits[weight_col_name]))
+        total_fc_visits = str(int(in_weights.get(node_id, 0)))
         if start_props is not None:
             start_props['totalFcVisits'] = total_fc_visits
         else:
@@ -199,7 +300,9 @@ def create_feature(
         'type': 'Feature',
         'geometry': geometry,
         'properties': create_properties(node_id, name, full_name, [lon, lat],
-                                        edges, location_dict, props=start_props)
+                                        (in_flows.get(node_id, {}),
+                                         out_flows.get(node_id, {})),
+                                        location_dict, props=start_props)
     }
 
     return feature
@@ -253,7 +356,7 @@ def create_circle(lat, lon, radius=18, num_points=20):
     Args:
         lat: the center latitude for the polygon
         lon: the center longitude for the polygon
-        radius (int): the radius of the circle polygon
+        radius (int): the radius of the circle polygon in meters
         num_points (int): number of discrete sample points to be generated along
             the circle
 
@@ -261,20 +364,97 @@ def create_circle(lat, lon, radius=18, num_points=20):
         list: a list of lat/lon points defining a somewhat circular polygon
     """
 
-    points = []
-    for k in range(num_points):
-        # compute
-        angle = math.pi * 2 * k / num_points
-        dx = radius * math.cos(angle)
-        dy = radius * math.sin(angle)
+    return create_circles([lat], [lon], radius, num_points)[0].tolist()
+
+
+def get_circle_template(num_points):
+    """
+    Gets the points of the unit circle used for every circle polygon with the
+    same number of points, computing them only once.
+
+    Args:
+        num_points (int): number of points along the circle
+
+    Returns:
+        numpy.ndarray: the (num_points x 2) cos and sin of the point angles
+    """
+
+    if num_points not in circle_templates:
+        angles = 2 * np.pi * np.arange(num_points) / num_points
+        circle_templates[num_points] = np.column_stack([np.cos(angles),
+                                                        np.sin(angles)])
 
-        new_lat = lat + (180 / math.pi) * (dy / 6378137)
-        new_lon = lon + (180 / math.pi) * (dx / 6378137) / math.cos(
-            lat * math.pi / 180)
+    return circle_templates[num_points]
 
-        points.append([round(new_lon, 7), round(new_lat, 7)])
 
-    return points
+def create_circles(lats, lons, radius=18, num_points=20):
+    """
+    Create the circle polygons of many nodes at once. Offsets in meters are
+    turned into degrees with the radii of curvature of the WGS84 ellipsoid at
+    each latitude, so the circles are round on the ground to well under a
+    meter at the scale of a city.
+
+    Args:
+        lats (numpy.ndarray): the center latitude of each polygon
+        lons (numpy.ndarray): the center longitude of each polygon
+        radius (float): the radius of the circles in meters
+        num_points (int): number of points along each circle
+
+    Returns:
+        numpy.ndarray: (nodes x num_points x 2) lon/lat points rounded to 7
+            decimals, use tolist for geojson coordinates
+    """
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    phi = np.radians(lats)
+    w2 = 1 - WGS84_E2 * np.sin(phi) ** 2
+
+    # Meridional and prime vertical radii of curvature
+    meridian = WGS84_A * (1 - WGS84_E2) / w2 ** 1.5
+    prime_vertical = WGS84_A / np.sqrt(w2)
+
+    degrees = np.degrees(radius * np.column_stack([
+        1 / (prime_vertical * np.cos(phi)), 1 / meridian]))
+
+    points = np.stack([lons, lats], axis=-1)[:, None, :] + \
+        get_circle_template(num_points)[None, :, :] * degrees[:, None, :]
+
+    return np.round(points, 7)
+
+
+def create_node_geometries(nodes, geometries=None, radius=18, num_points=20):
+    """
+    Get the geometry of every fountain node, creating the circles of all the
+    nodes without a geometry at once.
+
+    Args:
+        nodes (list): the fountain nodes, tuples of
+            (id, lat, lon, name, full_name)
+        geometries (dict): polygon geometry and area for each unique node id
+        radius (float): the radius of the circles in meters
+        num_points (int): number of points along each circle
+
+    Returns:
+        dict: the given geometries, plus a circle Polygon geometry for each
+            other node id
+    """
+
+    geometries = dict(geometries or {})
+    missing = [datum for datum in nodes if str(datum[0]) not in geometries]
+
+    if missing:
+        circles = create_circles([float(datum[1]) for datum in missing],
+                                 [float(datum[2]) for datum in missing],
+                                 radius, num_points)
+
+        for datum, circle in zip(missing, circles.tolist()):
+            geometries[str(datum[0])] = {
+                'geometry': {'type': 'Polygon', 'coordinates': [circle]}
+            }
+
+    return geometries
 
 
 def create_properties(
@@ -282,7 +462,7 @@ def create_properties(
         name,
         full_name,
         centroid,
-        edges,
+        flows,
         location_dict,
         props=None
 ):
@@ -298,9 +478,7 @@ def create_properties(
         name (string): the shorthand name of the node
         full_name: the long version of the name of the node
         centroid (list): the center lat/lon of the node
-        edges (Pandas.DataFrame): The weight for each edge to and from a pair
-            of nodes contained in the node list. Should contain a column for to,
-            from, and weight of that edge.
+        flows (tuple): the in and out flows of the node, see create_flows
         location_dict (dict): dictionary of all of the names and printable names
             for every location by id.
         props (dict): the optional starting properties for each unique id node
@@ -308,7 +486,7 @@ def create_properties(
     Returns:
         dict: the newly created properties object for the geojson feature
     """
-    in_flows, out_flows = create_flows(edges, node_id)
+    in_flows, out_flows = flows
 
     if props is None:
         props = {}
@@ -330,11 +508,70 @@ def create_properties(
     return props
 
 
+def format_node_ids(ids):
+    """
+    Format node ids from an edges DataFrame column as strings, writing float
+    ids as integers.
+
+    Args:
+        ids (Pandas.Series): the node ids
+
+    Returns:
+        Pandas.Series: the string node ids
+    """
+
+    if ids.dtype.kind == 'f':
+        return ids.astype(np.int64).astype(str)
+
+    return ids.map(lambda row: str(int(row)) if isinstance(row, float)
+                   else str(row))
+
+
+def create_edge_index(edges, to_col_name="to", from_col_name="from",
+                      weight_col_name="weight"):
+    """
+    Group the edges by node in a single pass, so that the flows of every node
+    of the fountain come from one lookup instead of a scan of all the edges.
+
+    Args:
+        edges (Pandas.DataFrame): The weight for each edge to and from a pair
+            of nodes, with the perc_to and perc_from columns from
+            create_percentage_columns. Optional args for the column names.
+        to_col_name (string): Name of the edges DataFrame column for to node
+        from_col_name (string): Name of the edges DataFrame column for from node
+        weight_col_name (string): Name of the edges DataFrame column for weight
+
+    Returns:
+        tuple (dict, dict, dict): the in flows and the out flows of each node
+            id, as returned by create_flows, and the total weight of the edges
+            into each node id
+    """
+
+    to_ids = format_node_ids(edges[to_col_name]).tolist()
+    from_ids = format_node_ids(edges[from_col_name]).tolist()
+    weights = edges[weight_col_name].tolist()
+
+    in_flows = defaultdict(dict)
+    out_flows = defaultdict(dict)
+    in_weights = defaultdict(int)
+
+    for to_id, from_id, weight, perc_to, perc_from in zip(
+            to_ids, from_ids, weights, edges['perc_to'].tolist(),
+            edges['perc_from'].tolist()):
+
+        in_flows[to_id][from_id] = {'weight': weight, 'percentage': perc_to}
+        out_flows[from_id][to_id] = {'weight': weight, 'percentage': perc_from}
+        in_weights[to_id] += weight
+
+    return dict(in_flows), dict(out_flows), dict(in_weights)
+
+
 def create_flows(edges, node_id, to_col_name="to", from_col_name="from",
                  weight_col_name="weight"):
     """
     Create the geojson property object that enumerates the flow volume to and
-    from a location for the fountain.
+    from a location for the fountain. Use create_edge_index to get the flows
+    of many nodes.
 
     Args:
         edges (Pandas.DataFrame): The weight for each edge to and from a pair
@@ -350,32 +587,12 @@ def create_flows(edges, node_id, to_col_name="to", from_col_name="from",
         tuple (dict, dict): the objects for the flows in and out of the node to
             each other node in the fountain for which there is a directed edge
     """
-    in_flows = {}
-    out_flows = {}
-    in_edges = edges.loc[(edges[to_col_name] == node_id)]
-    out_edges = edges.loc[(edges[from_col_name] == node_id)]
 
-    for index, edge in in_edges.iterrows():
-        from_id = edge[from_col_name]
-        if isinstance(from_id, float):
-            from_id = int(from_id)
-
-        in_flows[from_id] = {
-            'weight': edge[weight_col_name],
-            'percentage': edge['perc_to']
-        }
-
-    for index, edge in out_edges.iterrows():
-        to_id = edge[to_col_name]
-        if isinstance(to_id, float):
-            to_id = int(to_id)
-
-        out_flows[to_id] = {
-            'weight': edge[weight_col_name],
-            'percentage': edge['perc_from']
-        }
+    in_flows, out_flows, _ = create_edge_index(edges, to_col_name,
+                                               from_col_name, weight_col_name)
+    node_id = str(node_id)
 
-    return in_flows, out_flows
+    return in_flows.get(node_id, {}), out_flows.get(node_id, {})
 
 
 def format_cdr_properties(
@@ -386,7 +603,22 @@ def format_cdr_properties(
 ):
     """
     Converts the format of additional CDR properties from being in a DataFrame
-    to being in a dictionary indexed by the tower node id
+    to being in a dictionary indexed by the tower node id. Each density is
+    divided by the area of its tower's geometry and then by the largest of
+    these, so the densest tower per unit area has a density of 1. Towers
+    without a geometry with a positive area have no density. Only the first
+    row of each tower is used.
+
+    For example, with areas of 2 and 4 for towers 1 and 2, densities of 10, 40
+    and 5 for towers 1, 2 and 3 become 0.5, 1 and None:
+
+    >>> geometries = {'1': {'geometry': None, 'area': 2},
+    ...               '2': {'geometry': None, 'area': 4}}
+    >>> densities = pd.DataFrame({'tower_id': [1.0, 2.0, 3.0],
+    ...                           'density': [10, 40, 5]})
+    >>> props = format_cdr_properties(geometries, densities)
+    >>> [props[tower_id]['density'] for tower_id in ['1', '2', '3']]
+    [0.5, 1.0, None]
 
     Args:
         geometries (dict): object where the keys are the node id and the value
@@ -402,32 +634,33 @@ def format_cdr_properties(
             object with values for area and density of that node
     """
 
-    props = {}
-    ids = densities[id_col_name].unique()
-
-    for tower_id in ids:
-        area = None
-        tower_id = str(int(tower_id))
+    towers = densities.drop_duplicates(id_col_name)
+    tower_ids = format_node_ids(towers[id_col_name]).values
 
-        if tower_id in geometries:
-            area = geometries[tower_id]['area']
+    areas = pd.Series({tower_id: geometry['area']
+                       for tower_id, geometry in geometries.items()},
+                      dtype=object)
+    areas = np.array(areas.reindex(tower_ids), dtype=object)
+    known = pd.notnull(areas)
 
-        density = None
-        densities[id_col_name] = densities[id_col_name].apply(int).apply(str)
+    positive = known.copy()
+    positive[known] = areas[known].astype(np.float64) > 0
 
-        if area is not None and area > 0:
-            densities[density_col_name] = densities[density_col_name] / area
+    tower_densities = np.full(len(towers), np.nan)
+    tower_densities[positive] = \
+        towers[density_col_name].values[positive] / \
+        areas[positive].astype(np.float64)
 
-        maximum = densities[density_col_name].max()
-        densities[density_col_name] = densities[density_col_name] / maximum
+    if positive.any():
+        tower_densities /= np.nanmax(tower_densities)
 
-        first_match = densities[densities[id_col_name] == tower_id].head(1)
-        if not first_match.empty:
-            density = first_match[density_col_name].iloc[0]
+    tower_densities = tower_densities.astype(object)
+    tower_densities[pd.isnull(tower_densities)] = None
+    areas[~known] = None
 
-        props[tower_id] = {'area': area, 'density': density}
-
-    return props
+    return {tower_id: {'area': area, 'density': density}
+            for tower_id, area, density
+            in zip(tower_ids, areas, tower_densities)}
 
 
 def format_firenzecard_properties(
@@ -437,7 +670,14 @@ def format_firenzecard_properties(
 ):
     """
     Converts the format of additional museum properties from being in a
-    DataFrame to being in a dictionary indexed by the museum node id
+    DataFrame to being in a dictionary indexed by the museum node id. Only the
+    first row of each museum is used.
+
+    >>> museums = pd.DataFrame({'museum_id': [3, 5, 3],
+    ...                         'visitors': [10, 20, 30]})
+    >>> props = format_firenzecard_properties(museums)
+    >>> [(museum_id, props[museum_id]) for museum_id in sorted(props)]
+    [('3', {'totalVisits': 10}), ('5', {'totalVisits': 20})]
 
     Args:
         museums (Pandas.DataFrame): DataFrame with column with museum id and
@@ -452,32 +692,307 @@ def format_firenzecard_properties(
             aka total visitors, to that museum.
     """
 
-    props = {}
-    ids = museums[id_col_name].unique()
+    museums = museums.drop_duplicates(id_col_name)
 
-    for museum_id in ids:
-        museum_id = str(int(museum_id))
-        museums[id_col_name] = museums[id_col_name].apply(str)
-        first_match = museums[museums[id_col_name] == museum_id].head(1)
+    return {museum_id: {'totalVisits': total_visits}
+            for museum_id, total_visits
+            in zip(format_node_ids(museums[id_col_name]),
+                   museums[visitors_col_name].tolist())}
 
-        total_visits = None
-        if not first_match.empty:
-            total_visits = first_match[visitors_col_name].iloc[0]
 
-        props[str(museum_id)] = {'totalVisits': total_visits}
+def create_binary_fountain(
+        nodes,
+        edges,
+        to_col_name="to",
+        from_col_name="from",
+        weight_col_name="weight",
+        geometries=None,
+        props=None,
+        fountain_type=FountainType.CDR
+):
+    """
+    Create the flat typed arrays of a binary fountain, an alternative to
+    create_geojson that the browser can load without parsing the flows. Node
+    attributes are one array per attribute, indexed by node number. The nodes
+    are the fountain nodes followed by any other location found in the edges,
+    such as the start and end of day. Edges are sorted by to node, so the in
+    flows of node i are edges inOffsets[i] to inOffsets[i + 1]. The out flows
+    of node i are the edges listed in outEdges from outOffsets[i] to
+    outOffsets[i + 1]. Node polygons are rings of lon, lat coordinates: the
+    rings of node i are nodeRings[i] to nodeRings[i + 1] and the coordinates
+    of ring r are 2 * ringOffsets[r] to 2 * ringOffsets[r + 1].
 
-    return props
+    Args:
+        nodes (list): The list of nodes that will be used for the visualization.
+            Each node in the list is a tuple of (id, lat, lon, name, full_name)
+            with a unique id
+        edges (Pandas.DataFrame): The weight for each edge to and from a pair
+            of nodes contained in the node list. Should contain a column for to,
+            from, and weight of that edge. Optional args for those column names.
+        to_col_name (string): Name of the edges DataFrame column for to node
+        from_col_name (string): Name of the edges DataFrame column for from node
+        weight_col_name (string): Name of the edges DataFrame column for weight
+        geometries (dict): polygon geometry and area for each unique region id
+        props (dict): Additional properties of each node id. Numeric properties
+            become Float32 arrays with NaN for missing values, others are kept
+            in the header
+        fountain_type (int): Type of fountain to create
+
+    Returns:
+        tuple (dict, list, dict): the header, the list of (name, numpy.ndarray)
+            buffers in file order and the object containing all the location
+            names by id
+    """
+
+    location_dict = create_location_dict()
+
+    updated_edges = create_percentage_columns(edges, to_col_name,
+                                              from_col_name, weight_col_name)
+    to_ids = format_node_ids(updated_edges[to_col_name]).values
+    from_ids = format_node_ids(updated_edges[from_col_name]).values
+
+    feature_ids = [str(datum[0]) for datum in nodes]
+
+    # Node attributes are stored by position, a repeated id would put them
+    # out of step with the ids
+    duplicates = pd.Index(feature_ids)[pd.Index(feature_ids).duplicated()]
+    if len(duplicates):
+        raise ValueError('Duplicate fountain node ids: %s'
+                         % ', '.join(sorted(set(duplicates))))
+
+    ids = pd.Index(feature_ids).append(
+        pd.Index(np.concatenate([to_ids, from_ids]))).unique()
+    n_ids = len(ids)
+
+    to_codes = ids.get_indexer(to_ids)
+    from_codes = ids.get_indexer(from_ids)
+    weights = updated_edges[weight_col_name].values.astype(np.float64)
+
+    in_order = np.argsort(to_codes, kind='mergesort')
+    to_codes, from_codes = to_codes[in_order], from_codes[in_order]
+    out_edges = np.argsort(from_codes, kind='mergesort')
+
+    lon = np.full(n_ids, np.nan)
+    lat = np.full(n_ids, np.nan)
+    names = []
+    full_names = []
+
+    for i, (node_id, node_lat, node_lon, name, full_name) in enumerate(nodes):
+        lon[i], lat[i] = float(node_lon), float(node_lat)
+        location_dict[str(node_id)] = {'name': name, 'fullName': full_name}
+
+    for node_id in ids:
+        location = location_dict.get(node_id, {})
+        names.append(location.get('name', node_id))
+        full_names.append(location.get('fullName', node_id))
+
+    node_rings = [0]
+    ring_offsets = [0]
+    coordinates = []
+    geometries = create_node_geometries(nodes, geometries)
+
+    for node_id in feature_ids:
+        geometry = geometries[node_id]['geometry']
+        polygons = geometry['coordinates']
+        if geometry['type'] == 'Polygon':
+            polygons = [polygons]
+
+        for polygon in polygons:
+            for ring in polygon:
+                coordinates.extend(ring)
+                ring_offsets.append(len(coordinates))
+
+        node_rings.append(len(ring_offsets) - 1)
+
+    node_props = {}
+    for i, node_id in enumerate(feature_ids):
+        for key, value in (props or {}).get(node_id, {}).items():
+            node_props.setdefault(key, [None] * n_ids)[i] = value
+
+    if fountain_type is FountainType.MUSEUM:
+        node_props['totalFcVisits'] = np.bincount(to_codes,
+                                                  weights=weights[in_order],
+                                                  minlength=n_ids)
+
+    buffers = [
+        ('lon', lon),
+        ('lat', lat),
+        ('to', to_codes),
+        ('from', from_codes),
+        ('weight', weights[in_order]),
+        ('percTo', updated_edges['perc_to'].values[in_order]),
+        ('percFrom', updated_edges['perc_from'].values[in_order]),
+        ('inOffsets', np.append(0, np.cumsum(np.bincount(to_codes,
+                                                         minlength=n_ids)))),
+        ('outEdges', out_edges),
+        ('outOffsets', np.append(0, np.cumsum(np.bincount(from_codes,
+                                                          minlength=n_ids)))),
+        ('nodeRings', np.array(node_rings)),
+        ('ringOffsets', np.array(ring_offsets)),
+        ('coordinates', np.array(coordinates, dtype=np.float64).ravel())
+    ]
 
+    header = {
+        'version': BINARY_FOUNTAIN_VERSION,
+        'fountainType': fountain_type,
+        'featureCount': len(feature_ids),
+        'ids': ids.tolist(),
+        'names': names,
+        'fullNames': full_names,
+        'properties': {},
+        'buffers': []
+    }
+
+    for key, values in sorted(node_props.items()):
+        try:
+            values = np.array([np.nan if value is None else float(value)
+                               for value in values])
+        except (TypeError, ValueError):
+            header['properties'][key] = values
+            continue
+
+        buffers.append((key, values))
+
+    byte_offset = 0
+    for i, (name, values) in enumerate(buffers):
+        if values.dtype.kind == 'f':
+            array_type = 'Float32Array'
+        else:
+            array_type = 'Uint32Array'
+
+        values = values.astype(BINARY_BUFFER_TYPES[array_type])
+        buffers[i] = (name, values)
+
+        header['buffers'].append({'name': name, 'type': array_type,
+                                  'byteOffset': byte_offset,
+                                  'length': len(values)})
+        byte_offset += values.nbytes
+
+    return header, buffers, location_dict
+
+
+def write_binary_fountain(path, header, buffers):
+    """
+    Write a binary fountain file: the magic bytes, the version and the header
+    length as little-endian uint32, the JSON header padded with spaces to a
+    multiple of 4 bytes, then the buffers one after another. Every buffer
+    starts on a 4 byte boundary, so the app can view it with a typed array
+    over the downloaded ArrayBuffer without copying.
+
+    Args:
+        path (string): file path for the output
+        header (dict): the header from create_binary_fountain
+        buffers (list): the (name, numpy.ndarray) buffers from
+            create_binary_fountain
+    """
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 4)
 
-def firenzecard_main(db_connection, fountain_json_path, dict_path):
+    with open(path, 'wb') as outfile:
+        outfile.write(BINARY_FOUNTAIN_MAGIC)
+        outfile.write(np.array([BINARY_FOUNTAIN_VERSION, len(header_bytes)],
+                               dtype='<u4').tobytes())
+        outfile.write(header_bytes)
+
+        for _, values in buffers:
+            outfile.write(values.tobytes())
+
+
+def read_binary_fountain(path):
+    """
+    Read a binary fountain file written by write_binary_fountain.
+
+    Args:
+        path (string): file path of the binary fountain
+
+    Returns:
+        tuple (dict, dict): the header and the buffers as numpy arrays by name
+    """
+
+    with open(path, 'rb') as infile:
+        data = infile.read()
+
+    if data[:len(BINARY_FOUNTAIN_MAGIC)] != BINARY_FOUNTAIN_MAGIC:
+        raise ValueError('%s is not a binary fountain file' % path)
+
+    start = len(BINARY_FOUNTAIN_MAGIC)
+    version, header_length = np.frombuffer(data, dtype='<u4', count=2,
+                                           offset=start)
+
+    if version != BINARY_FOUNTAIN_VERSION:
+        raise ValueError('Unsupported binary fountain version %d' % version)
+
+    start += 8
+    header = json.loads(data[start:start + header_length].decode('utf-8'))
+    start += header_length
+
+    buffers = {}
+    for buffer in header['buffers']:
+        buffers[buffer['name']] = np.frombuffer(
+            data, dtype=BINARY_BUFFER_TYPES[buffer['type']],
+            count=buffer['length'], offset=start + buffer['byteOffset'])
+
+    return header, buffers
+
+
+def save_fountain(nodes, edges, fountain_path, dict_path,
+                  output_format=OutputFormat.GEOJSON, indent=None,
+                  compress=None, **kwargs):
+    """
+    Create a fountain and write it with its node name dictionary. GeoJSON
+    features are written one at a time as they are made, so the whole feature
+    collection is never held in memory.
+
+    Args:
+        nodes (list): the fountain nodes, see create_geojson
+        edges (Pandas.DataFrame): the fountain edges, see create_geojson
+        fountain_path (string): file path for the fountain output
+        dict_path (string): file path for the node name dictionary JSON output
+        output_format (string): OutputFormat.GEOJSON for the GeoJSON feature
+            collection or OutputFormat.BINARY for create_binary_fountain
+        indent (int): indentation of the GeoJSON output, compact if None
+        compress (bool): whether to gzip the GeoJSON output, only if the path
+            ends with .gz if None
+        kwargs: any other arguments for iter_features or
+            create_binary_fountain
+    """
+
+    if output_format == OutputFormat.GEOJSON:
+        location_dict = create_location_dict()
+        geojson = {
+            'type': 'FeatureCollection',
+            'features': iter_features(nodes, edges, location_dict, **kwargs)
+        }
+
+        json_stream.dump(geojson, fountain_path, indent=indent,
+                         compress=compress)
+
+    elif output_format == OutputFormat.BINARY:
+        header, buffers, location_dict = create_binary_fountain(nodes, edges,
+                                                                **kwargs)
+        write_binary_fountain(fountain_path, header, buffers)
+
+    else:
+        raise ValueError('Unknown fountain output format %r, use %s or %s'
+                         % (output_format, OutputFormat.GEOJSON,
+                            OutputFormat.BINARY))
+
+    with open(dict_path, 'w') as outfile:
+        json.dump(location_dict, outfile, indent=2)
+
+
+def firenzecard_main(db_connection, fountain_json_path, dict_path,
+                     output_format=OutputFormat.GEOJSON):
     """
     Main function for producing the appropriate JSON files to feed into the
     Firenze card museum fountain visualization made with Deck.GL
 
     Args:
         db_connection (Psycopg.connection): The database connection
-        fountain_json_path (string): file path for the fountain JSON output
+        fountain_json_path (string): file path for the fountain output
         dict_path (string): file path for the node name dictionary JSON output
+        output_format (string): OutputFormat.GEOJSON or OutputFormat.BINARY
     """
 
     query = """
@@ -528,25 +1043,23 @@ def firenzecard_main(db_connection, fountain_json_path, dict_path):
     FROM optourism.firenze_card_logs
     """
 
-    network_df = pd.read_sql(network_query, con=db_connection)
+    network_df = dbutils.read_sql_copy(network_query, db_connection,
+                                       dtypes={'entry_time': 'datetime64[ns]',
+                                               'date': 'datetime64[ns]'})
     network_df['total_people'] = 1
     dynamic_edges = na.make_dynamic_firenze_card_edgelist(network_df,
                                                           location='museum_id')
 
     edges = na.make_static_firenze_card_edgelist(dynamic_edges)
-    geojson, location_dict = create_geojson(records, edges, props=props,
-                                            fountain_type=FountainType.MUSEUM)
-
-    with open(fountain_json_path, 'w') as outfile:
-        json.dump(geojson, outfile, indent=2)
-
-    with open(dict_path, 'w') as outfile:
-        json.dump(location_dict, outfile, indent=2)
+    save_fountain(records, edges, fountain_json_path, dict_path,
+                  output_format=output_format, props=props,
+                  fountain_type=FountainType.MUSEUM)
 
 
 def cdr_main(db_connection, table_name, fountain_json_path, dict_path,
              edges_pickle, density_pickle, end_nodes_path=None,
-             start_nodes_path=None, geojson_path=None):
+             start_nodes_path=None, geojson_path=None,
+             output_format=OutputFormat.GEOJSON):
     """
     Main function for producing the appropriate JSON files to feed into the
     Telecom CDR fountain visualization made with Deck.GL
@@ -555,7 +1068,7 @@ def cdr_main(db_connection, table_name, fountain_json_path, dict_path,
         db_connection (Psycopg.connection): The database connection
         table_name (string): The name of the table that contains the data from
             which to make the nodes and edges
-        fountain_json_path (string): file path for the fountain JSON output
+        fountain_json_path (string): file path for the fountain output
         dict_path (string): file path for the node name dictionary JSON output
         edges_pickle (string): file path for pickle object with edges
         density_pickle (string): file path for pickle object with node densities
@@ -564,6 +1077,7 @@ def cdr_main(db_connection, table_name, fountain_json_path, dict_path,
         start_nodes_path (string): file path for output csv of most common start
             nodes in ranked order
         geojson_path (string): file path for tower voronoi geojson definitions
+        output_format (string): OutputFormat.GEOJSON or OutputFormat.BINARY
     """
 
     query = """
@@ -613,27 +1127,18 @@ def cdr_main(db_connection, table_name, fountain_json_path, dict_path,
         voronoi_geometries = process_geometries_geojson(json.load(f))
 
     props = format_cdr_properties(voronoi_geometries, density)
-    geojson, location_dict = create_geojson(all_records, edges,
-                                            props=props,
-                                            geometries=voronoi_geometries)
-
-    with open(fountain_json_path, 'w') as outfile:
-        json.dump(geojson, outfile, indent=2)
-
-    with open(dict_path, 'w') as outfile:
-        json.dump(location_dict, outfile, indent=2)
+    save_fountain(all_records, edges, fountain_json_path, dict_path,
+                  output_format=output_format, props=props,
+                  geometries=voronoi_geometries)
 
 
 if __name__ == '__main__':
-    conn = dbutils.connect()
-
     curr_dir = os.path.dirname(os.path.abspath(__file__))
 
     output_path = os.path.join(curr_dir, 'output',
                                'museum_fountain.json')
     location_dict_path = os.path.join(curr_dir, 'output',
                                       'museum_dict.json')
-    firenzecard_main(conn, output_path, location_dict_path)
 
     cdr_path = os.path.join(curr_dir, 'output', 'cdr_daytripper_fountain.json')
     cdr_dict_path = os.path.join(curr_dir, 'output', 'cdr_daytripper_dict.json')
@@ -651,6 +1156,9 @@ if __name__ == '__main__':
 
     table_name = 'optourism.foreigners_daytripper_dwell_time'
 
-    cdr_main(conn, table_name, cdr_path, cdr_dict_path, edges_pickle,
-             density_pickle, end_nodes_path=end_node_csv,
-             start_nodes_path=start_node_csv, geojson_path=geojson_path)
+    with dbutils.connection() as conn:
+        firenzecard_main(conn, output_path, location_dict_path)
+
+        cdr_main(conn, table_name, cdr_path, cdr_dict_path, edges_pickle,
+                 density_pickle, end_nodes_path=end_node_csv,
+                 start_nodes_path=start_node_csv, geojson_path=geojson_path)
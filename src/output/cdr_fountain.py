@@ -2,23 +2,31 @@ import pandas as pd
 import numpy as np
 import os
 import json
-from ..utils.database import dbutils
+from utils.database import dbutils, query_cache
 
 
-def get_dwell_time_df(db_connection, table_name):
+def get_dwell_time_df(db_connection, table_name, use_cache=True):
     query = """
       SELECT
           cust_id,
           prev_cust_id,
           tower_id,
           prev_tower_id,
-          dwell_time,
+          EXTRACT(EPOCH FROM dwell_time)::bigint AS dwell_time_seconds,
           near_airport,
           in_florence_comune
         FROM %(name)s
     """ % {'name': table_name}
 
-    users = pd.read_sql(query, con=db_connection)
+    # The interval is read as whole seconds, the pinned pyarrow cannot store
+    # timedelta columns in the cache
+    users = query_cache.read_sql_cached(query, db_connection, [table_name],
+                                        dtypes={'near_airport': 'bool',
+                                                'in_florence_comune': 'bool'},
+                                        use_cache=use_cache,
+                                        reader=dbutils.read_sql_copy)
+    users['dwell_time'] = pd.to_timedelta(users.pop('dwell_time_seconds'),
+                                          unit='s')
 
     users['key'] = (
     (users['tower_id'] != users['prev_tower_id']) | (
@@ -125,5 +133,5 @@ def get_network_edges(connection,
 
 
 if __name__ == '__main__':
-    connection = dbutils.connect()
-    edges, densities = get_network_edges(connection)
+    with dbutils.connection() as connection:
+        edges, densities = get_network_edges(connection)
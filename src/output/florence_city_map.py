@@ -152,7 +152,6 @@ def plot_voronoi_per_hour(db_connection):
 
 
 if __name__ == '__main__':
-    connection = dbutils.connect()
-    plot_voronoi_per_hour(connection)
-    connection.close()
+    with dbutils.connection() as connection:
+        plot_voronoi_per_hour(connection)
 
@@ -1,70 +1,73 @@
 from utils.database import dbutils
-import json
-import requests
-import polyline
+from utils.routing import routers
+from utils.streaming import json_stream
 import cPickle as pickle
 import os
 
 
-def get_routes(location_pairs, routes_path, get_time=False):
+def get_routes(location_pairs, routes_path, get_time=False, router=None):
     """
-    Gets the driving route from Open Street Routing Machine for an array
-    of pairs of coordinates. Decodes the returned polyline routes into an
-    array or lat/lon tuples. Saves the resulting paths as a pickle.
+    Gets the route for an array of pairs of coordinates from a router, the
+    public Open Source Routing Machine server by default. Decodes the returned
+    polyline routes into an array or lat/lon tuples. Saves the resulting paths
+    as a pickle. Use a routers.LocalRouter to compute walking routes offline
+    from an OSM extract.
 
     Args:
         location_pairs (dictionary): The set of location pairs to query for
         routes_path (string): The file path for the routes pickle
         get_time (bool): whether or not to save the duration for route
+        router (routers.Router): the routing backend, an OSRMRouter for
+            driving routes if None
 
     Returns:
         array: The routes between all of the supplied pairs of locations
     """
 
-    # TODO: Change this to being walking directions. Use google maps routing.
+    if router is None:
+        router = routers.OSRMRouter()
 
     routes = {}
     if os.path.isfile(routes_path):
         routes = pickle.load(open(routes_path, 'rb'))
 
-    for location_pair_key in location_pairs:
-        if location_pair_key not in routes:
-            location = location_pairs[location_pair_key]
-            url = 'http://router.project-osrm.org/route/v1/driving/%s' % \
-                  location
-            response = requests.get(url)
-            route = response.json()['routes'][0]
-
-            if get_time:
-                routes[location_pair_key] = {
-                    'duration': route['duration'],
-                    'distance': route['distance']
-                }
-            else:
-                routes[location_pair_key] = polyline.decode(route['geometry'])
+    missing = {key: location for key, location in location_pairs.items()
+               if key not in routes}
+
+    for key, route in router.route_many(missing).items():
+        if get_time:
+            routes[key] = {
+                'duration': route['duration'],
+                'distance': route['distance']
+            }
+        else:
+            routes[key] = route['geometry']
 
     pickle.dump(routes, open(routes_path, 'wb'))
 
     return routes
 
 
-def get_tower_pairs(query):
+def get_tower_pairs(query, routes_path, router=None):
     """
     Gets the pairs of sequential towers that exist in a set of CDR records.
     Only adds transitions between towers that exist in one users records.
 
     Args:
         query (string): The POSTGRES query to retrieve the set of CDR records
+        routes_path (string): The file path for the routes pickle
+        router (routers.Router): the routing backend, see get_routes. Use a
+            routers.LocalRouter for offline walking routes
 
     Returns:
         array: The routes between all of the pairs of towers
     """
 
-    conn = dbutils.connect()
-    cursor = conn.cursor()
-
-    cursor.execute(query)
-    records = cursor.fetchall()
+    with dbutils.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        records = cursor.fetchall()
+        cursor.close()
 
     prev_user = None
     prev_tower = None
@@ -84,30 +87,31 @@ def get_tower_pairs(query):
         prev_lon = lon
         prev_lat = lat
 
-    return get_routes(tower_pairs)
+    return get_routes(tower_pairs, routes_path, router=router)
 
 
-def museum_main(routes_path):
+def museum_main(routes_path, router=None):
     """
     Calculates routes between every pair of museums that are visited in a row
 
     Args:
         routes_path (string): path for output museum routes pickle
+        router (routers.Router): the routing backend, see get_routes. Use a
+            routers.LocalRouter for walking routes
     """
 
-    # TODO: Finish this so that it creates paths. Need to complete walking
-    # directions implementation for routes first
-
-    conn = dbutils.connect()
-    cursor = conn.cursor()
+    # TODO: Finish this so that it creates paths.
 
     museum_location_query = """
         SELECT latitude, longitude, string 
         FROM optourism.firenze_card_locations;
     """
 
-    cursor.execute(museum_location_query)
-    records = cursor.fetchall()
+    with dbutils.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(museum_location_query)
+        records = cursor.fetchall()
+        cursor.close()
 
     museum_pairs = {}
 
@@ -125,49 +129,24 @@ def museum_main(routes_path):
                                                 end_lat)
             museum_pairs[key] = location
 
-    return get_routes(museum_pairs, routes_path, get_time=True)
+    return get_routes(museum_pairs, routes_path, get_time=True, router=router)
 
 
-def cdr_main(routes_path, output_path):
+def iter_trips(records, routes):
     """
-    Retrieves a set of CDR records for users with notable paths and
-    interpolates these paths with routes between their tower locations
-    equally spaced over the time gap.
-    Creates a JSON data file to feed into the deck.gl paths visualization.
+    Turns CDR records, ordered by user and time, into one trip per user with
+    the routes between their successive towers interpolated equally spaced
+    over the time gap. Trips are made one at a time as the records are read.
 
     Args:
-        routes_path (string): The file path for the routes pickle
-        output_path (string): The file path for the output json
-    """
-
-    conn = dbutils.connect()
-    cursor = conn.cursor()
+        records (iterable): (user, lon, lat, hour, minute, tower) tuples
+        routes (dict): the tower routes from get_routes by location pair key
 
-    routes_query = """
-        SELECT 
-          paths.cust_id, 
-          paths.lon, 
-          paths.lat, 
-          date_part('hour', paths.date_time_m) AS hour, 
-          date_part('minute', paths.date_time_m) AS minute,
-          paths.tower_id
-        FROM optourism.foreigners_path_records_joined AS paths
-          JOIN optourism.foreigners_features AS features
-          ON features.cust_id = paths.cust_id
-            AND (
-              date_part('day', paths.date_time_m) = 27 
-                OR 
-              date_part('day', paths.date_time_m) = 28
-            )
-            AND date_part('month', paths.date_time_m) = 7
-            AND features.days_active < 15
-        ORDER BY cust_id ASC, hour ASC, minute ASC; 
+    Yields:
+        dict: the trip of each user, with color, startTime, endTime and
+            segments of [lon, lat, time]
     """
 
-    cursor.execute(routes_query)
-    records = cursor.fetchall()
-    clean_records = []
-
     data = None
     prev_user = None
     prev_time = None
@@ -176,15 +155,12 @@ def cdr_main(routes_path, output_path):
     prev_lon = None
     id_counter = 0
 
-    routes = pickle.load(open(routes_path, 'rb'))
-
-    for index in range(len(records)):
-        user, lon, lat, hour, minute, tower = records[index]
+    for user, lon, lat, hour, minute, tower in records:
         timestamp = hour * 60 + minute
 
         if prev_user is not None and prev_user != user:
             data['endTime'] = prev_time
-            clean_records.append(data)
+            yield data
 
         if prev_user is None or prev_user != user:
             data = {
@@ -215,8 +191,59 @@ def cdr_main(routes_path, output_path):
         prev_lat = lat
         prev_lon = lon
 
-    with open(output_path, 'w') as outfile:
-        json.dump(clean_records, outfile)
+    if data is not None:
+        data['endTime'] = prev_time
+        yield data
+
+
+def cdr_main(routes_path, output_path, indent=None, compress=None):
+    """
+    Retrieves a set of CDR records for users with notable paths and
+    interpolates these paths with routes between their tower locations
+    equally spaced over the time gap.
+    Creates a JSON data file to feed into the deck.gl paths visualization.
+    The records are read through a server side cursor and each trip is
+    written as soon as it is complete, so memory does not grow with the
+    number of users.
+
+    Args:
+        routes_path (string): The file path for the routes pickle
+        output_path (string): The file path for the output json
+        indent (int): indentation of the output, compact if None
+        compress (bool): whether to gzip the output, only if the path ends
+            with .gz if None
+    """
+
+    routes_query = """
+        SELECT 
+          paths.cust_id, 
+          paths.lon, 
+          paths.lat, 
+          date_part('hour', paths.date_time_m) AS hour, 
+          date_part('minute', paths.date_time_m) AS minute,
+          paths.tower_id
+        FROM optourism.foreigners_path_records_joined AS paths
+          JOIN optourism.foreigners_features AS features
+          ON features.cust_id = paths.cust_id
+            AND (
+              date_part('day', paths.date_time_m) = 27 
+                OR 
+              date_part('day', paths.date_time_m) = 28
+            )
+            AND date_part('month', paths.date_time_m) = 7
+            AND features.days_active < 15
+        ORDER BY cust_id ASC, hour ASC, minute ASC; 
+    """
+
+    routes = pickle.load(open(routes_path, 'rb'))
+
+    with dbutils.connection() as conn:
+        cursor = conn.cursor(name='cdr_paths')
+        cursor.execute(routes_query)
+
+        json_stream.dump(iter_trips(cursor, routes), output_path,
+                         indent=indent, compress=compress)
+        cursor.close()
 
 
 if __name__ == '__main__':
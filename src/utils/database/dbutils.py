@@ -1,17 +1,35 @@
+import atexit
+import logging as log
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
 import psycopg2
+import psycopg2.pool
 import dbcreds
 
+# Maximum number of open connections in the shared pool
+POOL_MAX_SIZE = 8
 
-def connect():
+# Pooled connections idle for longer than this many seconds are pinged before
+# being handed out again
+HEALTH_CHECK_INTERVAL = 30
+
+connection_pool = None
+connection_pool_lock = threading.Lock()
+
+
+def get_config():
     """
-    Creates a connection to the Postgres database specified in the credentials
-    file dbcreds.py
+    Reads the connection parameters from the credentials file dbcreds.py
 
     Returns:
-        Psycopg.connection: The database connection
+        dict: keyword arguments for psycopg2.connect
     """
 
-    config = {
+    return {
         'database': dbcreds.database,
         'user': dbcreds.user,
         'password': dbcreds.password,
@@ -19,4 +37,299 @@ def connect():
         'port': dbcreds.port
     }
 
-    return psycopg2.connect(**config)
+
+def connect():
+    """
+    Creates a connection to the Postgres database specified in the credentials
+    file dbcreds.py. The caller owns the connection and must close it, use
+    connection() to borrow one from the shared pool instead.
+
+    Returns:
+        Psycopg.connection: The database connection
+    """
+
+    return psycopg2.connect(**get_config())
+
+
+def read_sql_copy(query, db_connection, dtypes=None, **kwargs):
+    """
+    Reads the result of a query with COPY ... TO STDOUT instead of fetching
+    rows through the cursor. The server streams the result as CSV through a
+    pipe straight into the pandas C parser, which skips the per row tuple
+    conversion of pd.read_sql and never holds a second copy of the data. The
+    same as running psql -c "copy (...) to STDOUT csv header" by hand.
+
+    Args:
+        query (string): the SELECT query, without a trailing semicolon
+        db_connection (Psycopg.connection): The database connection
+        dtypes (dict): column name to dtype hints. datetime64 columns are
+            parsed as dates, timedelta64 columns from Postgres intervals, bool
+            columns from the Postgres t and f, any other dtype (for example
+            'category' or 'int32') is passed to the CSV parser
+        kwargs: any other arguments for pd.read_csv
+
+    Returns:
+        Pandas.DataFrame: the query result, with NULLs converted from the
+            Postgres CSV format. Boolean columns without a bool hint are left
+            as the strings t and f. Bool columns with NULLs keep the object
+            dtype, with True, False and NaN values
+    """
+
+    parse_dates = []
+    timedeltas = []
+    booleans = []
+    csv_dtypes = {}
+
+    for column, dtype in (dtypes or {}).items():
+        if str(dtype).startswith('datetime64'):
+            parse_dates.append(column)
+        elif str(dtype).startswith('timedelta64'):
+            timedeltas.append(column)
+        elif str(dtype) == 'bool' or dtype is bool:
+            booleans.append(column)
+            csv_dtypes[column] = str
+        else:
+            csv_dtypes[column] = dtype
+
+    copy_query = 'COPY (%s) TO STDOUT WITH CSV HEADER' % \
+                 query.strip().rstrip(';')
+
+    read_fd, write_fd = os.pipe()
+    errors = []
+    cursor = db_connection.cursor()
+
+    def copy():
+        try:
+            with os.fdopen(write_fd, 'wb') as sink:
+                cursor.copy_expert(copy_query, sink)
+        except Exception as error:
+            errors.append(error)
+
+    writer = threading.Thread(target=copy)
+    writer.start()
+
+    try:
+        with os.fdopen(read_fd, 'rb') as source:
+            df = pd.read_csv(source, dtype=csv_dtypes or None,
+                             parse_dates=parse_dates or False, **kwargs)
+    except Exception as error:
+        writer.join()
+
+        # Closing the pipe also makes the COPY fail, raise the reader's error
+        # and keep the writer's one on it rather than hiding one behind the
+        # other
+        if errors:
+            error.copy_error = errors[0]
+            log.warning('COPY failed after the CSV reader failed: %s',
+                        errors[0])
+        raise
+    finally:
+        writer.join()
+        cursor.close()
+
+    # A failed COPY ends the stream early, which can still parse, report the
+    # database error
+    if errors:
+        raise errors[0]
+
+    for column in timedeltas:
+        df[column] = pd.to_timedelta(df[column])
+
+    for column in booleans:
+        df[column] = df[column].map({'t': True, 'f': False})
+
+        if df[column].notnull().all():
+            df[column] = df[column].astype(bool)
+
+    return df
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of database connections. At most max_size connections are
+    open at once, acquire blocks until one is free. Connections that were idle
+    for a while are checked before being reused and replaced if they are dead.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, min_size=0,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, **config):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size,
+                                                         **config)
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.health_check_interval = health_check_interval
+        self.released_at = {}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, conn):
+        """
+        Checks that a pooled connection can still be used.
+
+        Args:
+            conn (Psycopg.connection): the connection to check
+
+        Returns:
+            bool: False if the connection is closed or fails a ping
+        """
+
+        if conn.closed:
+            return False
+
+        with self.lock:
+            released_at = self.released_at.get(id(conn))
+
+        if released_at is not None and \
+                time.time() - released_at < self.health_check_interval:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def acquire(self, timeout=None):
+        """
+        Borrows a connection from the pool, waiting for one to be released if
+        all of them are in use.
+
+        Args:
+            timeout (float): seconds to wait for a free connection, forever if
+                None
+
+        Returns:
+            Psycopg.connection: a healthy connection, to be given back with
+                release
+        """
+
+        if timeout is None:
+            acquired = self.slots.acquire()
+        else:
+            acquired = self.slots.acquire(timeout=timeout)
+
+        if not acquired:
+            raise psycopg2.pool.PoolError('no free connection after %ss'
+                                          % timeout)
+
+        try:
+            conn = self.pool.getconn()
+
+            if not self.is_healthy(conn):
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+
+        except Exception:
+            self.slots.release()
+            raise
+
+        return conn
+
+    def release(self, conn, close=False):
+        """
+        Gives a borrowed connection back to the pool. Any transaction that was
+        not committed is rolled back.
+
+        Args:
+            conn (Psycopg.connection): the connection from acquire
+            close (bool): whether to close the connection instead of keeping it
+        """
+
+        try:
+            with self.lock:
+                if close or conn.closed:
+                    self.released_at.pop(id(conn), None)
+                else:
+                    self.released_at[id(conn)] = time.time()
+
+            self.pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that borrows a connection for the duration of a with
+        block. If the block raises a database error the connection is closed
+        rather than reused.
+
+        Args:
+            timeout (float): seconds to wait for a free connection
+
+        Yields:
+            Psycopg.connection: the borrowed connection
+        """
+
+        conn = self.acquire(timeout=timeout)
+        broken = False
+
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, close=broken)
+
+    def close(self):
+        """
+        Closes every connection in the pool.
+        """
+
+        self.pool.closeall()
+
+
+def get_pool(max_size=POOL_MAX_SIZE):
+    """
+    Gets the connection pool shared by all modules, creating it on first use.
+
+    Args:
+        max_size (int): the pool size, only used when the pool is created
+
+    Returns:
+        ConnectionPool: the shared pool
+    """
+
+    global connection_pool
+
+    with connection_pool_lock:
+        if connection_pool is None:
+            connection_pool = ConnectionPool(max_size=max_size, **get_config())
+
+    return connection_pool
+
+
+@contextmanager
+def connection(timeout=None):
+    """
+    Borrows a connection from the shared pool for a with block:
+
+        with dbutils.connection() as conn:
+            df = pd.read_sql(query, con=conn)
+
+    Args:
+        timeout (float): seconds to wait for a free connection
+
+    Yields:
+        Psycopg.connection: the borrowed connection
+    """
+
+    with get_pool().connection(timeout=timeout) as conn:
+        yield conn
+
+
+@atexit.register
+def close_pool():
+    """
+    Closes the shared pool, called when the interpreter exits.
+    """
+
+    global connection_pool
+
+    with connection_pool_lock:
+        if connection_pool is not None and not connection_pool.pool.closed:
+            connection_pool.close()
+
+        connection_pool = None
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Where cached query results are stored and how much disk they may use, both
+# can be overridden from the environment. The default is the cache directory
+# at the root of the repository, outside of the source tree
+CACHE_DIR = os.environ.get(
+    'OPTOURISM_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+                 'cache', 'query_cache'))
+
+CACHE_MAX_BYTES = int(os.environ.get('OPTOURISM_CACHE_MAX_BYTES',
+                                     5 * 1024 ** 3))
+
+CACHE_EXTENSION = '.parquet'
+
+# Kinds of relation whose contents the markers follow: ordinary tables and
+# materialized views. Plain views are replaced by the relations they read
+TRACKED_RELKINDS = ('r', 'm')
+VIEW_RELKIND = 'v'
+
+
+def get_table_markers(db_connection, source_tables):
+    """
+    Gets a marker of the current contents of each source table. The marker is
+    the kind and the file node of the relation, which changes when a table is
+    rewritten or a materialized view is refreshed, and the insert, update and
+    delete counters from the statistics collector. Plain views have no storage
+    of their own, so they are replaced by the relations they select from,
+    recursively.
+
+    Args:
+        db_connection (Psycopg.connection): The database connection
+        source_tables (list): names of the tables the query reads from
+
+    Returns:
+        list: one [table, relkind, filenode, inserts, updates, deletes] list
+            per table, None if one of the relations does not exist or its
+            changes cannot be followed, such as a foreign table
+    """
+
+    query = """
+        SELECT c.relkind,
+          c.relfilenode,
+          COALESCE(s.n_tup_ins, 0),
+          COALESCE(s.n_tup_upd, 0),
+          COALESCE(s.n_tup_del, 0)
+        FROM pg_class AS c
+          LEFT JOIN pg_stat_all_tables AS s ON s.relid = c.oid
+        WHERE c.oid = to_regclass(%s)
+    """
+
+    view_query = """
+        SELECT DISTINCT d.refobjid::regclass::text
+        FROM pg_rewrite AS r
+          JOIN pg_depend AS d
+          ON d.classid = 'pg_rewrite'::regclass
+            AND d.objid = r.oid
+            AND d.refclassid = 'pg_class'::regclass
+            AND d.refobjid <> r.ev_class
+        WHERE r.ev_class = to_regclass(%s)
+    """
+
+    markers = []
+    pending = sorted(set(source_tables))
+    seen = set(pending)
+    cursor = db_connection.cursor()
+
+    try:
+        while pending:
+            table = pending.pop(0)
+            cursor.execute(query, (table,))
+            row = cursor.fetchone()
+
+            if row is None:
+                return None
+
+            relkind = row[0]
+            if relkind == VIEW_RELKIND:
+                cursor.execute(view_query, (table,))
+                for (base_table,) in cursor.fetchall():
+                    if base_table not in seen:
+                        seen.add(base_table)
+                        pending.append(base_table)
+
+            elif relkind not in TRACKED_RELKINDS:
+                return None
+
+            markers.append([table, relkind] + [int(v) for v in row[1:]])
+    finally:
+        cursor.close()
+
+    return sorted(markers)
+
+
+def get_cache_key(query, markers, dtypes=None):
+    """
+    Hashes a query together with the markers of its source tables and the
+    requested column types.
+
+    Args:
+        query (string): the SQL query
+        markers (list): the source table markers from get_table_markers
+        dtypes (dict): the column type hints for the result
+
+    Returns:
+        string: the hex digest identifying the cached result
+    """
+
+    payload = json.dumps([' '.join(query.split()), markers,
+                          sorted((dtypes or {}).items())])
+
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def compact_dtypes(df, dtypes=None):
+    """
+    Converts the columns of a query result to compact types. Integer id
+    columns (named id or ending in _id) are stored as int32 when their values
+    fit, and the type hints are applied on top, for example 'category' for
+    repeated strings or 'datetime64[ns]' for timestamps returned as text.
+
+    Args:
+        df (Pandas.DataFrame): the query result, converted in place
+        dtypes (dict): column name to dtype hints
+
+    Returns:
+        Pandas.DataFrame: the converted DataFrame
+    """
+
+    int32 = np.iinfo(np.int32)
+
+    for column in df.columns:
+        is_id = column == 'id' or str(column).endswith('_id')
+
+        if is_id and df[column].dtype.kind in 'iu' and len(df) > 0 and \
+                int32.min <= df[column].min() and \
+                df[column].max() <= int32.max:
+            df[column] = df[column].astype(np.int32)
+
+    for column, dtype in (dtypes or {}).items():
+        if column not in df.columns:
+            continue
+
+        if str(dtype).startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column])
+        elif str(dtype).startswith('timedelta64'):
+            df[column] = pd.to_timedelta(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+
+    return df
+
+
+def evict(cache_dir=None, max_bytes=None, keep=None):
+    """
+    Deletes the least recently used cached results until the cache fits in
+    max_bytes. A result is used when it is written or read.
+
+    Args:
+        cache_dir (string): the cache directory
+        max_bytes (int): the maximum total size of the cache
+        keep (string): path of a file that must not be deleted
+    """
+
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(CACHE_EXTENSION):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+
+        if path == keep:
+            continue
+
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def read_sql_cached(query, db_connection, source_tables, dtypes=None,
+                    use_cache=True, cache_dir=None, max_bytes=None,
+                    reader=None):
+    """
+    Runs a query through the local result cache. Results are stored as Parquet
+    files keyed by the query text and the current markers of its source
+    tables, so a cached result is reused until one of the tables changes.
+    Queries reading from a relation that get_table_markers cannot follow are
+    run without the cache.
+
+    Args:
+        query (string): the SQL query
+        db_connection (Psycopg.connection): The database connection
+        source_tables (list): names of the tables the query reads from
+        dtypes (dict): column type hints, see compact_dtypes
+        use_cache (bool): whether to use the cache at all
+        cache_dir (string): the cache directory, CACHE_DIR by default
+        max_bytes (int): the cache size limit, CACHE_MAX_BYTES by default
+        reader (function): function of (query, db_connection, dtypes)
+            returning a DataFrame on a cache miss, pd.read_sql by default.
+            Pass dbutils.read_sql_copy for large tables
+
+    Returns:
+        Pandas.DataFrame: the query result
+    """
+
+    if reader is None:
+        reader = lambda q, con, dtypes: pd.read_sql(q, con=con)
+
+    if not use_cache:
+        return compact_dtypes(reader(query, db_connection, dtypes), dtypes)
+
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    markers = get_table_markers(db_connection, source_tables)
+
+    # Results of relations whose changes cannot be followed are never cached
+    if markers is None:
+        return compact_dtypes(reader(query, db_connection, dtypes), dtypes)
+
+    key = get_cache_key(query, markers, dtypes)
+    path = os.path.join(cache_dir, key + CACHE_EXTENSION)
+
+    if os.path.isfile(path):
+        df = pd.read_parquet(path)
+        os.utime(path, None)
+        return df
+
+    df = compact_dtypes(reader(query, db_connection, dtypes), dtypes)
+
+    # Write to a temporary name first so concurrent runs never read a
+    # partially written file
+    tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    df.to_parquet(tmp_path, index=False)
+    os.rename(tmp_path, path)
+
+    evict(cache_dir, max_bytes, keep=path)
+
+    return df
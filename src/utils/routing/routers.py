@@ -0,0 +1,499 @@
+import bz2
+import gzip
+import heapq
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import polyline
+import requests
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+from scipy.spatial import cKDTree
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+# Walking speed in meters per second used for the duration of local routes
+WALKING_SPEED = 1.4
+
+# Highway types that cannot be walked on, any other highway way can be
+NON_WALKABLE_HIGHWAYS = {
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'construction',
+    'proposed', 'raceway', 'bus_guideway', 'abandoned', 'platform'
+}
+
+# Values of the foot and access tags that forbid walking on a way
+NO_ACCESS = {'no', 'private'}
+
+# Shortest edge length in meters, so that repeated points are still edges
+MIN_EDGE_LENGTH = 1e-3
+
+
+def parse_location_pair(location):
+    """
+    Parses a location pair in the OSRM format used for the route keys.
+
+    Args:
+        location (string): 'start_lon,start_lat;end_lon,end_lat'
+
+    Returns:
+        tuple: the (lon, lat) start and end points as floats
+    """
+
+    start, end = location.split(';')
+
+    return (tuple(float(x) for x in start.split(',')),
+            tuple(float(x) for x in end.split(',')))
+
+
+def get_haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Computes great circle distances between points, element-wise.
+
+    Args:
+        lat1 (numpy.ndarray): latitudes of the first points in degrees
+        lon1 (numpy.ndarray): longitudes of the first points in degrees
+        lat2 (numpy.ndarray): latitudes of the second points in degrees
+        lon2 (numpy.ndarray): longitudes of the second points in degrees
+
+    Returns:
+        numpy.ndarray: the distances in meters
+    """
+
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class Router(object):
+    """
+    Interface of the routing backends used by paths_deck_gl.get_routes. A
+    route is a dict with the geometry as a list of (lat, lon) points, the
+    distance in meters and the duration in seconds, like an OSRM route with
+    its polyline decoded. Backends implement route and may override
+    route_many to compute many routes at once.
+    """
+
+    def route(self, start, end):
+        """
+        Args:
+            start (tuple): the (lon, lat) start point
+            end (tuple): the (lon, lat) end point
+
+        Returns:
+            dict: the route, None if there is none
+        """
+
+        raise NotImplementedError
+
+    def route_many(self, location_pairs):
+        """
+        Args:
+            location_pairs (dict): location pair strings, see
+                parse_location_pair, by route key
+
+        Returns:
+            dict: the route of each key that has one
+        """
+
+        routes = {}
+
+        for key, location in location_pairs.items():
+            route = self.route(*parse_location_pair(location))
+
+            if route is not None:
+                routes[key] = route
+
+        return routes
+
+
+class OSRMRouter(Router):
+    """
+    Routes with the HTTP API of an Open Source Routing Machine server, one
+    request per route.
+    """
+
+    def __init__(self, url='http://router.project-osrm.org',
+                 profile='driving'):
+        self.url = url.rstrip('/')
+        self.profile = profile
+
+    def route(self, start, end):
+        url = '%s/route/v1/%s/%s,%s;%s,%s' % ((self.url, self.profile) +
+                                              start + end)
+        response = requests.get(url)
+        routes = response.json().get('routes')
+
+        if not routes:
+            return None
+
+        return {
+            'geometry': polyline.decode(routes[0]['geometry']),
+            'distance': routes[0]['distance'],
+            'duration': routes[0]['duration']
+        }
+
+
+def open_osm_file(path):
+    """
+    Opens an OSM XML extract, decompressing .bz2 and .gz files.
+
+    Args:
+        path (string): file path of the extract
+
+    Returns:
+        file: the binary file object
+    """
+
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+
+    return open(path, 'rb')
+
+
+def is_walkable(tags):
+    """
+    Args:
+        tags (dict): the tags of an OSM way
+
+    Returns:
+        bool: whether the way is a road or path people can walk on
+    """
+
+    if 'highway' not in tags or tags['highway'] in NON_WALKABLE_HIGHWAYS:
+        return False
+
+    if tags.get('foot') in NO_ACCESS:
+        return False
+
+    return tags.get('access') not in NO_ACCESS or tags.get('foot') == 'yes'
+
+
+def read_osm_walking_graph(path):
+    """
+    Reads the walkable ways of an OSM XML extract as a graph, streaming the
+    file so that elements are dropped once read. Ways can be walked in both
+    directions whatever their oneway tag.
+
+    Args:
+        path (string): file path of the .osm, .osm.bz2 or .osm.gz extract
+
+    Returns:
+        tuple: the lat and lon arrays of the graph nodes and the source,
+            target and length in meters arrays of the edges, each edge
+            listed in both directions
+    """
+
+    node_ids = []
+    lats = []
+    lons = []
+    way_sources = []
+    way_targets = []
+    refs = []
+    tags = {}
+
+    with open_osm_file(path) as osm_file:
+        for _, element in ElementTree.iterparse(osm_file):
+            if element.tag == 'node':
+                node_ids.append(int(element.get('id')))
+                lats.append(float(element.get('lat')))
+                lons.append(float(element.get('lon')))
+                tags = {}
+                element.clear()
+
+            elif element.tag == 'nd':
+                refs.append(int(element.get('ref')))
+
+            elif element.tag == 'tag':
+                tags[element.get('k')] = element.get('v')
+
+            elif element.tag in ('way', 'relation'):
+                if element.tag == 'way' and is_walkable(tags):
+                    way_sources.extend(refs[:-1])
+                    way_targets.extend(refs[1:])
+
+                refs = []
+                tags = {}
+                element.clear()
+
+    node_ids = np.array(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids)
+    node_ids = node_ids[order]
+
+    ends = np.array(way_sources + way_targets, dtype=np.int64)
+    positions = np.searchsorted(node_ids, ends)
+
+    # Ways in a clipped extract can refer to nodes outside of it
+    known = positions < len(node_ids)
+    known[known] = node_ids[positions[known]] == ends[known]
+
+    n_edges = len(way_sources)
+    known = known[:n_edges] & known[n_edges:]
+    sources = order[positions[:n_edges][known]]
+    targets = order[positions[n_edges:][known]]
+
+    used, codes = np.unique(np.concatenate([sources, targets]),
+                            return_inverse=True)
+    sources, targets = codes[:len(sources)], codes[len(sources):]
+    lats = np.array(lats)[used]
+    lons = np.array(lons)[used]
+
+    lengths = np.maximum(get_haversine_distance(
+        lats[sources], lons[sources], lats[targets], lons[targets]),
+        MIN_EDGE_LENGTH)
+
+    return (lats, lons, np.concatenate([sources, targets]),
+            np.concatenate([targets, sources]),
+            np.concatenate([lengths, lengths]))
+
+
+class LocalRouter(Router):
+    """
+    Offline walking routes on the road graph of a local OSM extract. Start
+    and end points are snapped to the nearest graph node with a KD-tree. The
+    graph is stored as a CSR matrix, keeping the shortest of any parallel
+    edges.
+
+    Routing uses ALT landmarks: the distances from a few landmarks spread
+    over the graph are computed once, and the triangle inequality then gives
+    both a lower bound on the distance between two nodes, the heuristic of
+    the A* search of route, and an upper bound, the limit beyond which the
+    Dijkstra searches of route_many stop. route_many runs one search per
+    distinct start node and reads all its routes off the predecessors.
+    """
+
+    def __init__(self, osm_path, n_landmarks=8, speed=WALKING_SPEED):
+        self.speed = speed
+        self.lats, self.lons, sources, targets, lengths = \
+            read_osm_walking_graph(osm_path)
+
+        n_nodes = len(self.lats)
+        if n_nodes == 0:
+            raise ValueError('No walkable ways in %s' % osm_path)
+
+        # Keep the shortest of the parallel edges, csr_matrix would sum them
+        order = np.lexsort((lengths, targets, sources))
+        sources, targets, lengths = (sources[order], targets[order],
+                                     lengths[order])
+        first = np.ones(len(sources), dtype=bool)
+        first[1:] = (sources[1:] != sources[:-1]) | \
+            (targets[1:] != targets[:-1])
+
+        self.graph = sp.csr_matrix(
+            (lengths[first], (sources[first], targets[first])),
+            shape=(n_nodes, n_nodes))
+
+        # Equirectangular projection in meters around the extract, accurate
+        # enough at city scale to find the nearest node
+        self.scale = np.cos(np.radians(self.lats.mean()))
+        self.tree = cKDTree(self.project(self.lats, self.lons))
+
+        self.landmarks, self.landmark_distances = \
+            self.select_landmarks(n_landmarks)
+
+    def project(self, lats, lons):
+        """
+        Args:
+            lats (numpy.ndarray): latitudes in degrees
+            lons (numpy.ndarray): longitudes in degrees
+
+        Returns:
+            numpy.ndarray: (points x 2) projected coordinates in meters
+        """
+
+        return EARTH_RADIUS * np.radians(np.column_stack(
+            [np.asarray(lons) * self.scale, np.asarray(lats)]))
+
+    def select_landmarks(self, n_landmarks):
+        """
+        Picks landmarks by farthest point selection: each new landmark is the
+        node farthest from the landmarks so far, within the same connected
+        component.
+
+        Args:
+            n_landmarks (int): number of landmarks
+
+        Returns:
+            tuple: the landmark nodes and the (landmarks x nodes) array of
+                distances from them
+        """
+
+        landmarks = [int(np.argmax(self.lats))]
+        distances = [csgraph.dijkstra(self.graph, indices=landmarks[0])]
+
+        while len(landmarks) < min(n_landmarks, len(self.lats)):
+            nearest = np.min(distances, axis=0)
+            nearest[~np.isfinite(nearest)] = -1
+
+            if nearest.max() <= 0:
+                break
+
+            landmarks.append(int(np.argmax(nearest)))
+            distances.append(csgraph.dijkstra(self.graph,
+                                              indices=landmarks[-1]))
+
+        return np.array(landmarks), np.array(distances)
+
+    def snap(self, points):
+        """
+        Args:
+            points (list): (lon, lat) points
+
+        Returns:
+            numpy.ndarray: the nearest graph node of each point
+        """
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+        return self.tree.query(self.project(points[:, 1], points[:, 0]))[1]
+
+    def get_bounds(self, source, targets):
+        """
+        Bounds the network distances from a node with the landmark distances.
+
+        Args:
+            source (int): the start node
+            targets (numpy.ndarray): the end nodes
+
+        Returns:
+            tuple: lower and upper bound arrays, 0 and inf where the
+                landmarks do not reach both nodes
+        """
+
+        from_source = self.landmark_distances[:, source][:, None]
+        to_targets = self.landmark_distances[:, targets]
+        reached = np.isfinite(from_source) & np.isfinite(to_targets)
+
+        with np.errstate(invalid='ignore'):
+            lower = np.where(reached, np.abs(from_source - to_targets), 0)
+            upper = np.where(reached, from_source + to_targets, np.inf)
+
+        return lower.max(axis=0), upper.min(axis=0)
+
+    def make_route(self, path, distance):
+        """
+        Args:
+            path (list): graph nodes from start to end
+            distance (float): length of the path in meters
+
+        Returns:
+            dict: the route, see Router
+        """
+
+        return {
+            'geometry': list(zip(self.lats[path].tolist(),
+                                 self.lons[path].tolist())),
+            'distance': float(distance),
+            'duration': float(distance) / self.speed
+        }
+
+    def route(self, start, end):
+        """
+        A* search of the shortest walk between two points with the landmark
+        lower bounds as heuristic.
+        """
+
+        source, target = self.snap([start, end])
+        indptr, indices, data = (self.graph.indptr, self.graph.indices,
+                                 self.graph.data)
+
+        # Walks are symmetric, so the bounds from the target to every node
+        # are the bounds from every node to the target
+        heuristic = self.get_bounds(target, np.arange(len(self.lats)))[0]
+
+        distances = {source: 0.0}
+        previous = {source: None}
+        queue = [(heuristic[source], source)]
+        done = set()
+
+        while queue:
+            _, node = heapq.heappop(queue)
+
+            if node == target:
+                break
+
+            if node in done:
+                continue
+            done.add(node)
+
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[k]
+                distance = distances[node] + data[k]
+
+                if distance < distances.get(neighbor, np.inf):
+                    distances[neighbor] = distance
+                    previous[neighbor] = node
+                    heapq.heappush(queue,
+                                   (distance + heuristic[neighbor], neighbor))
+
+        if target not in distances:
+            return None
+
+        return self.make_route(self.unwind(previous, target),
+                               distances[target])
+
+    def unwind(self, previous, target):
+        """
+        Args:
+            previous (dict or numpy.ndarray): the predecessor of each reached
+                node, None or negative at the start
+            target (int): the end node
+
+        Returns:
+            list: the nodes from the start to the target
+        """
+
+        path = [target]
+        node = previous[target]
+
+        while node is not None and node >= 0:
+            path.append(node)
+            node = previous[node]
+
+        return path[::-1]
+
+    def route_many(self, location_pairs):
+        """
+        Computes all the routes with one Dijkstra search per distinct start
+        node, stopped at the largest landmark upper bound of its end nodes.
+        """
+
+        keys = list(location_pairs)
+        starts, ends = [], []
+
+        for key in keys:
+            start, end = parse_location_pair(location_pairs[key])
+            starts.append(start)
+            ends.append(end)
+
+        if not keys:
+            return {}
+
+        sources = self.snap(starts)
+        targets = self.snap(ends)
+        routes = {}
+
+        for source in np.unique(sources):
+            pairs = np.flatnonzero(sources == source)
+            # A little slack, as the bound can equal the route length up to
+            # rounding when a landmark lies on the route
+            limit = self.get_bounds(source, targets[pairs])[1].max() * \
+                (1 + 1e-9)
+
+            distances, previous = csgraph.dijkstra(
+                self.graph, indices=source, return_predecessors=True,
+                limit=limit)
+
+            for pair in pairs:
+                target = targets[pair]
+
+                if np.isfinite(distances[target]):
+                    routes[keys[pair]] = self.make_route(
+                        self.unwind(previous, target), distances[target])
+
+        return routes
@@ -0,0 +1,156 @@
+import gzip
+import json
+import numbers
+
+# Number of encoded characters gathered before each write to the output
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def is_stream(value):
+    """
+    Checks whether a value is an iterator, such as a generator, whose items
+    should be written as a JSON array as they are produced.
+
+    Args:
+        value: any value
+
+    Returns:
+        bool: True for iterators, False for lists, dicts, strings and scalars
+    """
+
+    return hasattr(value, '__iter__') and iter(value) is value
+
+
+def format_key(key):
+    """
+    Converts a dict key to the string the json module writes for it: strings
+    as they are, True, False and None as true, false and null, and numbers,
+    such as integer tower or museum ids, as their text.
+
+    Args:
+        key: the dict key
+
+    Returns:
+        string: the key as a string
+    """
+
+    if isinstance(key, str):
+        return key
+
+    if key is True or key is False or key is None:
+        return json.dumps(key)
+
+    if isinstance(key, numbers.Integral):
+        return str(int(key))
+
+    if isinstance(key, numbers.Real):
+        return json.dumps(float(key))
+
+    raise TypeError('keys must be str, int, float, bool or None, not %s'
+                    % type(key).__name__)
+
+
+def open_output(path, compress=None):
+    """
+    Opens a file for writing encoded JSON, gzipped if asked for or if the path
+    ends with .gz
+
+    Args:
+        path (string): the output file path
+        compress (bool): whether to gzip the output, from the path if None
+
+    Returns:
+        file: the binary file object
+    """
+
+    if compress is None:
+        compress = path.endswith('.gz')
+
+    if compress:
+        return gzip.open(path, 'wb')
+
+    return open(path, 'wb')
+
+
+def iter_json(value, indent=None, level=0):
+    """
+    Encodes a value as JSON piece by piece. Iterators anywhere in the value,
+    either at the top or as values of dicts, are encoded as arrays one item at
+    a time, so the output of a generator is never held in memory. Any other
+    value is encoded with the json module.
+
+    Args:
+        value: the value to encode
+        indent (int): number of spaces per indentation level, compact output
+            if None
+        level (int): the indentation level of the value
+
+    Yields:
+        string: successive pieces of the JSON text
+    """
+
+    if indent is None:
+        encoder = json.JSONEncoder(separators=(',', ':'))
+        newline = ''
+    else:
+        encoder = json.JSONEncoder(indent=indent, separators=(',', ': '))
+        newline = '\n' + ' ' * indent * level
+
+    inner = newline + ' ' * (indent or 0)
+
+    if is_stream(value):
+        items = ((None, item) for item in value)
+        brackets = '[]'
+    elif isinstance(value, dict) and any(is_stream(item)
+                                         for item in value.values()):
+        items = value.items()
+        brackets = '{}'
+    else:
+        encoded = encoder.encode(value)
+        yield encoded if indent is None else encoded.replace('\n', newline)
+        return
+
+    yield brackets[0]
+
+    empty = True
+    for key, item in items:
+        yield inner if empty else ',' + inner
+        empty = False
+
+        if brackets == '{}':
+            yield encoder.encode(format_key(key)) + encoder.key_separator
+
+        for piece in iter_json(item, indent, level + 1):
+            yield piece
+
+    yield brackets[1] if empty else newline + brackets[1]
+
+
+def dump(value, path, indent=None, compress=None):
+    """
+    Writes a value as JSON to a file while it is being encoded, see iter_json.
+    Peak memory depends on the largest item of the iterators in the value
+    rather than on the size of the whole output.
+
+    Args:
+        value: the value to write
+        path (string): the output file path
+        indent (int): number of spaces per indentation level, compact output
+            if None
+        compress (bool): whether to gzip the output, from the path if None
+    """
+
+    with open_output(path, compress) as outfile:
+        chunk = []
+        chunk_length = 0
+
+        for piece in iter_json(value, indent):
+            chunk.append(piece)
+            chunk_length += len(piece)
+
+            if chunk_length >= WRITE_CHUNK_SIZE:
+                outfile.write(''.join(chunk).encode('utf-8'))
+                chunk = []
+                chunk_length = 0
+
+        outfile.write(''.join(chunk).encode('utf-8'))
@@ -0,0 +1,132 @@
+// Loader for the binary fountain files written by
+// fountain_deck_gl.write_binary_fountain. The buffers are typed array views
+// over the downloaded ArrayBuffer, nothing is copied.
+
+const MAGIC = 'FNTN';
+const VERSION = 1;
+
+// Buffers that describe the nodes, flows and polygons, any other buffer is a
+// numeric node property such as density
+const LAYOUT_BUFFERS = [
+  'lon', 'lat', 'to', 'from', 'weight', 'percTo', 'percFrom', 'inOffsets',
+  'outEdges', 'outOffsets', 'nodeRings', 'ringOffsets', 'coordinates'
+];
+
+const ARRAY_TYPES = {
+  Float32Array: Float32Array,
+  Uint32Array: Uint32Array
+};
+
+function isLittleEndian() {
+  return new Uint8Array(new Uint32Array([1]).buffer)[0] === 1;
+}
+
+export function parseBinaryFountain(arrayBuffer) {
+  const magic = String.fromCharCode.apply(null, new Uint8Array(arrayBuffer, 0, 4));
+  if (magic !== MAGIC) {
+    throw new Error('Not a binary fountain file');
+  }
+
+  const view = new DataView(arrayBuffer);
+  const version = view.getUint32(4, true);
+  const headerLength = view.getUint32(8, true);
+
+  if (version !== VERSION) {
+    throw new Error('Unsupported binary fountain version ' + version);
+  }
+
+  // Typed arrays use the byte order of the platform
+  if (!isLittleEndian()) {
+    throw new Error('Binary fountains need a little-endian platform');
+  }
+
+  const headerBytes = new Uint8Array(arrayBuffer, 12, headerLength);
+  const header = JSON.parse(new TextDecoder('utf-8').decode(headerBytes));
+  const dataStart = 12 + headerLength;
+
+  const buffers = {};
+  header.buffers.forEach(buffer => {
+    const ArrayType = ARRAY_TYPES[buffer.type];
+    buffers[buffer.name] = new ArrayType(arrayBuffer,
+      dataStart + buffer.byteOffset, buffer.length);
+  });
+
+  return {header, buffers};
+}
+
+export function loadBinaryFountain(url) {
+  return fetch(url)
+    .then(response => response.arrayBuffer())
+    .then(parseBinaryFountain);
+}
+
+function getPolygon(buffers, node) {
+  const {nodeRings, ringOffsets, coordinates} = buffers;
+  const rings = [];
+
+  for (let ring = nodeRings[node]; ring < nodeRings[node + 1]; ring++) {
+    const points = [];
+    for (let k = ringOffsets[ring]; k < ringOffsets[ring + 1]; k++) {
+      points.push([coordinates[2 * k], coordinates[2 * k + 1]]);
+    }
+    rings.push(points);
+  }
+
+  return {type: 'Polygon', coordinates: rings};
+}
+
+// Builds the same features as the GeoJSON fountain, so the existing
+// components can draw a binary fountain
+export function getFountainFeatures(fountain) {
+  const {header, buffers} = fountain;
+  const {ids, names, fullNames} = header;
+  const propertyBuffers = header.buffers.map(buffer => buffer.name)
+    .filter(name => LAYOUT_BUFFERS.indexOf(name) < 0);
+
+  const features = [];
+
+  for (let node = 0; node < header.featureCount; node++) {
+    const inFlows = {};
+    for (let edge = buffers.inOffsets[node]; edge < buffers.inOffsets[node + 1]; edge++) {
+      inFlows[ids[buffers.from[edge]]] = {
+        weight: buffers.weight[edge],
+        percentage: buffers.percTo[edge]
+      };
+    }
+
+    const outFlows = {};
+    for (let k = buffers.outOffsets[node]; k < buffers.outOffsets[node + 1]; k++) {
+      const edge = buffers.outEdges[k];
+      outFlows[ids[buffers.to[edge]]] = {
+        weight: buffers.weight[edge],
+        percentage: buffers.percFrom[edge]
+      };
+    }
+
+    const properties = {
+      id: ids[node],
+      name: names[node],
+      fullName: fullNames[node],
+      centroid: [buffers.lon[node], buffers.lat[node]],
+      inFlows,
+      outFlows
+    };
+
+    propertyBuffers.forEach(name => {
+      const value = buffers[name][node];
+      properties[name] = isNaN(value) ? null : value;
+    });
+
+    Object.keys(header.properties).forEach(name => {
+      properties[name] = header.properties[name][node];
+    });
+
+    features.push({
+      type: 'Feature',
+      geometry: getPolygon(buffers, node),
+      properties
+    });
+  }
+
+  return features;
+}